@@ -0,0 +1,193 @@
+"""
+Benchmarks for the game's subsystems, run on headless games.
+
+For every combination of map size and entity count a headless game is
+played on a generated maze for a number of frames with a random scripted player, timing each
+subsystem separately. The results are written as JSON so that runs can be
+compared with each other.
+
+Usage: python benchmark.py [--sizes 32 256] [--entities 20 2000] [--frames 300]
+                           [--seed 0] [--output benchmark.json]
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import platform
+import time
+import numpy as np
+import pygame
+from main import GameApplication, Simulation, MAP, FPS, TICKS_PER_SECOND
+from mapgen import cached_maze
+
+CORRIDOR_WIDTH = 4  # corridor width of benchmark mazes, which keeps (6, 6) free
+FLOOR_SHARE = (CORRIDOR_WIDTH / (CORRIDOR_WIDTH + 1)) ** 2  # about the share of floor tiles
+ARROW_KEYS = (pygame.K_UP, pygame.K_DOWN, pygame.K_LEFT, pygame.K_RIGHT)
+
+
+def make_map(size: int, seed: int) -> np.ndarray:
+    """
+    Returns a size x size maze, which is cached on disk between runs. The
+    default map is used for sizes matching its width, though it is a few
+    rows shorter.
+    """
+    if size == len(MAP[0]):
+        return np.array(MAP, dtype=np.uint8)
+    return cached_maze(size, size, CORRIDOR_WIDTH, seed)
+
+
+def summarize(samples: list[float]) -> dict[str, float]:
+    """Returns summary statistics of timing samples given in seconds, in ms."""
+    millis = np.array(samples) * 1000
+    return {
+        "mean_ms": float(millis.mean()),
+        "p50_ms": float(np.percentile(millis, 50)),
+        "p95_ms": float(np.percentile(millis, 95)),
+        "max_ms": float(millis.max()),
+    }
+
+
+def benchmark_subsystems(
+    size: int, entities: int, frames: int, seed: int
+) -> dict[str, object]:
+    """
+    Plays a headless game, calling each subsystem once per frame and timing
+    it. Half of the entities are coins and half are monsters.
+    """
+    rng = np.random.default_rng(seed)
+    grid = make_map(size, seed)
+    coins = entities // 2
+    monsters = entities - coins
+
+    start = time.perf_counter()
+    game = GameApplication(grid, coins, monsters, seed=seed, headless=True)
+    spawn_time = time.perf_counter() - start
+
+    timings: dict[str, list[float]] = {
+        "move_monsters": [],
+        "player_move": [],
+        "check_collisions": [],
+        "render_world_tiles": [],
+        "render_world_entities": [],
+    }
+
+    def timed(name, function, *args):
+        start = time.perf_counter()
+        function(*args)
+        timings[name].append(time.perf_counter() - start)
+
+    player = game.player
+    for _ in range(frames):
+        player.move_right, player.move_left, player.move_down, player.move_up = (
+            rng.integers(0, 2, 4).tolist()
+        )
+        timed("move_monsters", game.world.move_monsters, (player.x_pos, player.y_pos))
+        timed("player_move", player.move, game.world)
+        timed("check_collisions", game.simulation.check_collisions)
+        game.camera.center_on_point(player.x_pos, player.y_pos)
+        timed("render_world_tiles", game.camera.render_world_tiles, game.window)
+        timed("render_world_entities", game.camera.render_world_entities, game.window)
+
+    return {
+        "spawn_ms": spawn_time * 1000,
+        "timings": {name: summarize(samples) for name, samples in timings.items()},
+    }
+
+
+def benchmark_ticks(size: int, entities: int, frames: int, seed: int) -> dict[str, object]:
+    """
+    Measures whole 60 FPS frames of a headless game, including rendering,
+    with the player holding a random arrow key that changes every second.
+    """
+    rng = np.random.default_rng(seed)
+    grid = make_map(size, seed)
+    coins = entities // 2
+    game = GameApplication(grid, coins, entities - coins, seed=seed, headless=True)
+
+    script: dict[int, list[pygame.event.Event]] = {}
+    key = None
+    for frame in range(0, frames, FPS):
+        events = []
+        if key is not None:
+            events.append(pygame.event.Event(pygame.KEYUP, key=key))
+        key = ARROW_KEYS[rng.integers(len(ARROW_KEYS))]
+        events.append(pygame.event.Event(pygame.KEYDOWN, key=key))
+        script[frame] = events
+
+    frame_times = []
+    for frame in range(frames):
+        start = time.perf_counter()
+        game.step(script.get(frame), render=True)
+        frame_times.append(time.perf_counter() - start)
+
+    return {
+        "frames_per_sec": frames / sum(frame_times),
+        "frame": summarize(frame_times),
+    }
+
+
+def benchmark_simulation(
+    size: int, entities: int, ticks: int, seed: int
+) -> dict[str, object]:
+    """
+    Measures simulation ticks without any rendering or display, with the
+    player holding a random arrow key that changes every second. The game
+    keeps going after the player is caught.
+    """
+    rng = np.random.default_rng(seed)
+    grid = make_map(size, seed)
+    coins = entities // 2
+    simulation = Simulation.new_game(grid, coins, entities - coins, seed)
+
+    key = None
+    start = time.perf_counter()
+    for tick in range(ticks):
+        if tick % TICKS_PER_SECOND == 0:
+            if key is not None:
+                simulation.queue_key(key, False)
+            key = ARROW_KEYS[rng.integers(len(ARROW_KEYS))]
+            simulation.queue_key(key, True)
+        simulation.tick()
+    return {"simulation_ticks_per_sec": ticks / (time.perf_counter() - start)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[32, 256, 1024])
+    parser.add_argument("--entities", type=int, nargs="+", default=[70, 2000, 20000])
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark.json")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        for entities in args.entities:
+            # skip entity counts that can't fit on the map
+            if entities > size * size * FLOOR_SHARE * 0.5:
+                continue
+            result = {"map_size": size, "entities": entities, "frames": args.frames}
+            result.update(benchmark_subsystems(size, entities, args.frames, args.seed))
+            result.update(benchmark_ticks(size, entities, args.frames, args.seed))
+            result.update(benchmark_simulation(size, entities, args.frames, args.seed))
+            results.append(result)
+            print(
+                f"size {size:>5} entities {entities:>6}: "
+                f"{result['frames_per_sec']:.0f} frames/sec, "
+                f"{result['simulation_ticks_per_sec']:.0f} simulation ticks/sec"
+            )
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pygame": pygame.version.ver,
+        "numpy": np.__version__,
+        "seed": args.seed,
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
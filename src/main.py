@@ -1,7 +1,22 @@
 from __future__ import annotations
+import argparse
+import hashlib
+import itertools
+import json
+import math
+import mmap
+import os
+import struct
+import time
+import zlib
 import pygame
-from random import randint, choice
+import numpy as np
 from enum import Enum
+from fractions import Fraction
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from contextlib import nullcontext
+from typing import BinaryIO, Callable
 
 # Constants
 
@@ -14,6 +29,86 @@ COIN_COUNT = 50  # number of coins on the screen
 MONSTER_COUNT = 20  # number of coins on the screen
 SCORE_TEXT_COLOR = (255, 255, 255) # color of score text
 PLAYER_MOVEMENT_SPEED = 4 # the player movement speed when keys are held down
+PLAYER_START = (6, 6)  # the tile the player starts on
+TILE_CHUNK_SIZE = 16  # width and height of a cached tile layer chunk in tiles
+TILE_CHUNK_CACHE_SIZE = 16  # max number of tile layer chunks kept in memory
+# max bytes of tile layer chunks a camera keeps per zoom level, unless the
+# chunks its view touches take more
+TILE_CACHE_BYTES = 32 * 2**20
+ZOOM_LEVELS = 5  # number of camera zoom levels, each halving the tile size
+ZOOM_CACHE_SIZE = 2  # max number of zoom levels whose tiles and sprites are kept
+ZOOM_IN_KEY = pygame.K_EQUALS  # the key that zooms the camera in
+ZOOM_OUT_KEY = pygame.K_MINUS  # the key that zooms the camera out
+DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1))  # right, left, down, up
+DIRECTION_X = np.array([dx for dx, _ in DIRECTIONS])  # x step of each direction
+DIRECTION_Y = np.array([dy for _, dy in DIRECTIONS])  # y step of each direction
+DIRTY_RECT_RENDERING = True  # only redraw and update the changed parts of the screen
+SMOOTH_MOVEMENT = True  # draw the player and monsters moving between tiles
+DIRTY_RECT_LIMIT = 16  # max dirty rects per frame before redrawing everything
+TEXT_CACHE_SIZE = 256  # max number of rendered text surfaces kept in memory
+TICKS_PER_SECOND = 20  # simulation ticks per second of game time
+TICK_MILLIS = 1000 // TICKS_PER_SECOND  # length of a simulation tick
+MAX_TICKS_PER_FRAME = TICKS_PER_SECOND  # ticks run per frame before rendering again
+MAX_SKIPPED_FRAMES = 5  # frames in a row that may skip rendering to catch up
+MONSTER_MOVE_TICKS = TICKS_PER_SECOND  # ticks between monster moves
+MONSTER_CHASE_RADIUS = 6  # path distance within which monsters chase the player
+FLOW_FIELD_CACHE_SIZE = 4  # max number of flow fields kept by a world
+FOG_OF_WAR = True  # only show what the player can see and has seen
+FOV_RADIUS = 8  # how many tiles far the player can see
+FOV_CACHE_SIZE = 64  # max number of fields of view kept by a world
+FREE_LIST_CACHE_SIZE = 256  # max number of chunk free cell lists kept by a world
+FOG_EXPLORED_ALPHA = 160  # how dark explored tiles out of view are drawn, up to 255
+MONSTER_LOD = True  # only move the monsters in the world chunks near the player
+# how far from the player monsters move with MONSTER_LOD, in tiles: at least
+# as far as they chase the player and as the camera draws them when zoomed out
+# the most, which is half the view plus the tile drawn beyond its edge and the
+# tile the player can be drawn away from its cell
+MONSTER_ACTIVE_RADIUS = max(
+    MONSTER_CHASE_RADIUS,
+    FOV_RADIUS,
+    -(-max(CAMERA_WIDTH, CAMERA_HEIGHT) * TILE_SIZE // max(1, TILE_SIZE >> (ZOOM_LEVELS - 1)))
+    // 2
+    + 3,
+)
+MONSTER_CATCH_UP_STEPS = 32  # max missed steps a waking monster catches up on
+WORLD_CHUNK_SIZE = 64  # width and height of a stored world chunk in tiles, a power of two
+WORLD_CHUNK_CACHE_SIZE = 1024  # max number of chunks of a map file kept resident
+MAP_FILE_MAGIC = b"ROBOTMAP"  # the first bytes of a map file
+MAP_FILE_VERSION = 1  # bump when the map file layout changes
+MAP_FILE_HEADER = struct.Struct("<8sHHII")  # magic, version, chunk size, width, height
+MAP_FILE_ALIGNMENT = 65536  # chunk data in a map file starts on a multiple of this
+PADDING_TILE_ID = 255  # fills the parts of edge chunks outside of the world
+MAZE_CORRIDOR_WIDTH = 4  # corridor width of generated mazes, which keeps PLAYER_START free
+ATLAS_MAX_WIDTH = 1024  # width in pixels at which a sprite atlas starts a new shelf
+ATLAS_PADDING = 1  # transparent pixels between the sprites of an atlas
+ATLAS_FILE_MAGIC = b"ROBOTATL"  # the first bytes of a cached atlas file
+ATLAS_FILE_VERSION = 1  # bump when the atlas file layout or packing changes
+ATLAS_FILE_HEADER = struct.Struct("<8sHHHH")  # magic, version, width, height, regions
+ATLAS_FILE_REGION = struct.Struct("<HHHHH")  # x, y, width, height, name length
+RECORDING_FILE_MAGIC = b"ROBOTREC"  # the first bytes of an input recording
+RECORDING_FILE_VERSION = 2  # bump when the recording layout or the game rules change
+RECORDING_FILE_HEADER = struct.Struct("<8sHqIIH")  # magic, version, seed, counts, map path length
+RECORDING_EVENT = struct.Struct("<IB")  # tick, key index * 2 + pressed
+RECORDING_END = 255  # the event code of the record closing a recording
+RECORDING_OUTCOME = struct.Struct("<IiiB")  # coins collected, player x and y, game over
+SNAPSHOT_FILE_MAGIC = b"ROBOTSAV"  # the first bytes of a saved game
+SNAPSHOT_FILE_VERSION = 2  # bump when the layout of saved games changes
+SNAPSHOT_FILE_HEADER = struct.Struct("<8sHI")  # magic, version, state length
+SNAPSHOT_SECTION = struct.Struct("<I")  # the length of a section of a saved game
+QUICK_SAVE_KEY = pygame.K_F5  # the key that snapshots the game in memory
+QUICK_LOAD_KEY = pygame.K_F9  # the key that goes back to the last snapshot
+PROFILER_HISTORY = 600  # frames of timings kept by a frame profiler
+PROFILER_TRACE_EVENTS = 100_000  # max timed scopes kept for a trace file
+PROFILER_OVERLAY_FRAMES = 15  # frames between updates of the profiler overlay
+PROFILER_OVERLAY_KEY = pygame.K_F3  # the key that shows and hides the overlay
+PROFILER_TEXT_COLOR = (255, 255, 0)  # color of the profiler overlay text
+MINIMAP_SIZE = 128  # max width and height of the minimap in pixels
+MINIMAP_REFRESH_FRAMES = 10  # frames between redraws of the minimap markers
+MINIMAP_KEY = pygame.K_m  # the key that shows and hides the minimap
+MINIMAP_UNKNOWN_COLOR = (0, 0, 0)  # color of unexplored parts of the minimap
+MINIMAP_COIN_COLOR = (255, 215, 0)  # color of coins on the minimap
+MINIMAP_MONSTER_COLOR = (220, 40, 40)  # color of monsters on the minimap
+MINIMAP_PLAYER_COLOR = (40, 160, 255)  # color of the player on the minimap
 
 MAP = [
     [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1],
@@ -47,13 +142,53 @@ MAP = [
     [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1]
 ]
 
-# Custom Event Constants
-PLAYER_MOVE_EVENT = pygame.USEREVENT + 1
-MONSTER_MOVE_EVENT = pygame.USEREVENT + 2
+RESOURCE_DIR = os.path.dirname(os.path.abspath(__file__))  # where images are kept
+ATLAS_CACHE_DIR = os.path.join(RESOURCE_DIR, ".asset_cache")  # where packed atlases are kept
+
+# Sprite IDs, which entities use to refer to their image
+ROBOT_SPRITE = 0
+MONSTER_SPRITE = 1
+DOOR_SPRITE = 2
+COIN_SPRITE = 3
+SPRITE_NAMES = ("robot", "monster", "door", "coin")  # atlas regions of the sprite IDs
+
+# Keys that move the player, mapped to the Player flag they set
+MOVEMENT_KEYS = {
+    pygame.K_UP: "move_up",
+    pygame.K_DOWN: "move_down",
+    pygame.K_LEFT: "move_left",
+    pygame.K_RIGHT: "move_right",
+}
 
 
 class GameApplication:
-    def __init__(self) -> None:
+    """
+    The game itself. Call run to play it in a window.
+
+    The game rules run in a Simulation of fixed ticks, fed from an
+    accumulator of the real time passed, so rendering can drop frames under
+    load without changing the outcome of the game. A headless game uses
+    SDL's dummy video driver, so nothing is shown and time only passes when
+    step or simulate is called. Quitting a headless game sets game_over
+    instead of exiting.
+    """
+
+    def __init__(
+        self,
+        tile_grid: list[list[int]] | np.ndarray | ChunkedTileGrid = MAP,
+        coin_count: int = COIN_COUNT,
+        monster_count: int = MONSTER_COUNT,
+        seed: int | None = None,
+        headless: bool = False,
+        recorder: InputRecorder | None = None,
+        replay: InputRecording | None = None,
+        profiler: FrameProfiler | None = None,
+        save_path: str | None = None,
+    ) -> None:
+        self.headless = headless
+        self.save_path = save_path  # where to save the game when quitting
+        if headless:
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
         pygame.init()
         self.window_width = CAMERA_WIDTH * TILE_SIZE  # in pixels
         self.window_height = CAMERA_HEIGHT * TILE_SIZE  # in pixels
@@ -61,413 +196,3403 @@ class GameApplication:
         pygame.display.set_caption(GAME_TITLE)
         self.clock = pygame.time.Clock()
 
-        # set world and camera
-        self.world = World(MAP)
-        self.camera = Camera(CAMERA_WIDTH, CAMERA_HEIGHT, self.world, TILE_SIZE)
-
         # pre game setup
         self.load_resources()
 
-        # add entities to world and create player
-        self.world.place_coins(self.images[3])
-        self.world.add_monsters(self.images[1])
-        self.player = Player(self.images[0], 6, 6, speed=PLAYER_MOVEMENT_SPEED)
-        
-        # variable to keep track of game score
-        self.coin_count = 0 
-
-        # schedule event to move monsters every second
-        pygame.time.set_timer(MONSTER_MOVE_EVENT, 1000)
-        
-        # start game loop
-        self.run()
+        # set up the game rules, world and camera
+        self.simulation = Simulation.new_game(tile_grid, coin_count, monster_count, seed)
+        self.simulation.recorder = recorder
+        self.simulation.replay = replay
+        self.profiler = profiler or FrameProfiler()
+        self.simulation.profiler = self.profiler
+        self.world = self.simulation.world
+        self.player = self.simulation.player
+        self.camera = Camera(
+            CAMERA_WIDTH, CAMERA_HEIGHT, self.world, TILE_SIZE, self.images
+        )
+        self.minimap = Minimap(self.world, fog=FOG_OF_WAR)
+        self.interpolator = Interpolator(self.simulation)
+        if SMOOTH_MOVEMENT:
+            self.camera.interpolator = self.interpolator
+
+        # real time not yet simulated, in milliseconds
+        self.accumulator = 0
+        self.score_parts: tuple[str | int, ...] = ()
+
+        # what the score looked like the last time it was drawn
+        self._drawn_score_text: pygame.Surface | None = None
+        self._drawn_score_rect = pygame.Rect(0, 0, 0, 0)
+        self._redraw_all = True
+
+        # the last snapshot taken with QUICK_SAVE_KEY
+        self.quick_save: GameSnapshot | None = None
+
+        # the profiler overlay, and what it looked like the last time it was drawn
+        self.show_profiler = False
+        self._profiler_text: pygame.Surface | None = None
+        self._drawn_profiler_text: pygame.Surface | None = None
+        self._drawn_profiler_rect = pygame.Rect(0, 0, 0, 0)
+        # whether the profiler was enabled before the overlay was shown
+        self._profiler_was_enabled = self.profiler.enabled
+
+        # the minimap, and the version of it that was drawn last
+        self.show_minimap = True
+        self._drawn_minimap_version = -1
 
     def load_resources(self) -> None:
-        self.images = []
-        self.images.append(pygame.image.load("robot.png"))
-        self.images.append(pygame.image.load("monster.png"))
-        self.images.append(pygame.image.load("door.png"))
-        self.images.append(pygame.image.load("coin.png"))
+        self.atlas = SpriteAtlas.load(SPRITE_NAMES)
+        self.atlas.convert()
+        self.images = self.atlas.sprites(SPRITE_NAMES)
         self.game_font = pygame.font.SysFont("Arial", 24)
+        self.text_cache = TextCache()
 
-    def update(self, delta: float) -> None:
-        self.handle_events()
-        self.check_collisions()
-        self.update_score_text()
+    @property
+    def game_over(self) -> bool:
+        return self.simulation.game_over
 
-        # center camera on player
-        self.camera.center_on_point(self.player.x_pos, self.player.y_pos)
+    def step(
+        self,
+        events: list[pygame.event.Event] | None = None,
+        delta: int = 1000 // FPS,
+        render: bool = False,
+    ) -> None:
+        """
+        Advances a headless game by one frame of delta milliseconds after
+        handling the given scripted events.
+        """
+        self.update(delta, events or [])
+        if render:
+            self.render(delta)
+
+    def simulate(
+        self,
+        frames: int,
+        script: dict[int, list[pygame.event.Event]] | None = None,
+        delta: int = 1000 // FPS,
+        render: bool = False,
+    ) -> int:
+        """
+        Steps a headless game for the given number of frames, or until it is
+        over. script maps frame numbers to the events handled in that frame.
+        Returns the number of frames stepped.
+        """
+        script = script or {}
+        for frame in range(frames):
+            if self.game_over:
+                return frame
+            self.step(script.get(frame), delta, render)
+        return frames
+
+    def update(
+        self, delta: int, events: list[pygame.event.Event] | None = None
+    ) -> None:
+        profiler = self.profiler
+        profiler.next_frame(delta)
+        with profiler.scope("handle_events"):
+            self.handle_events(events)
+
+        # run the simulation ticks that fit in the time passed, keeping the
+        # remainder for the next frame. After a stall, such as a window drag
+        # or a suspend, the time beyond one more frame of ticks is dropped
+        # rather than fast forwarded through
+        self.accumulator += delta
+        ticks = min(self.accumulator // TICK_MILLIS, MAX_TICKS_PER_FRAME)
+        with profiler.scope("simulation"):
+            self.accumulator -= self.simulation.advance(ticks) * TICK_MILLIS
+        self.accumulator = min(self.accumulator, TICK_MILLIS * MAX_TICKS_PER_FRAME)
+        if self.simulation.game_over:
+            self.quit()
+
+        with profiler.scope("update_score_text"):
+            self.update_score_text()
+        if self.show_profiler and profiler.frame_count % PROFILER_OVERLAY_FRAMES == 0:
+            self.update_profiler_text()
+
+        # center camera on player, where it is drawn between tiles
+        if SMOOTH_MOVEMENT:
+            self.interpolator.update(self.accumulator / TICK_MILLIS)
+            self.camera.center_on_point(*self.interpolator.player_position())
+        else:
+            self.camera.center_on_point(self.player.x_pos, self.player.y_pos)
+        if FOG_OF_WAR:
+            with profiler.scope("field_of_view"):
+                self.update_field_of_view()
+        with profiler.scope("minimap"):
+            self.minimap.update(self.player.x_pos, self.player.y_pos)
+
+    def update_field_of_view(self) -> None:
+        """
+        Shows the camera what the player sees, exploring it when it changed.
+        """
+        field_of_view = self.world.field_of_view(
+            self.player.x_pos, self.player.y_pos, FOV_RADIUS
+        )
+        if field_of_view is not self.camera.field_of_view:
+            self.world.explore(field_of_view)
+            self.minimap.explore(field_of_view)
+            self.camera.field_of_view = field_of_view
+
+    @property
+    def is_behind(self) -> bool:
+        """Whether there is still a full simulation tick left to run."""
+        return self.accumulator >= TICK_MILLIS
 
     def render(self, delta: float) -> None:
+        if not DIRTY_RECT_RENDERING:
+            self.draw_frame()
+            with self.profiler.scope("display_update"):
+                pygame.display.flip()
+            return
+
+        rects = self.camera.changed_rects(self.player)
+        score_rect = self.score_rect()
+        if self.score_text is not self._drawn_score_text:
+            rects.append(score_rect.union(self._drawn_score_rect))
+            self._drawn_score_text = self.score_text
+            self._drawn_score_rect = score_rect
+        if self._profiler_text is not self._drawn_profiler_text:
+            profiler_rect = self.profiler_rect()
+            rects.append(profiler_rect.union(self._drawn_profiler_rect))
+            self._drawn_profiler_text = self._profiler_text
+            self._drawn_profiler_rect = profiler_rect
+        if self.show_minimap and self.minimap.version != self._drawn_minimap_version:
+            rects.append(self.minimap_rect())
+            self._drawn_minimap_version = self.minimap.version
+
+        if self._redraw_all or len(rects) > DIRTY_RECT_LIMIT:
+            rects = [self.window.get_rect()]
+            self._redraw_all = False
+        if not rects:
+            return
 
-        # clear window with solid color
-        self.window.fill((0, 0, 0))
+        self.draw_frame(rects)
+        with self.profiler.scope("display_update"):
+            pygame.display.update(rects)
 
-        # render tiles
-        self.camera.render_world_tiles(self.window)
+    def draw_frame(self, rects: list[pygame.Rect] | None = None) -> None:
+        """
+        Draws the frame to the window, or only the parts of it inside the
+        given rectangles, without updating the display. What to blit is
+        worked out once, and then every rectangle is cleared and gets all
+        of it clipped to it, so overlapping rectangles don't draw the
+        translucent parts twice.
+        """
 
-        # render coins and monsters
-        self.camera.render_world_entities(self.window)
+        # the tiles, the coins and monsters, the player, and then the score
+        # text, profiler overlay and minimap
+        with self.profiler.scope("render_world_tiles"):
+            tiles = self.camera.world_tile_blits()
+        with self.profiler.scope("render_world_entities"):
+            entities = self.camera.world_entity_blits()
+        overlays = self.camera.image_entity_blits(self.player)
+        overlays.append((self.score_text, self.score_rect()))
+        if self._profiler_text is not None:
+            overlays.append((self._profiler_text, self.profiler_rect()))
+        if self.show_minimap:
+            overlays.append((self.minimap.surface, self.minimap_rect()))
+
+        with self.profiler.scope("blit_frame"):
+            if rects is None:
+                rects = [self.window.get_rect()]
+            entity_rects = [entity[1] for entity in entities]
+            for rect in rects:
+                self.window.set_clip(rect)
+                self.window.fill((0, 0, 0))
+                self.window.blits(tiles, doreturn=False)
+                self.window.blits(
+                    [entities[i] for i in rect.collidelistall(entity_rects)], doreturn=False
+                )
+                self.window.blits(overlays, doreturn=False)
+            self.window.set_clip(None)
 
-        # render player
-        self.camera.render_image_entity(self.window, self.player)
+    def score_rect(self) -> pygame.Rect:
+        return self.score_text.get_rect(topright=(self.window_width - 20, 20))
 
-        # render score text
-        self.window.blit(
-            self.score_text, (self.window_width - self.score_text.get_width() - 20, 20)
+    def minimap_rect(self) -> pygame.Rect:
+        return self.minimap.surface.get_rect(
+            bottomright=(self.window_width - 20, self.window_height - 20)
         )
 
-        pygame.display.flip()
+    def profiler_rect(self) -> pygame.Rect:
+        if self._profiler_text is None:
+            return pygame.Rect(20, 20, 0, 0)
+        return self._profiler_text.get_rect(topleft=(20, 20))
+
+    def update_profiler_text(self) -> None:
+        """
+        Renders the frame rate, the frame time percentiles and the mean time
+        of each profiler scope over the recorded frames into the overlay.
+        """
+        summary = self.profiler.summary()
+        frame = summary.get("frame")
+        if frame is None:
+            return
+        lines = [
+            f"{1000 / max(frame['mean_ms'], 1e-9):.0f} FPS",
+            f"frame p50 {frame['p50_ms']:.1f} p95 {frame['p95_ms']:.1f} "
+            f"p99 {frame['p99_ms']:.1f} ms",
+        ]
+        lines.extend(
+            f"{name} {stats['mean_ms']:.2f} ms"
+            for name, stats in summary.items()
+            if name != "frame"
+        )
+        rendered = [
+            self.game_font.render(line, True, PROFILER_TEXT_COLOR) for line in lines
+        ]
+        surface = pygame.Surface(
+            (
+                max(line.get_width() for line in rendered),
+                sum(line.get_height() for line in rendered),
+            ),
+            pygame.SRCALPHA,
+        )
+        surface.fill((0, 0, 0, 160))
+        y = 0
+        for line in rendered:
+            surface.blit(line, (0, y))
+            y += line.get_height()
+        self._profiler_text = surface
 
     def update_score_text(self):
-        if self.coin_count >= COIN_COUNT:
-            self.score_text = self.game_font.render("You Win!", True, SCORE_TEXT_COLOR)
+        coin_count = self.simulation.coin_count
+        total_coins = self.simulation.total_coins
+        if coin_count >= total_coins:
+            score_parts: tuple[str | int, ...] = ("You Win!",)
         else:
-            self.score_text = self.game_font.render(
-                f"Coins collected: {self.coin_count} / {COIN_COUNT}",
-                True,
-                SCORE_TEXT_COLOR,
+            score_parts = ("Coins collected: ", coin_count, f" / {total_coins}")
+
+        # only compose the text again when it has changed
+        if score_parts != self.score_parts:
+            self.score_parts = score_parts
+            self.score_text = self.text_cache.render_parts(
+                self.game_font, score_parts, SCORE_TEXT_COLOR
             )
 
-    def check_collisions(self):
-        
-        # collect coin functionality
-        for coin_pos in self.world.coin_coordinates():
-            if coin_pos[0] == self.player.x_pos and coin_pos[1] == self.player.y_pos:
-                self.world.remove_coin_at_position(coin_pos[0], coin_pos[1])
-                self.coin_count += 1
-
-        # exit game on monster collision
-        for monster_pos in self.world.monster_coordinates():
-            if (
-                monster_pos[0] == self.player.x_pos
-                and monster_pos[1] == self.player.y_pos
-            ):
-                self.quit()
+    def handle_events(self, events: list[pygame.event.Event] | None = None) -> None:
+        """
+        Handles the given events, or the events in the pygame queue if none
+        are given.
+        """
+        if events is None:
+            events = pygame.event.get()
 
-    def handle_events(self) -> None:
-        for event in pygame.event.get():
+        for event in events:
             if event.type == pygame.QUIT:
                 self.quit()
+
+            if event.type == pygame.WINDOWEXPOSED:
+                self._redraw_all = True
+
+            if event.type == pygame.KEYDOWN and event.key == PROFILER_OVERLAY_KEY:
+                self.show_profiler = not self.show_profiler
+                if self.show_profiler:
+                    self._profiler_was_enabled = self.profiler.enabled
+                    self.profiler.enabled = True
+                    self.update_profiler_text()
+                else:
+                    self.profiler.enabled = self._profiler_was_enabled
+                    self._profiler_text = None
+
+            if event.type == pygame.KEYDOWN and event.key == MINIMAP_KEY:
+                self.show_minimap = not self.show_minimap
+                self._redraw_all = True
+
+            if event.type == pygame.KEYDOWN and event.key in (ZOOM_IN_KEY, ZOOM_OUT_KEY):
+                self.camera.set_zoom(self.camera.zoom + (-1 if event.key == ZOOM_IN_KEY else 1))
+
+            # a replayed game only takes the recorded keys
+            if self.simulation.replay is not None:
+                continue
+
+            if event.type == pygame.KEYDOWN and event.key == QUICK_SAVE_KEY:
+                self.quick_save = GameSnapshot.capture(self.simulation)
+
+            # going back in time would make a recording useless
+            if (
+                event.type == pygame.KEYDOWN
+                and event.key == QUICK_LOAD_KEY
+                and self.quick_save is not None
+                and self.simulation.recorder is None
+            ):
+                self.restore(self.quick_save)
+                continue
                 
             if event.type == pygame.KEYDOWN:
-                match (event.key):
-                    case pygame.K_UP:
-                        if not self.player.is_moving():
-                            self.player.move_up = 1
-                            self.player.move(self.world)
-                            pygame.time.set_timer(
-                                PLAYER_MOVE_EVENT, 1000 // self.player.speed
-                            )
-                        else:
-                            self.player.move_up = 1
-                    case pygame.K_DOWN:
-                        if not self.player.is_moving():
-                            self.player.move_down = 1
-                            self.player.move(self.world)
-                            pygame.time.set_timer(
-                                PLAYER_MOVE_EVENT, 1000 // self.player.speed
-                            )
-                        else:
-                            self.player.move_down = 1
-                    case pygame.K_LEFT:
-                        if not self.player.is_moving():
-                            self.player.move_left = 1
-                            self.player.move(self.world)
-                            pygame.time.set_timer(
-                                PLAYER_MOVE_EVENT, 1000 // self.player.speed
-                            )
-                        else:
-                            self.player.move_left = 1
-                    case pygame.K_RIGHT:
-                        if not self.player.is_moving():
-                            self.player.move_right = 1
-                            self.player.move(self.world)
-                            pygame.time.set_timer(
-                                PLAYER_MOVE_EVENT, 1000 // self.player.speed
-                            )
-                        else:
-                            self.player.move_right = 1
+                self.simulation.queue_key(event.key, True)
 
             if event.type == pygame.KEYUP:
-                match (event.key):
-                    case pygame.K_UP:
-                        self.player.move_up = 0
-                        if not self.player.is_moving():
-                            pygame.time.set_timer(PLAYER_MOVE_EVENT, 0)
-                    case pygame.K_DOWN:
-                        self.player.move_down = 0
-                        if not self.player.is_moving():
-                            pygame.time.set_timer(PLAYER_MOVE_EVENT, 0)
-                    case pygame.K_LEFT:
-                        self.player.move_left = 0
-                        if not self.player.is_moving():
-                            pygame.time.set_timer(PLAYER_MOVE_EVENT, 0)
-                    case pygame.K_RIGHT:
-                        self.player.move_right = 0
-                        if not self.player.is_moving():
-                            pygame.time.set_timer(PLAYER_MOVE_EVENT, 0)
-
-            if event.type == PLAYER_MOVE_EVENT:
-                self.player.move(self.world)
+                self.simulation.queue_key(event.key, False)
 
-            if event.type == MONSTER_MOVE_EVENT:
-                self.world.move_monsters()
+    def restore(self, snapshot: GameSnapshot) -> None:
+        """
+        Puts the game back in the state of the snapshot, which has to be of
+        a game on the same map.
+        """
+        simulation = snapshot.restore(self.world.tile_grid)
+        simulation.recorder = self.simulation.recorder
+        simulation.replay = self.simulation.replay
+        simulation.profiler = self.profiler
+        self.simulation = simulation
+        self.world = simulation.world
+        self.player = simulation.player
+        zoom = self.camera.zoom
+        self.camera = Camera(
+            CAMERA_WIDTH, CAMERA_HEIGHT, self.world, TILE_SIZE, self.images
+        )
+        self.camera.set_zoom(zoom)
+        self.minimap = Minimap(self.world, fog=FOG_OF_WAR)
+        self.interpolator = Interpolator(simulation)
+        if SMOOTH_MOVEMENT:
+            self.camera.interpolator = self.interpolator
+        self.camera.center_on_point(self.player.x_pos, self.player.y_pos)
+        if FOG_OF_WAR:
+            self.update_field_of_view()
+        self._redraw_all = True
 
     def run(self) -> None:
+        skipped = 0
         while True:
             delta = self.clock.tick(FPS)
             self.update(delta)
-            self.render(delta)
+
+            # skip rendering while the simulation is catching up, but never
+            # for more than MAX_SKIPPED_FRAMES frames in a row
+            if self.is_behind and skipped < MAX_SKIPPED_FRAMES:
+                skipped += 1
+            else:
+                self.render(delta)
+                skipped = 0
             
     def quit(self) -> None:
+        if self.save_path is not None:
+            GameSnapshot.capture(self.simulation).save(self.save_path)
+        if self.simulation.recorder is not None:
+            self.simulation.recorder.close(self.simulation)
+        self.profiler.close()
+        if self.headless:
+            self.simulation.game_over = True
+            return
         pygame.quit()
         exit()
 
-class World:
+
+class Simulation:
     """
-    A class representing a tile-based game world, on which to keep track of
-    tiles to render and update. Tile types are currently defined using integer
-    IDs. Also keeps track of coins and monsters.
+    The rules of the game, advanced in fixed ticks of TICK_MILLIS
+    milliseconds independently of rendering: player input and movement,
+    monster movement and collisions. Key presses are queued and applied at
+    the start of the next tick, so a game is fully determined by its seed
+    and the tick each key was pressed or released on. Needs no display, so
+    it can run faster than real time.
+
+    The keys applied on each tick are logged to recorder if one is set, and
+    replay, if set, queues the keys of a recorded game on the ticks they
+    were applied on. The hot parts of a tick are timed by profiler.
     """
 
-    def __init__(self, tile_grid: list[list[int]]) -> None:
-        self._width = len(tile_grid[0])
-        self._height = len(tile_grid)
-        self._tile_grid = tile_grid
-        self._coins: dict[tuple[int, int], ImageEntity] = {}
-        self._monsters: dict[tuple[int, int], ImageEntity] = {}
-
-    def get_tile_at_position(self, x: int, y: int) -> Tile:
-
-        # Check if the position is out of bounds. If so, return a bounds tile.
-        if x < 0 or x >= self._width or y < 0 or y >= self._height:
-            return Tile.BOUNDS
-
-        return Tile(self._tile_grid[y][x]) # type: ignore
-
-    def set_tile_at_position(self, x: int, y: int, tile: Tile) -> None:
-        self._tile_grid[y][x] = tile # type: ignore
-
-    def place_coins(self, coin_image: pygame.Surface) -> None:
-
-        i = 0
-        while i < COIN_COUNT:
-            x = randint(0, self.width - 1)
-            y = randint(0, self.height - 1)
-
-            if self.get_tile_at_position(x, y).is_collidable: # type: ignore
-                continue
-
-            if (x, y) in self._coins.keys():
-                continue
-
-            if (x, y) in self._monsters.keys():
-                continue
-
-            coin = ImageEntity(coin_image, x, y)
+    def __init__(self, world: World, player: Player, total_coins: int) -> None:
+        self.world = world
+        self.player = player
+        self.total_coins = total_coins
+        self.coin_count = 0
+        self.tick_count = 0
+        self.game_over = False
+        self._keys: list[tuple[int, bool]] = []
+        self._player_cooldown = 0  # ticks until the held player move repeats
+        self.recorder: InputRecorder | None = None
+        self.replay: InputRecording | None = None
+        self.profiler = FrameProfiler()
+        world.publish_entered_cell(player)
+
+    @classmethod
+    def new_game(
+        cls,
+        tile_grid: list[list[int]] | np.ndarray | ChunkedTileGrid = MAP,
+        coin_count: int = COIN_COUNT,
+        monster_count: int = MONSTER_COUNT,
+        seed: int | None = None,
+    ) -> Simulation:
+        """
+        Creates a game with coins and monsters placed on random free cells
+        other than the player's start. vecenv.VectorGame plays by the same
+        rules, so changes to them have to be made there too.
+        """
+        world = World(tile_grid, seed=seed)
+        world.place_coins(coin_count, avoid=PLAYER_START)
+        world.add_monsters(monster_count, avoid=PLAYER_START)
+        player = Player(ROBOT_SPRITE, *PLAYER_START, speed=PLAYER_MOVEMENT_SPEED)
+        return cls(world, player, coin_count)
 
-            self.coins[(x, y)] = coin
-            i += 1
+    def queue_key(self, key: int, pressed: bool) -> None:
+        """
+        Queues a key press or release to be applied on the next tick. Keys
+        other than MOVEMENT_KEYS are ignored.
+        """
+        if key in MOVEMENT_KEYS:
+            self._keys.append((key, pressed))
 
-    def add_monsters(self, monster_image: pygame.Surface) -> None:
-        i = 0
-        while i < MONSTER_COUNT:
-            x = randint(0, self.width - 1)
-            y = randint(0, self.height - 1)
+    def advance(self, ticks: int) -> int:
+        """
+        Runs up to the given number of ticks, stopping early if the game is
+        over. Returns the number of ticks run.
+        """
+        for i in range(ticks):
+            if self.game_over:
+                return i
+            self.tick()
+        return ticks
+
+    def tick(self) -> None:
+        if self.replay is not None:
+            self.replay.feed(self)
+
+        # a key press starts moving the player straight away
+        moved = False
+        for key, pressed in self._keys:
+            if self.recorder is not None:
+                self.recorder.record(self.tick_count, key, pressed)
+            moved = self._apply_key(key, pressed) or moved
+        self._keys.clear()
+
+        # a held key repeats the move at the player's speed
+        if self.player.is_moving() and not moved:
+            self._player_cooldown -= 1
+            if self._player_cooldown <= 0:
+                self.player.move(self.world)
+                self._player_cooldown = self._player_move_ticks()
 
-            if self.get_tile_at_position(x, y).is_collidable: # type: ignore
-                continue
+        self.tick_count += 1
+        if self.tick_count % MONSTER_MOVE_TICKS == 0:
+            with self.profiler.scope("move_monsters"):
+                self.world.move_monsters((self.player.x_pos, self.player.y_pos))
 
-            if (x, y) in self._monsters.keys():
-                continue
+        with self.profiler.scope("check_collisions"):
+            self.check_collisions()
 
-            if (x, y) in self._coins.keys():
-                continue
+    def _apply_key(self, key: int, pressed: bool) -> bool:
+        # returns whether the player moved
+        was_moving = self.player.is_moving()
+        setattr(self.player, MOVEMENT_KEYS[key], int(pressed))
+        if pressed and not was_moving:
+            self.player.move(self.world)
+            self._player_cooldown = self._player_move_ticks()
+            return True
+        return False
 
-            monster = ImageEntity(monster_image, x, y)
+    def _player_move_ticks(self) -> int:
+        return max(1, round(TICKS_PER_SECOND / self.player.speed))
 
-            self.monsters[(x, y)] = monster
-            i += 1
+    def check_collisions(self):
+        """
+        Resolves the collisions caused by the entities that entered a cell
+        since the last call. Nothing is checked if nothing has moved.
+        vecenv.VectorGame ends its games by the same rules.
+        """
+        for entity, x, y in self.world.pop_entered_cells():
+            if entity is self.player:
+                # collect coin functionality
+                if self.world.remove_coin_at_position(x, y):
+                    self.coin_count += 1
 
-    def move_monsters(self) -> None:
+                # end game on monster collision
+                if self.world.has_monster_at_position(x, y):
+                    self.game_over = True
 
-        new_monsters: dict[tuple[int, int], ImageEntity] = {} 
-        for monster in self._monsters.values():
-            direction = choice([(1, 0), (-1, 0), (0, 1), (0, -1)])
-            new_x = monster.x_pos + direction[0]
-            new_y = monster.y_pos + direction[1]
+        # end game if a monster walked into the player
+        if self.world.pop_monsters_moved() and self.world.has_monster_at_position(
+            self.player.x_pos, self.player.y_pos
+        ):
+            self.game_over = True
 
-            move = True
 
-            if self.get_tile_at_position(new_x, new_y).is_collidable: # type: ignore
-                move = False
+class InputRecorder:
+    """
+    Records a game to a compact append-only binary file: a header with the
+    seed, coin and monster counts and map file of the game, then a five
+    byte record for every key applied, holding the tick it was applied on.
+    close appends a record with the outcome of the game, so a replay can be
+    checked against it. Together with the seed this is all it takes to
+    play the game again exactly, see InputRecording.
+    """
 
-            if (new_x, new_y) in self._monsters.keys():
-                move = False
+    _keys = tuple(MOVEMENT_KEYS)
 
-            if (new_x, new_y) in new_monsters.keys():
-                move = False
+    def __init__(
+        self,
+        path: str,
+        seed: int,
+        coin_count: int = COIN_COUNT,
+        monster_count: int = MONSTER_COUNT,
+        map_path: str = "",
+    ) -> None:
+        encoded_path = map_path.encode()
+        self._file: BinaryIO | None = open(path, "wb")
+        self._file.write(
+            RECORDING_FILE_HEADER.pack(
+                RECORDING_FILE_MAGIC,
+                RECORDING_FILE_VERSION,
+                seed,
+                coin_count,
+                monster_count,
+                len(encoded_path),
+            )
+        )
+        self._file.write(encoded_path)
 
-            if (new_x, new_y) in self._coins.keys():
-                move = False
+    def record(self, tick: int, key: int, pressed: bool) -> None:
+        """
+        Appends a key that was applied on the given tick.
+        """
+        if self._file is not None:
+            code = self._keys.index(key) * 2 + pressed
+            self._file.write(RECORDING_EVENT.pack(tick, code))
 
-            if move:
-                monster.x_pos = new_x
-                monster.y_pos = new_y
-                new_monsters[(new_x, new_y)] = monster
-            else:
-                new_monsters[(monster.x_pos, monster.y_pos)] = monster
+    def close(self, simulation: Simulation) -> None:
+        """
+        Appends the outcome of the recorded game and closes the file.
+        Closing it again does nothing.
+        """
+        if self._file is None:
+            return
+        player = simulation.player
+        self._file.write(RECORDING_EVENT.pack(simulation.tick_count, RECORDING_END))
+        self._file.write(
+            RECORDING_OUTCOME.pack(
+                simulation.coin_count, player.x_pos, player.y_pos, simulation.game_over
+            )
+        )
+        self._file.close()
+        self._file = None
 
-            self._monsters = new_monsters
 
-    def monster_coordinates(self) -> list[tuple[int, int]]:
-        return list(self._monsters.keys())
+class InputRecording:
+    """
+    A game recorded by InputRecorder. new_game sets the recorded game up
+    again, with the recording queueing the recorded keys through the same
+    path as live input, so the replay plays out exactly like the original.
+    A recording that was never closed, for example because the game
+    crashed, replays up to its last key and has no outcome.
+    """
 
-    def coin_coordinates(self) -> list[tuple[int, int]]:
-        return list(self._coins.keys())
+    def __init__(
+        self,
+        seed: int,
+        coin_count: int,
+        monster_count: int,
+        map_path: str,
+        events: list[tuple[int, int, bool]],
+        ticks: int,
+        outcome: tuple[int, int, int, bool] | None,
+    ) -> None:
+        self.seed = seed
+        self.coin_count = coin_count
+        self.monster_count = monster_count
+        self.map_path = map_path
+        self.events = events  # (tick, key, pressed), in the order applied
+        self.ticks = ticks  # the number of ticks the game ran for
+        self.outcome = outcome  # coins collected, player x and y, game over
+        self._next_event = 0
+
+    @classmethod
+    def open(cls, path: str) -> InputRecording:
+        """
+        Reads a recording written by InputRecorder.
+        """
+        with open(path, "rb") as file:
+            data = file.read()
 
-    def remove_coin_at_position(self, x: int, y: int) -> None:
-        if (x, y) in self._coins.keys():
-            self._coins.pop((x, y))
+        magic, version, seed, coin_count, monster_count, path_length = (
+            RECORDING_FILE_HEADER.unpack_from(data)
+        )
+        if magic != RECORDING_FILE_MAGIC or version != RECORDING_FILE_VERSION:
+            raise ValueError(f"{path} is not a version {RECORDING_FILE_VERSION} recording")
+        offset = RECORDING_FILE_HEADER.size
+        map_path = data[offset : offset + path_length].decode()
+        offset += path_length
+
+        events = []
+        ticks = 0
+        outcome = None
+        keys = InputRecorder._keys
+        while offset + RECORDING_EVENT.size <= len(data):
+            tick, code = RECORDING_EVENT.unpack_from(data, offset)
+            offset += RECORDING_EVENT.size
+            if code == RECORDING_END:
+                coins, x, y, game_over = RECORDING_OUTCOME.unpack_from(data, offset)
+                ticks = tick
+                outcome = (coins, x, y, bool(game_over))
+                break
+            events.append((tick, keys[code // 2], bool(code % 2)))
+            ticks = tick + 1
+        return cls(seed, coin_count, monster_count, map_path, events, ticks, outcome)
+
+    def tile_grid(self) -> list[list[int]] | ChunkedTileGrid:
+        """
+        Returns the map the game was recorded on.
+        """
+        return ChunkedTileGrid.open(self.map_path) if self.map_path else MAP
 
-    @property
-    def width(self):
-        """The width property."""
-        return self._width
+    def new_game(self) -> Simulation:
+        """
+        Creates the recorded game, with this recording feeding it its keys.
+        """
+        simulation = Simulation.new_game(
+            self.tile_grid(), self.coin_count, self.monster_count, self.seed
+        )
+        simulation.replay = self
+        self._next_event = 0
+        return simulation
 
-    @property
-    def height(self):
-        """The height property."""
-        return self._height
+    def feed(self, simulation: Simulation) -> None:
+        """
+        Queues the keys recorded for the simulation's next tick.
+        """
+        events = self.events
+        while (
+            self._next_event < len(events)
+            and events[self._next_event][0] <= simulation.tick_count
+        ):
+            _, key, pressed = events[self._next_event]
+            simulation.queue_key(key, pressed)
+            self._next_event += 1
+
+    def run(self, simulation: Simulation) -> int:
+        """
+        Replays the rest of the recording as fast as possible, without
+        rendering. Returns the number of ticks run.
+        """
+        return simulation.advance(self.ticks - simulation.tick_count)
 
-    @property
-    def coins(self):
-        """The coins property."""
-        return self._coins
+    def matches(self, simulation: Simulation) -> bool:
+        """
+        Whether the simulation ended the way the recorded game did. A
+        recording without an outcome matches nothing.
+        """
+        player = simulation.player
+        return self.outcome == (
+            simulation.coin_count, player.x_pos, player.y_pos, simulation.game_over
+        )
 
-    @property
-    def monsters(self):
-        """The monsters property."""
-        return self._monsters
 
-class Tile(Enum):
+class GameSnapshot:
     """
-    An enumeration representing the different types of tiles that can be
-    present in the game world. Each tile type has an ID, a color, and a flag
-    indicating whether the tile is collidable or not.
+    The full state of a game between two ticks: the simulation and player,
+    the coins and monsters, the world's random generator, the chunks of
+    tiles that were set and the tiles the player has explored. Capturing
+    one copies a few arrays and no objects per entity, so snapshots are
+    cheap enough to take every tick, and a snapshot can be restored any
+    number of times, for rollback or to play out several branches of the
+    same game.
+
+    save writes a snapshot to a versioned binary file: the scalar state as
+    JSON, then zlib compressed sections with the sorted cells of the coins
+    and monsters delta encoded as varints, the set chunks with their tiles
+    bit packed against a palette, and the explored bitsets. The map itself
+    isn't saved, so the game has to be restored onto the map it was played
+    on.
     """
 
-    FLOOR = (0, (120, 120, 120), False)
-    WALL = (1, (160, 160, 160), True)
+    def __init__(
+        self,
+        state: dict[str, object],
+        coins: EntityStore,
+        monsters: MonsterSwarm,
+        free_counts: np.ndarray,
+        chunks: dict[int, np.ndarray],
+        explored: dict[int, np.ndarray] | None = None,
+    ) -> None:
+        self.state = state  # the scalar state, as JSON compatible values
+        self.coins = coins
+        self.monsters = monsters
+        self.free_counts = free_counts
+        self.chunks = chunks  # the tiles of the chunks that were set
+        self.explored = explored or {}  # the explored bitsets, by chunk number
+
+    @classmethod
+    def capture(cls, simulation: Simulation) -> GameSnapshot:
+        """
+        Returns a snapshot of the simulation, which shares nothing with it.
+        """
+        world = simulation.world
+        player = simulation.player
+        state = {
+            "width": world.width,
+            "height": world.height,
+            "tick_count": simulation.tick_count,
+            "coin_count": simulation.coin_count,
+            "total_coins": simulation.total_coins,
+            "game_over": simulation.game_over,
+            "keys": simulation._keys.copy(),
+            "player_cooldown": simulation._player_cooldown,
+            "player": [
+                player.sprite,
+                player.x_pos,
+                player.y_pos,
+                player.move_up,
+                player.move_down,
+                player.move_left,
+                player.move_right,
+                player.speed,
+            ],
+            "entered_cells": [[x, y] for _, x, y in world._entered_cells],
+            "monster_steps": world._monster_steps,
+            "monsters_moved": world._monsters_moved,
+            "rng": world._rng.bit_generator.state,
+        }
+        return cls(
+            state,
+            world._coins.copy(),
+            world._monsters.copy(),  # type: ignore
+            world._free_counts.copy(),
+            world.tile_grid.edited_chunks(),
+            {chunk: bits.copy() for chunk, bits in world._explored.items()},
+        )
 
-    # The bounds tile represents a tile that is outside the bounds of a world
-    BOUNDS = (-1, (0, 0, 0), True)
+    def restore(
+        self, tile_grid: list[list[int]] | np.ndarray | ChunkedTileGrid = MAP
+    ) -> Simulation:
+        """
+        Returns a simulation in the state of the snapshot, on the map the
+        snapshotted game was played on. A ChunkedTileGrid is restored in
+        place, so it must not be used by another simulation any more.
+        Raises a ValueError if the map has a different size.
+        """
+        if not isinstance(tile_grid, ChunkedTileGrid):
+            tile_grid = ChunkedTileGrid.from_array(tile_grid)
+        state = self.state
+        if (tile_grid.width, tile_grid.height) != (state["width"], state["height"]):
+            raise ValueError(
+                f"The game was played on a {state['width']}x{state['height']} map, "
+                f"not on a {tile_grid.width}x{tile_grid.height} one"
+            )
+        tile_grid.restore_chunks(self.chunks)
+
+        world = World(tile_grid)
+        world._rng.bit_generator.state = state["rng"]
+        world._free_counts = self.free_counts.copy()
+        world._coins = self.coins.copy()
+        world._monsters = self.monsters.copy()  # type: ignore
+        world._monster_steps = state["monster_steps"]
+        world._monsters_moved = state["monsters_moved"]
+        world._explored = {chunk: bits.copy() for chunk, bits in self.explored.items()}
+
+        sprite, x, y, up, down, left, right, speed = state["player"]  # type: ignore
+        player = Player(sprite, x, y, speed=speed)
+        player.move_up, player.move_down = up, down
+        player.move_left, player.move_right = left, right
+
+        simulation = Simulation(world, player, state["total_coins"])  # type: ignore
+        world.pop_entered_cells()
+        for x, y in state["entered_cells"]:  # type: ignore
+            world._entered_cells.append((player, x, y))
+        simulation.tick_count = state["tick_count"]
+        simulation.coin_count = state["coin_count"]
+        simulation.game_over = state["game_over"]
+        simulation._keys = [(key, pressed) for key, pressed in state["keys"]]  # type: ignore
+        simulation._player_cooldown = state["player_cooldown"]
+        return simulation
+
+    def to_bytes(self) -> bytes:
+        """
+        Returns the snapshot in the format written by save.
+        """
+        sections = []
+        for store in (self.coins, self.monsters):
+            arrays = store.to_arrays()
+            sections.append(_encode_varints(np.diff(arrays.pop("cells"), prepend=0)))
+            sections.append(arrays.pop("indices").astype("<u4").tobytes())
+            sections.extend(
+                array.astype(array.dtype.newbyteorder("<")).tobytes()
+                for array in arrays.values()
+            )
+        sections.append(self.free_counts.astype("<u4").tobytes())
+        numbers = np.array(sorted(self.chunks), dtype="<u4")
+        sections.append(numbers.tobytes())
+        tiles = [self.chunks[chunk] for chunk in numbers.tolist()]
+        sections.append(_pack_tiles(np.concatenate(tiles) if tiles else np.empty(0, np.uint8)))
+        numbers = np.array(sorted(self.explored), dtype="<u4")
+        sections.append(numbers.tobytes())
+        sections.extend(self.explored[chunk].tobytes() for chunk in numbers.tolist())
+
+        body = b"".join(SNAPSHOT_SECTION.pack(len(section)) + section for section in sections)
+        state = json.dumps(self.state).encode()
+        header = SNAPSHOT_FILE_HEADER.pack(
+            SNAPSHOT_FILE_MAGIC, SNAPSHOT_FILE_VERSION, len(state)
+        )
+        return header + state + zlib.compress(body)
 
-    def __new__(cls, tile_id, color, is_collidable) -> Tile:
-        obj = object.__new__(cls)
-        obj._value_ = tile_id
-        obj.color = color # type: ignore
-        obj.is_collidable = is_collidable # type: ignore
-        return obj
+    @classmethod
+    def from_bytes(cls, data: bytes) -> GameSnapshot:
+        """
+        Returns the snapshot held by data in the format written by save.
+        Raises a ValueError if it isn't a saved game of the current version.
+        """
+        magic, version, state_length = SNAPSHOT_FILE_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_FILE_MAGIC or version != SNAPSHOT_FILE_VERSION:
+            raise ValueError(f"Not a version {SNAPSHOT_FILE_VERSION} saved game")
+        offset = SNAPSHOT_FILE_HEADER.size
+        state = json.loads(data[offset : offset + state_length])
+        body = zlib.decompress(data[offset + state_length :])
+
+        sections = []
+        offset = 0
+        while offset < len(body):
+            (length,) = SNAPSHOT_SECTION.unpack_from(body, offset)
+            offset += SNAPSHOT_SECTION.size
+            sections.append(body[offset : offset + length])
+            offset += length
+
+        width, height = state["width"], state["height"]
+        stores = []
+        for store_class in (EntityStore, MonsterSwarm):
+            arrays = {
+                "cells": np.cumsum(_decode_varints(sections.pop(0))).astype(np.int64),
+                "indices": np.frombuffer(sections.pop(0), dtype="<u4"),
+            }
+            empty = store_class(0, 0)
+            for name in store_class._columns[2:]:
+                dtype = getattr(empty, name).dtype.newbyteorder("<")
+                arrays[name] = np.frombuffer(sections.pop(0), dtype=dtype)
+            stores.append(store_class.from_arrays(width, height, arrays))
+
+        free_counts = np.frombuffer(sections.pop(0), dtype="<u4").astype(np.int64)
+        numbers = np.frombuffer(sections.pop(0), dtype="<u4").tolist()
+        tiles = _unpack_tiles(sections.pop(0))
+        area = len(tiles) // len(numbers) if numbers else 0
+        chunks = {
+            chunk: tiles[i * area : (i + 1) * area].copy() for i, chunk in enumerate(numbers)
+        }
+        numbers = np.frombuffer(sections.pop(0), dtype="<u4").tolist()
+        explored = {
+            chunk: np.frombuffer(sections.pop(0), dtype=np.uint8).copy() for chunk in numbers
+        }
+        return cls(state, stores[0], stores[1], free_counts, chunks, explored)  # type: ignore
+
+    def save(self, path: str) -> None:
+        """
+        Writes the snapshot to a file at path.
+        """
+        with open(path, "wb") as file:
+            file.write(self.to_bytes())
 
+    @classmethod
+    def open(cls, path: str) -> GameSnapshot:
+        """
+        Reads a snapshot written by save.
+        """
+        with open(path, "rb") as file:
+            return cls.from_bytes(file.read())
+
+
+def _encode_varints(values: np.ndarray) -> bytes:
+    # LEB128: seven bits per byte, low bits first, the high bit set on all
+    # but the last byte of a value
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    for shift in range(7, 64, 7):
+        lengths += values >= np.uint64(1 << shift)
+    starts = np.cumsum(lengths) - lengths
+    encoded = np.zeros(int(lengths.sum()), dtype=np.uint8)
+    for byte in range(int(lengths.max(initial=0))):
+        has_byte = lengths > byte
+        bits = (values[has_byte] >> np.uint64(7 * byte)) & np.uint64(0x7F)
+        more = (lengths[has_byte] > byte + 1).astype(np.uint64) << np.uint64(7)
+        encoded[starts[has_byte] + byte] = bits | more
+    return encoded.tobytes()
+
+
+def _decode_varints(data: bytes) -> np.ndarray:
+    encoded = np.frombuffer(data, dtype=np.uint8)
+    if len(encoded) == 0:
+        return np.empty(0, dtype=np.uint64)
+    last = encoded < 0x80
+    ends = np.flatnonzero(last)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    values = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shifts = (np.arange(len(encoded)) - starts[values]) * 7
+    parts = (encoded & 0x7F).astype(np.uint64) << shifts.astype(np.uint64)
+    return np.bitwise_or.reduceat(parts, starts)
+
+
+def _pack_tiles(tiles: np.ndarray) -> bytes:
+    # the tiles as a palette of the IDs used, followed by the index of each
+    # tile in the palette in as few bits as the palette needs
+    palette, indices = np.unique(tiles, return_inverse=True)
+    bits = max(1, (len(palette) - 1).bit_length())
+    planes = np.unpackbits(indices.astype(np.uint8)[:, np.newaxis], axis=1)[:, 8 - bits :]
+    header = struct.pack("<IH", len(tiles), len(palette))
+    return header + palette.astype(np.uint8).tobytes() + np.packbits(planes).tobytes()
+
+
+def _unpack_tiles(data: bytes) -> np.ndarray:
+    count, palette_size = struct.unpack_from("<IH", data)
+    offset = struct.calcsize("<IH")
+    palette = np.frombuffer(data, dtype=np.uint8, count=palette_size, offset=offset)
+    bits = max(1, (palette_size - 1).bit_length())
+    planes = np.unpackbits(np.frombuffer(data, dtype=np.uint8, offset=offset + palette_size))
+    planes = planes[: count * bits].reshape(count, bits)
+    indices = np.packbits(np.pad(planes, ((0, 0), (8 - bits, 0))), axis=1).reshape(-1)
+    return palette[indices]
 
-class Camera:
+
+class World:
     """
-    A class which represents a camera of a given width and height. It keeps
-    track of the position of the camera in the world, and is used to aid in
-    rendering the world to the screen.
+    A class representing a tile-based game world, on which to keep track of
+    tiles to render and update. Tile types are currently defined using integer
+    IDs. Also keeps track of coins and monsters.
+
+    The tiles are stored as uint8 IDs in a ChunkedTileGrid, either in memory
+    or read from a map file, and collidable flags are looked up from the IDs,
+    so passability can also be queried for many positions at once. Nothing
+    else is stored per tile: coins and monsters are found through sorted
+    arrays of the cells they are on, and free cells are only counted per
+    chunk, so a world on a huge map costs little more than its entities.
     """
 
     def __init__(
         self,
-        width: int,
-        height: int,
-        world: World,
-        tile_size: int,
-        pos_x: int = 0,
-        pos_y: int = 0,
+        tile_grid: list[list[int]] | np.ndarray | ChunkedTileGrid,
+        seed: int | None = None,
     ) -> None:
+        if not isinstance(tile_grid, ChunkedTileGrid):
+            tile_grid = ChunkedTileGrid.from_array(tile_grid)
+        self._tile_grid = tile_grid
+        self._width = tile_grid.width
+        self._height = tile_grid.height
+        self._rng = np.random.default_rng(seed)
+        # passable tiles without a coin or monster on them, per chunk
+        self._free_counts = tile_grid.passable_counts()
+        # the sorted free cells of the chunks spawned in lately, dropped as
+        # soon as anything but spawning changes which of their cells are free
+        self._free_lists: OrderedDict[int, np.ndarray] = OrderedDict()
+        self._coins = EntityStore(self._width, self._height)
+        self._monsters = MonsterSwarm(self._width, self._height)
+        self._monster_steps = 0  # how many times the monsters have been moved
+        self._monsters_moved = False
+        self._tile_listeners: list[Callable[[int, int], None]] = []
+        self._entity_listeners: list[Callable[[str, np.ndarray, np.ndarray], None]] = []
+        self._entered_cells: list[tuple[ImageEntity, int, int]] = []
+        self._flow_fields: OrderedDict[tuple[int, int, int], FlowField] = OrderedDict()
+        self._fields_of_view: OrderedDict[tuple[int, int, int], FieldOfView] = OrderedDict()
+        # a bitset per chunk of the tiles that have been seen, in chunk order
+        self._explored: dict[int, np.ndarray] = {}
+
+    def add_tile_listener(self, listener: Callable[[int, int], None]) -> None:
+        """
+        Registers a callback that is called with the (x, y) position of every
+        tile changed through set_tile_at_position.
+        """
+        self._tile_listeners.append(listener)
 
-        self._width = width
-        self._height = height
-        self._world = world
-        self._tile_size = tile_size
-        self.pos_x = pos_x
-        self.pos_y = pos_y
+    def remove_tile_listener(self, listener: Callable[[int, int], None]) -> None:
+        """
+        Unregisters a callback registered with add_tile_listener.
+        """
+        self._tile_listeners.remove(listener)
 
-    def render_world_tiles(self, surface: pygame.Surface) -> None:
+    def add_entity_listener(
+        self, listener: Callable[[str, np.ndarray, np.ndarray], None]
+    ) -> None:
         """
-        Renders the camera view to the given surface.
-        """
-        for x in range(0, self._width):
-            for y in range(0, self._height):
-                tile = self._world.get_tile_at_position(x + self.pos_x, y + self.pos_y)
-                top_x = x * self._tile_size
-                top_y = y * self._tile_size
-                bototm_x = top_x + self._tile_size
-                bototm_y = top_y + self._tile_size
-                pygame.draw.rect(
-                    surface, tile.color, (top_x, top_y, bototm_x, bototm_y) # type: ignore
-                )
+        Registers a callback that is called whenever coins or monsters are
+        added, removed or moved, with "coins" or "monsters" and the cell
+        numbers (y * width + x) the entities left and entered.
+        """
+        self._entity_listeners.append(listener)
 
-    def render_world_entities(self, surface: pygame.Surface) -> None:
-        for x in range(0, self._width):
-            for y in range(0, self._height):
-                for coin in self._world.coins.values():
-                    self.render_image_entity(surface, coin)
-                for monster in self._world.monsters.values():
-                    self.render_image_entity(surface, monster)
+    def _publish_entities(self, kind: str, left: np.ndarray, entered: np.ndarray) -> None:
+        for listener in self._entity_listeners:
+            listener(kind, left, entered)
 
-    def render_image_entity(self, surface: pygame.Surface, entity: ImageEntity) -> None:
+    def publish_entered_cell(self, entity: ImageEntity) -> None:
         """
-        Renders the entity to the surface relative to the game world.
-        The image associated with the entity is rendered at the entity's
-        position in the camera view, centered on the tile.
+        Records that the entity has entered the cell at its current position,
+        to be picked up by pop_entered_cells.
         """
+        self._entered_cells.append((entity, entity.x_pos, entity.y_pos))
 
-        # check if in bounds
-        if entity.x_pos < 0 or entity.x_pos > self.pos_x + self._width:
-            return
-        if entity.y_pos < 0 or entity.y_pos > self.pos_y + self._height:
-            return
+    def pop_entered_cells(self) -> list[tuple[ImageEntity, int, int]]:
+        """
+        Returns the (entity, x, y) events published since the last call, in
+        the order they happened, and clears them.
+        """
+        entered_cells = self._entered_cells
+        self._entered_cells = []
+        return entered_cells
+
+    def pop_monsters_moved(self) -> bool:
+        """
+        Returns whether any monster has moved since the last call, and clears
+        the flag.
+        """
+        monsters_moved = self._monsters_moved
+        self._monsters_moved = False
+        return monsters_moved
 
-        # center the entity image on the tile
-        x_offset = self._tile_size // 2 - entity.image.get_width() // 2
-        y_offset = self._tile_size // 2 - entity.image.get_height() // 2
+    def get_tile_at_position(self, x: int, y: int) -> Tile:
 
-        entity_x = (entity.x_pos - self.pos_x) * self._tile_size + x_offset
-        entity_y = (entity.y_pos - self.pos_y) * self._tile_size + y_offset
+        # Check if the position is out of bounds. If so, return a bounds tile.
+        if x < 0 or x >= self._width or y < 0 or y >= self._height:
+            return Tile.BOUNDS
 
-        surface.blit(entity.image, (entity_x, entity_y))
+        return TILES_BY_ID[self._tile_grid.get(x, y)] # type: ignore
 
-    def center_on_point(self, x: int, y: int) -> None:
+    def set_tile_at_position(self, x: int, y: int, tile: Tile) -> None:
+        was_collidable = self.is_collidable_at_position(x, y)
+        self._tile_grid.set(x, y, tile.value)
+        if tile.is_collidable != was_collidable and not self._is_occupied(x, y): # type: ignore
+            chunk = self._tile_grid.chunk_numbers(x, y)
+            self._free_counts[chunk] += -1 if tile.is_collidable else 1 # type: ignore
+            self._free_lists.pop(chunk, None)
+        self._flow_fields.clear()
+        if tile.is_collidable != was_collidable: # type: ignore
+            # only the fields of view that can see the tile change
+            for key in list(self._fields_of_view):
+                fov_x, fov_y, radius = key
+                if abs(x - fov_x) <= radius and abs(y - fov_y) <= radius:
+                    del self._fields_of_view[key]
+        for listener in self._tile_listeners:
+            listener(x, y)
+
+    def is_collidable_at_position(self, x: int, y: int) -> bool:
         """
-        Centers the camera on the given point.
+        Returns whether the tile at the given position is collidable, without
+        looking up the Tile itself. Positions out of bounds are collidable.
         """
-        self.pos_x = x - self._width // 2
-        self.pos_y = y - self._height // 2
+        if x < 0 or x >= self._width or y < 0 or y >= self._height:
+            return True
 
+        return bool(COLLIDABLE_BY_ID[self._tile_grid.get(x, y)])
 
-class ImageEntity:
-    """
-    A game entity that has an pygame Surface image object associated with it.
-    """
+    def passable_positions(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """
+        Returns a boolean array telling for each of the (xs[i], ys[i])
+        positions whether it can be entered. Positions out of bounds are not
+        passable.
+        """
+        xs = np.asarray(xs)
+        ys = np.asarray(ys)
+        in_bounds = (xs >= 0) & (xs < self._width) & (ys >= 0) & (ys < self._height)
+        passable = np.zeros(xs.shape, dtype=bool)
+        passable[in_bounds] = ~COLLIDABLE_BY_ID[
+            self._tile_grid.gather(xs[in_bounds], ys[in_bounds])
+        ]
+        return passable
+
+    def collidable_in_rect(self, x: int, y: int, width: int, height: int) -> np.ndarray:
+        """
+        Returns a height x width boolean array telling which tiles of the
+        given rectangle are collidable. Positions out of bounds are
+        collidable.
+        """
+        collidable = np.ones((height, width), dtype=bool)
+        start_x = max(x, 0)
+        start_y = max(y, 0)
+        end_x = min(x + width, self._width)
+        end_y = min(y + height, self._height)
+        if start_x < end_x and start_y < end_y:
+            tiles = self._tile_grid.rect(start_x, start_y, end_x - start_x, end_y - start_y)
+            collidable[start_y - y : end_y - y, start_x - x : end_x - x] = (
+                COLLIDABLE_BY_ID[tiles]
+            )
+        return collidable
 
-    def __init__(
+    def free_cells(self) -> np.ndarray:
+        """
+        Returns an (N, 2) array with the (x, y) positions of every passable
+        tile that has no coin or monster on it. Reads the whole map.
+        """
+        cells = [
+            self._free_cells_in_chunk(chunk)
+            for chunk in np.flatnonzero(self._free_counts).tolist()
+        ]
+        cells = np.concatenate(cells) if cells else np.empty(0, dtype=np.int64)
+        return np.stack((cells % self._width, cells // self._width), axis=1)
+
+    def neighbour_masks(self) -> np.ndarray:
+        """
+        Returns a boolean array of shape (len(DIRECTIONS), height, width)
+        where [d, y, x] tells whether the tile one step from (x, y) in
+        direction DIRECTIONS[d] is passable.
+        """
+        # include a collidable border for out of bounds
+        padded = ~self.collidable_in_rect(-1, -1, self._width + 2, self._height + 2)
+        masks = np.empty((len(DIRECTIONS), self._height, self._width), dtype=bool)
+        for d, (dx, dy) in enumerate(DIRECTIONS):
+            masks[d] = padded[
+                1 + dy : 1 + dy + self._height, 1 + dx : 1 + dx + self._width
+            ]
+        return masks
+
+    def place_coins(
         self,
-        image: pygame.Surface,
-        x_pos: int,
-        y_pos: int,
+        count: int = COIN_COUNT,
+        sprite: int = COIN_SPRITE,
+        avoid: tuple[int, int] | None = None,
     ) -> None:
-        self.image = image
-        self.x_pos = x_pos
-        self.y_pos = y_pos
-
+        """
+        Places count coins on random free cells other than avoid. Raises a
+        ValueError if there are fewer free cells than coins to place.
+        """
+        cells = self._take_free_cells(count, avoid)
+        self._coins.add(cells % self._width, cells // self._width, sprite)
+        self._publish_entities("coins", np.empty(0, dtype=np.int64), cells)
 
-class Player(ImageEntity):
-    def __init__(self, image: pygame.Surface, x_pos: int, y_pos: int, speed=4) -> None:
-        super().__init__(image, x_pos, y_pos)
+    def add_monsters(
+        self,
+        count: int = MONSTER_COUNT,
+        sprite: int = MONSTER_SPRITE,
+        avoid: tuple[int, int] | None = None,
+    ) -> None:
+        """
+        Adds count monsters on random free cells other than avoid. Raises a
+        ValueError if there are fewer free cells than monsters to add.
+        """
+        cells = self._take_free_cells(count, avoid)
+        self._monsters.add(
+            cells % self._width, cells // self._width, sprite, self._monster_steps
+        )
+        self._publish_entities("monsters", np.empty(0, dtype=np.int64), cells)
+
+    def flow_field(self, x: int, y: int, max_distance: int) -> FlowField:
+        """
+        Returns the flow field towards (x, y) covering the cells up to
+        max_distance steps away. Fields are cached until a tile changes, so
+        asking again for the same cell costs nothing.
+        """
+        key = (x, y, max_distance)
+        flow_field = self._flow_fields.get(key)
+        if flow_field is not None:
+            self._flow_fields.move_to_end(key)
+            return flow_field
+
+        flow_field = FlowField(self, x, y, max_distance)
+        self._flow_fields[key] = flow_field
+        if len(self._flow_fields) > FLOW_FIELD_CACHE_SIZE:
+            self._flow_fields.popitem(last=False)
+        return flow_field
+
+    def field_of_view(self, x: int, y: int, radius: int) -> FieldOfView:
+        """
+        Returns the field of view from (x, y) within radius. Fields are
+        cached until a tile they could see changes between collidable and
+        not, so looking from the same cell again costs nothing.
+        """
+        key = (x, y, radius)
+        field_of_view = self._fields_of_view.get(key)
+        if field_of_view is not None:
+            self._fields_of_view.move_to_end(key)
+            return field_of_view
+
+        field_of_view = FieldOfView(self, x, y, radius)
+        self._fields_of_view[key] = field_of_view
+        if len(self._fields_of_view) > FOV_CACHE_SIZE:
+            self._fields_of_view.popitem(last=False)
+        return field_of_view
+
+    def explore(self, field_of_view: FieldOfView) -> None:
+        """
+        Remembers the tiles visible in the field of view as explored.
+        """
+        ys, xs = np.nonzero(field_of_view.visible)
+        xs = xs + field_of_view.origin_x
+        ys = ys + field_of_view.origin_y
+        inside = (xs >= 0) & (xs < self._width) & (ys >= 0) & (ys < self._height)
+        xs = xs[inside]
+        ys = ys[inside]
+        size = self._tile_grid.chunk_size
+        chunks = self._tile_grid.chunk_numbers(xs, ys)
+        bits = (ys % size) * size + xs % size
+        for chunk in np.unique(chunks).tolist():
+            explored = self._explored.get(chunk)
+            if explored is None:
+                explored = np.zeros(-(-size * size // 8), dtype=np.uint8)
+                self._explored[chunk] = explored
+            chunk_bits = bits[chunks == chunk]
+            np.bitwise_or.at(
+                explored, chunk_bits >> 3, (1 << (chunk_bits & 7)).astype(np.uint8)
+            )
+
+    def explored_in_rect(self, x: int, y: int, width: int, height: int) -> np.ndarray:
+        """
+        Returns a height x width bool array telling which tiles of the
+        rectangle with its top left at (x, y) have been explored. Tiles out
+        of bounds never are.
+        """
+        xs, ys = np.meshgrid(np.arange(x, x + width), np.arange(y, y + height))
+        explored = np.zeros((height, width), dtype=bool)
+        inside = (xs >= 0) & (xs < self._width) & (ys >= 0) & (ys < self._height)
+        xs = xs[inside]
+        ys = ys[inside]
+        size = self._tile_grid.chunk_size
+        chunks = self._tile_grid.chunk_numbers(xs, ys)
+        bits = (ys % size) * size + xs % size
+        found = np.zeros(len(xs), dtype=bool)
+        for chunk in np.unique(chunks).tolist():
+            chunk_explored = self._explored.get(chunk)
+            if chunk_explored is None:
+                continue
+            in_chunk = chunks == chunk
+            chunk_bits = bits[in_chunk]
+            found[in_chunk] = (chunk_explored[chunk_bits >> 3] >> (chunk_bits & 7)) & 1
+        explored[inside] = found
+        return explored
+
+    def move_monsters(self, target: tuple[int, int] | None = None) -> None:
+        """
+        Moves every monster one tile in a random direction, drawn from the
+        world's seeded generator. If a target is given, monsters within
+        MONSTER_CHASE_RADIUS steps of it step towards it instead. See
+        MonsterSwarm.step for which moves are blocked.
+
+        With MONSTER_LOD and a target, only the monsters in the target's
+        chunk and in the chunks around it out to MONSTER_ACTIVE_RADIUS tiles
+        from it are moved, so the cost depends on the monsters near the
+        target rather than on all of them. The others sleep, and once their
+        chunk is active again they first catch up on the random steps they
+        missed, up to MONSTER_CATCH_UP_STEPS of them.
+        """
+        step = self._monster_steps
+        self._monster_steps += 1
+        if target is None:
+            self._step_monsters(None, None)
+            self._monsters.steps[:] = self._monster_steps
+            return
+
+        chase = self.flow_field(target[0], target[1], MONSTER_CHASE_RADIUS)
+        if not MONSTER_LOD:
+            self._step_monsters(None, chase)
+            self._monsters.steps[:] = self._monster_steps
+            return
+
+        size = self._tile_grid.chunk_size
+        active_chunks = -(-MONSTER_ACTIVE_RADIUS // size)
+        active_x = (target[0] // size - active_chunks) * size
+        active_y = (target[1] // size - active_chunks) * size
+        active_size = (2 * active_chunks + 1) * size
+        monsters = self._monsters.in_rect(active_x, active_y, active_size, active_size)
+
+        missed = np.minimum(step - self._monsters.steps[monsters], MONSTER_CATCH_UP_STEPS)
+        for catch_up in range(int(missed.max(initial=0))):
+            self._step_monsters(monsters[missed > catch_up], None)
+        self._step_monsters(monsters, chase)
+        self._monsters.steps[monsters] = self._monster_steps
+
+    def _step_monsters(self, monsters: np.ndarray | None, chase: FlowField | None) -> None:
+        moved_from, moved_to = self._monsters.step(
+            self._rng, self._blocked_cells, chase, monsters
+        )
+        if len(moved_to) == 0:
+            return
+        self._monsters_moved = True
+        self._publish_entities("monsters", moved_from, moved_to)
+
+        # the cells left behind are free again unless they became walls
+        from_x = moved_from % self._width
+        from_y = moved_from // self._width
+        freed = ~COLLIDABLE_BY_ID[self._tile_grid.gather(from_x, from_y)]
+        freed_chunks = self._tile_grid.chunk_numbers(from_x[freed], from_y[freed])
+        taken_chunks = self._tile_grid.chunk_numbers(
+            moved_to % self._width, moved_to // self._width
+        )
+        np.add.at(self._free_counts, freed_chunks, 1)
+        np.subtract.at(self._free_counts, taken_chunks, 1)
+        if self._free_lists:
+            for chunk in np.unique(np.concatenate((freed_chunks, taken_chunks))).tolist():
+                self._free_lists.pop(chunk, None)
+
+    def monster_coordinates(self) -> list[tuple[int, int]]:
+        return list(zip(self._monsters.x.tolist(), self._monsters.y.tolist()))
+
+    def coin_coordinates(self) -> list[tuple[int, int]]:
+        return list(zip(self._coins.x.tolist(), self._coins.y.tolist()))
+
+    def has_monster_at_position(self, x: int, y: int) -> bool:
+        if x < 0 or x >= self._width or y < 0 or y >= self._height:
+            return False
+
+        return bool(self._monsters.occupied(x, y))
+
+    def remove_coin_at_position(self, x: int, y: int) -> bool:
+        """
+        Removes the coin at the given position, returning whether there was
+        one to remove.
+        """
+        if x < 0 or x >= self._width or y < 0 or y >= self._height:
+            return False
+        cell = y * self._width + x
+        if not self._coins.remove_at(cell):
+            return False
+        self._release_cell(x, y)
+        self._publish_entities("coins", np.array([cell]), np.empty(0, dtype=np.int64))
+        return True
+
+    def _is_occupied(self, x: int, y: int) -> bool:
+        return bool(self._coins.occupied(x, y)) or (
+            self.has_monster_at_position(x, y)
+        )
+
+    def _release_cell(self, x: int, y: int) -> None:
+        # an entity left the cell, which is free again unless it became a wall
+        if not self.is_collidable_at_position(x, y):
+            chunk = self._tile_grid.chunk_numbers(x, y)
+            self._free_counts[chunk] += 1
+            self._free_lists.pop(chunk, None)
+
+    def _blocked_cells(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        # whether monsters can't enter the (xs[i], ys[i]) positions because
+        # of a wall or a coin
+        collidable = COLLIDABLE_BY_ID[self._tile_grid.gather(xs, ys)]
+        return collidable | self._coins.occupied(xs, ys)
+
+    def _free_cells_in_chunk(self, chunk: int) -> np.ndarray:
+        # the sorted cell numbers of the free cells in a chunk
+        size = self._tile_grid.chunk_size
+        chunk_y, chunk_x = divmod(chunk, self._tile_grid.chunk_columns)
+        x = chunk_x * size
+        y = chunk_y * size
+        width = min(size, self._width - x)
+        height = min(size, self._height - y)
+        ys, xs = np.nonzero(~self.collidable_in_rect(x, y, width, height))
+        xs += x
+        ys += y
+        free = ~(self._coins.occupied(xs, ys) | self._monsters.occupied(xs, ys))
+        return ys[free].astype(np.int64) * self._width + xs[free]
+
+    def _take_free_cells(self, count: int, avoid: tuple[int, int] | None = None) -> np.ndarray:
+        """
+        Picks count different free cells other than avoid at random and
+        counts them as taken, returning their cell numbers. Raises a
+        ValueError if fewer than count cells are free. Only the chunks the
+        cells are picked from are read, and only if their free cells have
+        changed since the last spawn in them, which mostly leaves spawning
+        to look up and delete cells in the kept free lists.
+        """
+        if avoid is not None:
+            x, y = avoid
+            if not self.is_collidable_at_position(x, y) and not self._is_occupied(x, y):
+                # count the cell as taken while picking the others
+                chunk = self._tile_grid.chunk_numbers(x, y)
+                free = self._free_list(chunk)
+                self._free_lists[chunk] = free[free != y * self._width + x]
+                self._free_counts[chunk] -= 1
+                try:
+                    return self._take_free_cells(count)
+                finally:
+                    self._free_counts[chunk] += 1
+                    self._free_lists.pop(chunk, None)
+
+        total = int(self._free_counts.sum())
+        if count > total:
+            raise ValueError(f"Cannot take {count} free cells, only {total} are free")
+
+        # number all free cells chunk by chunk, draw numbers without
+        # replacement, and look up the cell each number falls on
+        numbers = self._rng.choice(total, count, replace=False)
+        chunk_ends = np.cumsum(self._free_counts)
+        chunks = np.searchsorted(chunk_ends, numbers, side="right")
+        cells = np.empty(count, dtype=np.int64)
+        order = np.argsort(chunks, kind="stable")
+        picked_chunks, starts = np.unique(chunks[order], return_index=True)
+        for chunk, picks in zip(picked_chunks.tolist(), np.split(order, starts[1:])):
+            chunk_start = chunk_ends[chunk] - self._free_counts[chunk]
+            free = self._free_list(chunk)
+            cells[picks] = free[numbers[picks] - chunk_start]
+            self._free_lists[chunk] = np.delete(free, numbers[picks] - chunk_start)
+        np.subtract.at(self._free_counts, chunks, 1)
+        return cells
+
+    def _free_list(self, chunk: int) -> np.ndarray:
+        # the sorted free cells of a chunk, kept until they change
+        free = self._free_lists.get(chunk)
+        if free is not None:
+            self._free_lists.move_to_end(chunk)
+            return free
+
+        free = self._free_cells_in_chunk(chunk)
+        self._free_lists[chunk] = free
+        if len(self._free_lists) > FREE_LIST_CACHE_SIZE:
+            self._free_lists.popitem(last=False)
+        return free
+
+    def sprites_in_rect(
+        self, x: int, y: int, width: int, height: int
+    ) -> list[tuple[int, int, int]]:
+        """
+        Returns (sprite, x, y) for the coins and then the monsters positioned
+        inside the given rectangle of tiles. The cost depends on the size of
+        the rectangle rather than on the number of entities in the world.
+        """
+        sprites, xs, ys = self.sprite_arrays_in_rect(x, y, width, height)
+        return list(zip(sprites.tolist(), xs.tolist(), ys.tolist()))
+
+    def sprite_arrays_in_rect(
+        self, x: int, y: int, width: int, height: int
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns what sprites_in_rect does as arrays of the sprite IDs and of
+        the x and y positions.
+        """
+        found = [
+            (entities, entities.in_rect(x, y, width, height))
+            for entities in (self._coins, self._monsters)
+        ]
+        return (
+            np.concatenate([entities.sprites[indices] for entities, indices in found]),
+            np.concatenate([entities.x[indices] for entities, indices in found]),
+            np.concatenate([entities.y[indices] for entities, indices in found]),
+        )
+
+    @property
+    def width(self):
+        """The width property."""
+        return self._width
+
+    @property
+    def height(self):
+        """The height property."""
+        return self._height
+
+    @property
+    def tile_grid(self) -> ChunkedTileGrid:
+        """The grid holding the tiles of the world."""
+        return self._tile_grid
+
+    @property
+    def coins(self):
+        """
+        A snapshot of the coins as a dict of ImageEntity keyed by position.
+        Moving the entities in it does not move the coins.
+        """
+        return self._snapshot(self._coins)
+
+    @property
+    def monsters(self):
+        """
+        A snapshot of the monsters as a dict of ImageEntity keyed by position.
+        Moving the entities in it does not move the monsters.
+        """
+        return self._snapshot(self._monsters)
+
+    @staticmethod
+    def _snapshot(entities: EntityStore) -> dict[tuple[int, int], ImageEntity]:
+        return {
+            (x, y): ImageEntity(sprite, x, y)
+            for sprite, x, y in zip(
+                entities.sprites.tolist(), entities.x.tolist(), entities.y.tolist()
+            )
+        }
+
+class Tile(Enum):
+    """
+    An enumeration representing the different types of tiles that can be
+    present in the game world. Each tile type has an ID, a color, and a flag
+    indicating whether the tile is collidable or not.
+    """
+
+    FLOOR = (0, (120, 120, 120), False)
+    WALL = (1, (160, 160, 160), True)
+
+    # The bounds tile represents a tile that is outside the bounds of a world
+    BOUNDS = (-1, (0, 0, 0), True)
+
+    def __new__(cls, tile_id, color, is_collidable) -> Tile:
+        obj = object.__new__(cls)
+        obj._value_ = tile_id
+        obj.color = color # type: ignore
+        obj.is_collidable = is_collidable # type: ignore
+        return obj
+
+
+# Lookup tables from the uint8 tile IDs stored in a world grid to their tiles,
+# collidable flags and colors. IDs that have no tile are treated as collidable
+# and drawn like out of bounds tiles.
+TILES_BY_ID: list[Tile | None] = [None] * 256
+COLLIDABLE_BY_ID = np.ones(256, dtype=bool)
+COLORS_BY_ID = np.tile(np.array(Tile.BOUNDS.color, dtype=np.uint8), (256, 1)) # type: ignore
+for _tile in Tile:
+    if _tile.value >= 0:
+        TILES_BY_ID[_tile.value] = _tile
+        COLLIDABLE_BY_ID[_tile.value] = _tile.is_collidable # type: ignore
+        COLORS_BY_ID[_tile.value] = _tile.color # type: ignore
+
+
+def _contains_sorted(sorted_cells: np.ndarray, cells: np.ndarray) -> np.ndarray:
+    # whether each of the cells is in the sorted array sorted_cells
+    if len(sorted_cells) == 0:
+        return np.zeros(np.shape(cells), dtype=bool)
+    i = np.searchsorted(sorted_cells, cells).clip(max=len(sorted_cells) - 1)
+    return sorted_cells[i] == cells
+
+
+class ChunkedTileGrid:
+    """
+    The tile IDs of a world, stored in square chunks of chunk_size x
+    chunk_size tiles that are laid out one after another, each in row major
+    order. A map file holds a grid in the same layout, so a grid opened from
+    one reads its tiles straight from the file through mmap. Its chunks are
+    paged in when they are first read, and the least recently used ones are
+    paged out again once more than cache_size are resident, so maps larger
+    than memory can be played with a bounded footprint. Tiles set on such a
+    grid are kept in memory and never written back to the file.
+
+    The number of passable tiles in each chunk is kept along with the grid,
+    and stored in map files, so that opening a map doesn't read all of it.
+    """
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        chunk_size: int,
+        data: np.ndarray,
+        passable_counts: np.ndarray,
+        file_map: mmap.mmap | None = None,
+        cache_size: int = WORLD_CHUNK_CACHE_SIZE,
+    ) -> None:
+        self.width = width
+        self.height = height
+        self.chunk_size = chunk_size
+        self.chunk_columns = -(-width // chunk_size)
+        self.chunk_rows = -(-height // chunk_size)
+        self._chunk_area = chunk_size * chunk_size
+        self._data = data
+        self._passable_counts = passable_counts
+        self._file_map = file_map
+        self._cache_size = cache_size
+        self._resident: OrderedDict[int, None] = OrderedDict()
+        # the tiles the chunks that were set had before their first change
+        self._originals: dict[int, np.ndarray] = {}
+
+    @classmethod
+    def from_array(
+        cls, tile_grid: list[list[int]] | np.ndarray, chunk_size: int = WORLD_CHUNK_SIZE
+    ) -> ChunkedTileGrid:
+        """Returns an in-memory grid holding the given rows of tile IDs."""
+        tiles = np.asarray(tile_grid, dtype=np.uint8)
+        height, width = tiles.shape
+        rows = -(-height // chunk_size)
+        columns = -(-width // chunk_size)
+        padded = np.full(
+            (rows * chunk_size, columns * chunk_size), PADDING_TILE_ID, dtype=np.uint8
+        )
+        padded[:height, :width] = tiles
+        data = padded.reshape(rows, chunk_size, columns, chunk_size).swapaxes(1, 2)
+        data = data.reshape(-1)
+        passable_counts = (~COLLIDABLE_BY_ID[data]).reshape(rows * columns, -1).sum(axis=1)
+        return cls(width, height, chunk_size, data, passable_counts)
+
+    @classmethod
+    def open(
+        cls, path: str, cache_size: int = WORLD_CHUNK_CACHE_SIZE
+    ) -> ChunkedTileGrid:
+        """
+        Opens the map file at path, without reading its tiles yet. Raises a
+        ValueError if it isn't a map file of the current version.
+        """
+        with open(path, "rb") as file:
+            file_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+        if hasattr(mmap, "MADV_RANDOM"):
+            # chunks are read far apart, so reading ahead only wastes memory
+            file_map.madvise(mmap.MADV_RANDOM)
+        magic, version, chunk_size, width, height = MAP_FILE_HEADER.unpack_from(file_map)
+        if magic != MAP_FILE_MAGIC or version != MAP_FILE_VERSION:
+            raise ValueError(f"{path} is not a version {MAP_FILE_VERSION} map file")
+
+        chunks = -(-width // chunk_size) * -(-height // chunk_size)
+        passable_counts = np.frombuffer(
+            file_map, dtype="<u2", count=chunks, offset=MAP_FILE_HEADER.size
+        ).astype(np.int64)
+        data = np.frombuffer(
+            file_map,
+            dtype=np.uint8,
+            count=chunks * chunk_size * chunk_size,
+            offset=cls._data_offset(chunks),
+        )
+        return cls(
+            width, height, chunk_size, data, passable_counts, file_map, cache_size
+        )
+
+    def save(self, path: str) -> None:
+        """
+        Writes the grid to a map file at path: a header, the number of
+        passable tiles of each chunk, and then the chunks themselves.
+        """
+        chunks = len(self._passable_counts)
+        with open(path, "wb") as file:
+            file.write(
+                MAP_FILE_HEADER.pack(
+                    MAP_FILE_MAGIC, MAP_FILE_VERSION, self.chunk_size, self.width, self.height
+                )
+            )
+            file.write(self._passable_counts.astype("<u2").tobytes())
+            file.seek(self._data_offset(chunks))
+            file.write(self._data)
+
+    def passable_counts(self) -> np.ndarray:
+        """Returns the number of passable tiles in each chunk."""
+        return self._passable_counts.copy()
+
+    def chunk_numbers(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """
+        Returns the numbers of the chunks holding the (xs[i], ys[i])
+        positions. Also works on single positions.
+        """
+        return (ys // self.chunk_size) * self.chunk_columns + xs // self.chunk_size
+
+    def get(self, x: int, y: int) -> int:
+        """Returns the ID of the tile at a position inside the grid."""
+        chunk = self.chunk_numbers(x, y)
+        if self._file_map is not None:
+            self._touch(chunk)
+        size = self.chunk_size
+        return int(self._data[chunk * self._chunk_area + (y % size) * size + x % size])
+
+    def set(self, x: int, y: int, tile_id: int) -> None:
+        """Sets the ID of the tile at a position inside the grid."""
+        chunk = self.chunk_numbers(x, y)
+        if self._file_map is not None:
+            self._touch(chunk)
+        if chunk not in self._originals:
+            self._originals[chunk] = self._chunk(chunk).copy()
+        size = self.chunk_size
+        offset = chunk * self._chunk_area + (y % size) * size + x % size
+        passable_change = int(COLLIDABLE_BY_ID[self._data[offset]]) - int(
+            COLLIDABLE_BY_ID[tile_id]
+        )
+        self._data[offset] = tile_id
+        self._passable_counts[chunk] += passable_change
+
+    def edited_chunks(self) -> dict[int, np.ndarray]:
+        """
+        Returns copies of the tiles of the chunks that were set since the
+        grid was made or opened, by chunk number.
+        """
+        return {chunk: self._chunk(chunk).copy() for chunk in self._originals}
+
+    def restore_chunks(self, chunks: dict[int, np.ndarray]) -> None:
+        """
+        Puts back the chunks returned by edited_chunks, and every other
+        chunk that was set as it originally was, so the grid holds the tiles
+        it had when edited_chunks was called.
+        """
+        for chunk in [chunk for chunk in self._originals if chunk not in chunks]:
+            self._write_chunk(chunk, self._originals.pop(chunk))
+        for chunk, tiles in chunks.items():
+            if chunk not in self._originals:
+                self._originals[chunk] = self._chunk(chunk).copy()
+            self._write_chunk(chunk, tiles)
+
+    def _chunk(self, chunk: int) -> np.ndarray:
+        if self._file_map is not None:
+            self._touch(chunk)
+        return self._data[chunk * self._chunk_area : (chunk + 1) * self._chunk_area]
+
+    def _write_chunk(self, chunk: int, tiles: np.ndarray) -> None:
+        self._chunk(chunk)[:] = tiles
+        self._passable_counts[chunk] = np.count_nonzero(~COLLIDABLE_BY_ID[tiles])
+
+    def gather(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """
+        Returns the IDs of the tiles at the (xs[i], ys[i]) positions, which
+        must all be inside the grid.
+        """
+        xs = np.asarray(xs, dtype=np.int64)
+        ys = np.asarray(ys, dtype=np.int64)
+        chunks = self.chunk_numbers(xs, ys)
+        if self._file_map is not None:
+            for chunk in np.unique(chunks).tolist():
+                self._touch(chunk)
+        size = self.chunk_size
+        # the offsets in the chunks are taken by subtraction, which numpy
+        # does faster than remainders
+        offsets = (ys - ys // size * size) * size + xs - xs // size * size
+        return self._data[chunks * self._chunk_area + offsets]
+
+    def rect(self, x: int, y: int, width: int, height: int) -> np.ndarray:
+        """
+        Returns a height x width array of the IDs of the tiles in the given
+        rectangle, which must be inside the grid.
+        """
+        tiles = np.empty((height, width), dtype=np.uint8)
+        size = self.chunk_size
+        for chunk_y in range(y // size, (y + height - 1) // size + 1):
+            for chunk_x in range(x // size, (x + width - 1) // size + 1):
+                chunk = chunk_y * self.chunk_columns + chunk_x
+                if self._file_map is not None:
+                    self._touch(chunk)
+                start = chunk * self._chunk_area
+                chunk_tiles = self._data[start : start + self._chunk_area].reshape(
+                    size, size
+                )
+
+                # the part of the rectangle covered by this chunk
+                left = max(x, chunk_x * size)
+                top = max(y, chunk_y * size)
+                right = min(x + width, (chunk_x + 1) * size)
+                bottom = min(y + height, (chunk_y + 1) * size)
+                tiles[top - y : bottom - y, left - x : right - x] = chunk_tiles[
+                    top - chunk_y * size : bottom - chunk_y * size,
+                    left - chunk_x * size : right - chunk_x * size,
+                ]
+        return tiles
+
+    def _touch(self, chunk: int) -> None:
+        # marks a chunk of a map file as most recently used
+        resident = self._resident
+        if chunk in resident:
+            resident.move_to_end(chunk)
+            return
+        resident[chunk] = None
+        if len(resident) > self._cache_size:
+            self._page_out(resident.popitem(last=False)[0])
+
+    def _page_out(self, chunk: int) -> None:
+        # edited chunks only exist in memory, so they have to stay
+        if chunk in self._originals or not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        chunks = len(self._passable_counts)
+        start = self._data_offset(chunks) + chunk * self._chunk_area
+        end = start + self._chunk_area
+
+        # only whole pages can be dropped
+        page_start = -(-start // mmap.PAGESIZE) * mmap.PAGESIZE
+        page_end = end // mmap.PAGESIZE * mmap.PAGESIZE
+        if page_start < page_end:
+            self._file_map.madvise(  # type: ignore
+                mmap.MADV_DONTNEED, page_start, page_end - page_start
+            )
+
+    @staticmethod
+    def _data_offset(chunks: int) -> int:
+        # where the chunks start in a map file of the given number of chunks
+        header_size = MAP_FILE_HEADER.size + 2 * chunks
+        return -(-header_size // MAP_FILE_ALIGNMENT) * MAP_FILE_ALIGNMENT
+
+
+class Camera:
+    """
+    A class which represents a camera of a given width and height. It keeps
+    track of the position of the camera in the world, and is used to aid in
+    rendering the world to the screen.
+
+    With a field_of_view set, only the coins and monsters in it are drawn,
+    and the tiles are covered by fog: none in the field of view, some on
+    explored tiles and a full cover elsewhere.
+
+    The camera can zoom out by ZOOM_LEVELS - 1 levels, each halving the
+    tile size and so showing about twice as many tiles across in the same
+    number of pixels. Each level has its own tile layer, drawn at its tile
+    size, and its own copies of the sprites scaled once, and the levels of
+    the last ZOOM_CACHE_SIZE zoom levels used are kept, so nothing is
+    scaled while drawing a frame. The tile layers keep about
+    TILE_CACHE_BYTES of chunks each.
+    """
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        world: World,
+        tile_size: int,
+        sprites: list[pygame.Surface],
+        pos_x: int = 0,
+        pos_y: int = 0,
+    ) -> None:
+
+        self._world = world
+        self._view_width = width * tile_size  # the size of the view in pixels
+        self._view_height = height * tile_size
+        self._base_tile_size = tile_size  # the tile size without zoom
+        self._base_sprites = sprites  # the images of the sprite IDs without zoom
+
+        # the tile layer and sprites of the recently used zoom levels
+        self._levels: OrderedDict[int, tuple[TileLayer, list[pygame.Surface]]] = (
+            OrderedDict()
+        )
+        self.zoom = 0
+        self._width = width  # the size of the view in tiles at the current zoom
+        self._height = height
+        self._tile_size = tile_size
+        self._tile_layer, self._sprites = self._zoom_level(0)
+        self.pos_x = pos_x
+        self.pos_y = pos_y
+        self.shift_x = 0  # how many pixels the view is scrolled past pos_x
+        self.shift_y = 0
+        self.field_of_view: FieldOfView | None = None  # no fog of war if None
+        self.interpolator: Interpolator | None = None  # draws entities between tiles if set
+
+        # [image, screen rect] of the sprites drawn, reused from frame to frame
+        self._blit_items: list[list] = []
+
+        # the fog over the view, and the field of view and view it was made for
+        self._fog: pygame.Surface | None = None
+        self._fog_key: tuple[FieldOfView, int, int, int] | None = None
+
+        # what was in view the last time changed_rects was called
+        self._last_view: tuple[int, int, int, int, int, FieldOfView | None] | None = None
+        self._last_sprites: set[tuple[pygame.Surface, int, int]] = set()
+        self._changed_tiles: set[tuple[int, int]] = set()
+        world.add_tile_listener(lambda x, y: self._changed_tiles.add((x, y)))
+
+    def render_world_tiles(self, surface: pygame.Surface) -> None:
+        """
+        Renders the camera view to the given surface. Tiles are blitted from
+        the cached tile layer rather than drawn one by one.
+        """
+        surface.blits(self.world_tile_blits(), doreturn=False)
+
+    def world_tile_blits(self) -> list[tuple]:
+        """
+        Returns the blits render_world_tiles does: the parts of the tile
+        layer chunks in view, then the fog if there is a field of view.
+        """
+        blits = self._tile_layer.blit_items(
+            self.pos_x,
+            self.pos_y,
+            self._width + 1,
+            self._height + 1,
+            self.shift_x,
+            self.shift_y,
+        )
+        if self.field_of_view is not None:
+            blits.append((self._get_fog(self.field_of_view), (-self.shift_x, -self.shift_y)))
+        return blits
+
+    def render_world_entities(self, surface: pygame.Surface) -> None:
+        """
+        Renders the coins and monsters inside the camera view to the given
+        surface in a single batched blit.
+        """
+        count = self._place_sprites()
+        surface.blits(itertools.islice(self._blit_items, count), doreturn=False)
+
+    def world_entity_blits(self) -> list[list]:
+        """
+        Returns the [image, screen rect] blits render_world_entities does.
+        They are reused by the next call, so must not be kept.
+        """
+        return self._blit_items[: self._place_sprites()]
+
+    def render_image_entity(self, surface: pygame.Surface, entity: ImageEntity) -> None:
+        """
+        Renders the entity to the surface relative to the game world.
+        The image of the entity's sprite is rendered at the entity's
+        position in the camera view, centered on the tile. The player is
+        drawn where the interpolator puts it, if there is one.
+        """
+        surface.blits(self.image_entity_blits(entity), doreturn=False)
+
+    def image_entity_blits(self, entity: ImageEntity) -> list[tuple]:
+        """
+        Returns the blit render_image_entity does, or nothing if the entity
+        is out of view.
+        """
+        x, y = self._entity_position(entity)
+
+        # check if in bounds
+        if x <= self.pos_x - 1 or x >= self.pos_x + self._width + 1:
+            return []
+        if y <= self.pos_y - 1 or y >= self.pos_y + self._height + 1:
+            return []
+
+        return [(self._sprites[entity.sprite], self._screen_position(entity.sprite, x, y))]
+
+    def _entity_position(self, entity: ImageEntity) -> tuple[float, float]:
+        interpolator = self.interpolator
+        if interpolator is not None and entity is interpolator.player:
+            return interpolator.player_position()
+        return entity.x_pos, entity.y_pos
+
+    def _place_sprites(self) -> int:
+        # fills the blit items with the images and screen rectangles of the
+        # coins and monsters in view and in the field of view, and returns
+        # how many there are. The view is widened by a tile, so entities
+        # moving into it are drawn on the way in
+        sprites, xs, ys = self._world.sprite_arrays_in_rect(
+            self.pos_x - 1, self.pos_y - 1, self._width + 3, self._height + 3
+        )
+        if self.field_of_view is not None:
+            visible = self.field_of_view.visible_at(xs, ys)
+            sprites, xs, ys = sprites[visible], xs[visible], ys[visible]
+        if self.interpolator is not None:
+            positions_x, positions_y = self.interpolator.positions(xs, ys)
+        else:
+            positions_x, positions_y = xs, ys
+
+        count = len(sprites)
+        items = self._blit_items
+        while len(items) < count:
+            items.append([None, pygame.Rect(0, 0, 0, 0)])
+        tile_size = self._tile_size
+        screen_x = np.floor((positions_x - self.pos_x) * tile_size).astype(np.int64)
+        screen_y = np.floor((positions_y - self.pos_y) * tile_size).astype(np.int64)
+        images = self._sprites
+        for item, sprite, x, y in zip(
+            items, sprites.tolist(), screen_x.tolist(), screen_y.tolist()
+        ):
+            image = images[sprite]
+            rect = item[1]
+            rect.size = image.get_size()
+            rect.x = x + tile_size // 2 - rect.width // 2 - self.shift_x
+            rect.y = y + tile_size // 2 - rect.height // 2 - self.shift_y
+            item[0] = image
+        return count
+
+    def _get_fog(self, field_of_view: FieldOfView) -> pygame.Surface:
+        # the fog is drawn with one pixel per tile and scaled up, and only
+        # made again when the field of view or the view changes
+        key = (field_of_view, self.pos_x, self.pos_y, self.zoom)
+        if self._fog is not None and self._fog_key == key:
+            return self._fog
+
+        width, height = self._width + 1, self._height + 1
+        alpha = np.full((height, width), 255, dtype=np.uint8)
+        alpha[self._world.explored_in_rect(self.pos_x, self.pos_y, width, height)] = (
+            FOG_EXPLORED_ALPHA
+        )
+        alpha[field_of_view.visible_in_rect(self.pos_x, self.pos_y, width, height)] = 0
+
+        fog = pygame.Surface((width, height), pygame.SRCALPHA)
+        fog.fill((0, 0, 0, 255))
+        pixels = pygame.surfarray.pixels_alpha(fog)
+        pixels[...] = alpha.T
+        del pixels  # unlocks the surface
+        self._fog = pygame.transform.scale(
+            fog, (width * self._tile_size, height * self._tile_size)
+        )
+        self._fog_key = key
+        return self._fog
+
+    def _screen_position(self, sprite: int, x: float, y: float) -> tuple[int, int]:
+        # center the image on the tile
+        image = self._sprites[sprite]
+        x_offset = self._tile_size // 2 - image.get_width() // 2 - self.shift_x
+        y_offset = self._tile_size // 2 - image.get_height() // 2 - self.shift_y
+
+        screen_x = math.floor((x - self.pos_x) * self._tile_size) + x_offset
+        screen_y = math.floor((y - self.pos_y) * self._tile_size) + y_offset
+        return screen_x, screen_y
+
+    def changed_rects(self, player: ImageEntity) -> list[pygame.Rect]:
+        """
+        Returns the areas of the camera view, in pixels, that changed since
+        the last call: the whole view if the camera moved or zoomed or the
+        field of view changed, otherwise the tiles that changed and the
+        places where an entity, including the player, appeared, moved or
+        disappeared.
+        """
+        count = self._place_sprites()
+        sprites = {(item[0], item[1].x, item[1].y) for item in self._blit_items[:count]}
+        player_image = self._sprites[player.sprite]
+        player_x, player_y = self._entity_position(player)
+        sprites.add((player_image, *self._screen_position(player.sprite, player_x, player_y)))
+        changed_tiles = self._changed_tiles
+        self._changed_tiles = set()
+
+        view = (self.pos_x, self.pos_y, self.shift_x, self.shift_y, self.zoom, self.field_of_view)
+        if view != self._last_view:
+            self._last_view = view
+            self._last_sprites = sprites
+            return [pygame.Rect(0, 0, self._view_width, self._view_height)]
+
+        rects = [
+            self._tile_rect(x, y)
+            for x, y in changed_tiles
+            if 0 <= x - self.pos_x <= self._width and 0 <= y - self.pos_y <= self._height
+        ]
+        for image, x, y in sprites ^ self._last_sprites:
+            rects.append(image.get_rect(topleft=(x, y)))
+        self._last_sprites = sprites
+        return rects
+
+    def _tile_rect(self, x: int, y: int) -> pygame.Rect:
+        return pygame.Rect(
+            (x - self.pos_x) * self._tile_size - self.shift_x,
+            (y - self.pos_y) * self._tile_size - self.shift_y,
+            self._tile_size,
+            self._tile_size,
+        )
+
+    def center_on_point(self, x: float, y: float) -> None:
+        """
+        Centers the camera on the given point, which may be between tiles.
+        """
+        left = x - self._width // 2
+        top = y - self._height // 2
+        self.pos_x = math.floor(left)
+        self.pos_y = math.floor(top)
+        self.shift_x = int((left - self.pos_x) * self._tile_size)
+        self.shift_y = int((top - self.pos_y) * self._tile_size)
+
+    def set_zoom(self, zoom: int) -> None:
+        """
+        Switches to the given zoom level, from 0 for the full tile size to
+        ZOOM_LEVELS - 1 for the smallest, keeping the same point in the
+        center of the view.
+        """
+        zoom = min(max(zoom, 0), ZOOM_LEVELS - 1)
+        if zoom == self.zoom:
+            return
+        center_x = self.pos_x + self._width // 2
+        center_y = self.pos_y + self._height // 2
+        self.zoom = zoom
+        self._tile_size = max(1, self._base_tile_size >> zoom)
+        self._width = -(-self._view_width // self._tile_size)
+        self._height = -(-self._view_height // self._tile_size)
+        self._tile_layer, self._sprites = self._zoom_level(zoom)
+        self.center_on_point(center_x, center_y)
+
+    def _zoom_level(self, zoom: int) -> tuple[TileLayer, list[pygame.Surface]]:
+        # the tile layer and sprites of a zoom level, made the first time the
+        # level is used since it was last dropped from the cache
+        level = self._levels.get(zoom)
+        if level is not None:
+            self._levels.move_to_end(zoom)
+            return level
+
+        tile_size = self._tile_size
+        if zoom == 0:
+            sprites = self._base_sprites
+        else:
+            scale = tile_size / self._base_tile_size
+            sprites = [
+                pygame.transform.smoothscale(
+                    image,
+                    (
+                        max(1, round(image.get_width() * scale)),
+                        max(1, round(image.get_height() * scale)),
+                    ),
+                )
+                for image in self._base_sprites
+            ]
+        # chunks keep about the same size in pixels at every level, which is
+        # large, so only as many are kept as fit in TILE_CACHE_BYTES, but at
+        # least the ones a view anywhere can touch
+        chunk_size = TILE_CHUNK_SIZE << zoom
+        chunk_bytes = (chunk_size * tile_size) ** 2 * 4
+        visible = (-(-self._width // chunk_size) + 1) * (-(-self._height // chunk_size) + 1)
+        cache_size = max(visible, min(TILE_CHUNK_CACHE_SIZE, TILE_CACHE_BYTES // chunk_bytes))
+        level = (TileLayer(self._world, tile_size, chunk_size, cache_size), sprites)
+        self._levels[zoom] = level
+        if len(self._levels) > ZOOM_CACHE_SIZE:
+            _, (tile_layer, _) = self._levels.popitem(last=False)
+            tile_layer.close()
+        return level
+
+
+class TileLayer:
+    """
+    An off-screen cache of the tiles of a world. The world is split into square
+    chunks of tiles which are each drawn once into their own surface the first
+    time they are viewed, so a camera only has to blit the part of a chunk it
+    can see. Tiles changed through World.set_tile_at_position are redrawn in
+    place, and the least recently used chunks are dropped once more than
+    TILE_CHUNK_CACHE_SIZE chunks are cached.
+    """
+
+    def __init__(
+        self,
+        world: World,
+        tile_size: int,
+        chunk_size: int = TILE_CHUNK_SIZE,
+        cache_size: int = TILE_CHUNK_CACHE_SIZE,
+    ) -> None:
+        self._world = world
+        self._tile_size = tile_size
+        self._chunk_size = chunk_size
+        self._cache_size = cache_size
+        self._chunks: OrderedDict[tuple[int, int], pygame.Surface] = OrderedDict()
+        world.add_tile_listener(self.redraw_tile)
+
+    def render(
+        self,
+        surface: pygame.Surface,
+        pos_x: int,
+        pos_y: int,
+        width: int,
+        height: int,
+        shift_x: int = 0,
+        shift_y: int = 0,
+    ) -> None:
+        """
+        Blits the tiles in the given rectangle of the world (in tiles) to the
+        surface, with the top left of the rectangle shift_x and shift_y
+        pixels left of and above the top left of the surface. Positions
+        outside of the world are left untouched.
+        """
+        surface.blits(
+            self.blit_items(pos_x, pos_y, width, height, shift_x, shift_y), doreturn=False
+        )
+
+    def blit_items(
+        self,
+        pos_x: int,
+        pos_y: int,
+        width: int,
+        height: int,
+        shift_x: int = 0,
+        shift_y: int = 0,
+    ) -> list[tuple]:
+        """
+        Returns the (chunk, dest, area) blits that render does, so they can
+        be blitted more than once.
+        """
+        start_x = max(pos_x, 0)
+        start_y = max(pos_y, 0)
+        end_x = min(pos_x + width, self._world.width)
+        end_y = min(pos_y + height, self._world.height)
+        if start_x >= end_x or start_y >= end_y:
+            return []
+
+        size = self._chunk_size
+        tile_size = self._tile_size
+        blits = []
+        for chunk_y in range(start_y // size, (end_y - 1) // size + 1):
+            for chunk_x in range(start_x // size, (end_x - 1) // size + 1):
+                chunk = self._get_chunk(chunk_x, chunk_y)
+
+                # the part of the view covered by this chunk, in world tiles
+                left = max(start_x, chunk_x * size)
+                top = max(start_y, chunk_y * size)
+                right = min(end_x, (chunk_x + 1) * size)
+                bottom = min(end_y, (chunk_y + 1) * size)
+
+                area = pygame.Rect(
+                    (left - chunk_x * size) * tile_size,
+                    (top - chunk_y * size) * tile_size,
+                    (right - left) * tile_size,
+                    (bottom - top) * tile_size,
+                )
+                dest = (
+                    (left - pos_x) * tile_size - shift_x,
+                    (top - pos_y) * tile_size - shift_y,
+                )
+                blits.append((chunk, dest, area))
+        return blits
+
+    def redraw_tile(self, x: int, y: int) -> None:
+        """
+        Redraws a single tile if the chunk containing it is currently cached.
+        """
+        chunk = self._chunks.get((x // self._chunk_size, y // self._chunk_size))
+        if chunk is not None:
+            self._draw_tile(chunk, x, y)
+
+    def close(self) -> None:
+        """
+        Drops the cached chunks and stops following tile changes.
+        """
+        self._chunks.clear()
+        self._world.remove_tile_listener(self.redraw_tile)
+
+    def _get_chunk(self, chunk_x: int, chunk_y: int) -> pygame.Surface:
+        key = (chunk_x, chunk_y)
+        chunk = self._chunks.get(key)
+        if chunk is not None:
+            self._chunks.move_to_end(key)
+            return chunk
+
+        size = self._chunk_size
+        tile_size = self._tile_size
+        chunk = pygame.Surface((size * tile_size, size * tile_size))
+        chunk.fill(Tile.BOUNDS.color) # type: ignore
+        start_x = chunk_x * size
+        start_y = chunk_y * size
+        width = min(size, self._world.width - start_x)
+        height = min(size, self._world.height - start_y)
+        if width > 0 and height > 0:
+            # draw a pixel per tile and scale them up to tiles, which is much
+            # faster than filling the tiles one by one for large chunks
+            tiles = self._world.tile_grid.rect(start_x, start_y, width, height)
+            pixels = pygame.surfarray.make_surface(COLORS_BY_ID[tiles].swapaxes(0, 1))
+            chunk.blit(
+                pygame.transform.scale(pixels, (width * tile_size, height * tile_size)),
+                (0, 0),
+            )
+
+        self._chunks[key] = chunk
+        if len(self._chunks) > self._cache_size:
+            self._chunks.popitem(last=False)
+        return chunk
+
+    def _draw_tile(self, chunk: pygame.Surface, x: int, y: int) -> None:
+        tile = self._world.get_tile_at_position(x, y)
+        chunk.fill(
+            tile.color, # type: ignore
+            (
+                (x % self._chunk_size) * self._tile_size,
+                (y % self._chunk_size) * self._tile_size,
+                self._tile_size,
+                self._tile_size,
+            ),
+        )
+
+
+class Minimap:
+    """
+    A small map of the whole world with markers for the coins, the monsters
+    and the player. Each pixel block of the minimap stands for a block of
+    block_size x block_size tiles, a power of two picked so the minimap fits
+    in MINIMAP_SIZE pixels, and is drawn as floor if any of its tiles is.
+
+    The minimap is drawn in full once, through surfarray, and after that
+    only the blocks that changed are drawn again: the world reports changed
+    tiles and moved entities to it, which it counts per block right away,
+    and update redraws the changed blocks every refresh_frames frames. So a
+    frame costs O(changes) and not O(world).
+
+    With fog, only explored blocks and the coins on them are shown, and the
+    monsters are not shown at all.
+    """
+
+    def __init__(
+        self,
+        world: World,
+        fog: bool = False,
+        max_size: int = MINIMAP_SIZE,
+        refresh_frames: int = MINIMAP_REFRESH_FRAMES,
+    ) -> None:
+        self._world = world
+        self._fog = fog
+        self._refresh_frames = refresh_frames
+        tiles_per_pixel = -(-max(world.width, world.height) // max_size)
+        self.block_size = 1 << (tiles_per_pixel - 1).bit_length()
+        block_size = self.block_size
+        self._columns = -(-world.width // block_size)
+        self._rows = -(-world.height // block_size)
+        self._scale = max(1, max_size // max(self._columns, self._rows))  # pixels per block
+        self._frame = 0
+        self.version = 0  # counts the redraws, so callers can tell when it changed
+
+        # the state of every block, flattened in row major order
+        blocks = self._columns * self._rows
+        self._passable = np.zeros(blocks, dtype=bool)
+        self._explored = np.zeros(blocks, dtype=bool)
+        self._counts = {
+            "coins": np.zeros(blocks, dtype=np.int32),
+            "monsters": np.zeros(blocks, dtype=np.int32),
+        }
+        self._player_block = -1
+        self._dirty: list[np.ndarray] = []
+
+        for row in range(self._rows):
+            top = row * block_size
+            strip = slice(row * self._columns, (row + 1) * self._columns)
+            collidable = world.collidable_in_rect(0, top, self._columns * block_size, block_size)
+            self._passable[strip] = ~self._reduce_blocks(collidable).all(axis=(0, 2))
+            if fog:
+                explored = world.explored_in_rect(0, top, self._columns * block_size, block_size)
+                self._explored[strip] = self._reduce_blocks(explored).any(axis=(0, 2))
+        for kind, entities in (("coins", world._coins), ("monsters", world._monsters)):
+            self._counts[kind] += np.bincount(
+                self._blocks_of(entities.y.astype(np.int64) * world.width + entities.x),
+                minlength=blocks,
+            ).astype(np.int32)
+        world.add_tile_listener(self._on_tile)
+        world.add_entity_listener(self._on_entities)
+
+        self.surface = pygame.Surface((self._columns * self._scale, self._rows * self._scale))
+        colors = self._colors(np.arange(blocks)).reshape(self._rows, self._columns, 3)
+        pygame.transform.scale(
+            pygame.surfarray.make_surface(colors.swapaxes(0, 1)),
+            self.surface.get_size(),
+            self.surface,
+        )
+
+    def update(self, player_x: int, player_y: int) -> bool:
+        """
+        Moves the player marker and redraws the blocks that changed, once
+        every refresh_frames calls. Returns whether anything was redrawn.
+        """
+        frame = self._frame
+        self._frame += 1
+        if frame % self._refresh_frames != 0:
+            return False
+
+        player_block = self._blocks_of(np.array([player_y * self._world.width + player_x]))[0]
+        if player_block != self._player_block:
+            self._dirty.append(np.array([self._player_block, player_block]))
+            self._player_block = player_block
+        if not self._dirty:
+            return False
+
+        blocks = np.unique(np.concatenate(self._dirty))
+        self._dirty = []
+        blocks = blocks[blocks >= 0]
+        scale = self._scale
+        for block, color in zip(blocks.tolist(), self._colors(blocks).tolist()):
+            row, column = divmod(block, self._columns)
+            self.surface.fill(color, (column * scale, row * scale, scale, scale))
+        self.version += 1
+        return True
+
+    def explore(self, field_of_view: FieldOfView) -> None:
+        """
+        Shows the blocks with tiles visible in the field of view as explored.
+        """
+        if not self._fog:
+            return
+        ys, xs = np.nonzero(field_of_view.visible)
+        xs = xs + field_of_view.origin_x
+        ys = ys + field_of_view.origin_y
+        inside = (xs >= 0) & (xs < self._world.width) & (ys >= 0) & (ys < self._world.height)
+        blocks = np.unique(self._blocks_of(ys[inside] * self._world.width + xs[inside]))
+        blocks = blocks[~self._explored[blocks]]
+        if len(blocks):
+            self._explored[blocks] = True
+            self._dirty.append(blocks)
+
+    def _reduce_blocks(self, tiles: np.ndarray) -> np.ndarray:
+        # a strip of tiles one block high, split into its blocks
+        block_size = self.block_size
+        return tiles.reshape(block_size, self._columns, block_size)
+
+    def _blocks_of(self, cells: np.ndarray) -> np.ndarray:
+        width = self._world.width
+        block_size = self.block_size
+        return (cells // width // block_size) * self._columns + cells % width // block_size
+
+    def _on_tile(self, x: int, y: int) -> None:
+        block_size = self.block_size
+        column = x // block_size
+        row = y // block_size
+        collidable = self._world.collidable_in_rect(
+            column * block_size, row * block_size, block_size, block_size
+        )
+        block = row * self._columns + column
+        self._passable[block] = not collidable.all()
+        self._dirty.append(np.array([block]))
+
+    def _on_entities(self, kind: str, left: np.ndarray, entered: np.ndarray) -> None:
+        counts = self._counts[kind]
+        left = self._blocks_of(left)
+        entered = self._blocks_of(entered)
+        np.subtract.at(counts, left, 1)
+        np.add.at(counts, entered, 1)
+        if self._fog and kind == "monsters":
+            return  # they aren't shown
+        self._dirty.append(left)
+        self._dirty.append(entered)
+
+    def _colors(self, blocks: np.ndarray) -> np.ndarray:
+        # the color each of the blocks is drawn in
+        colors = np.where(
+            self._passable[blocks, np.newaxis],
+            np.array(Tile.FLOOR.color, dtype=np.uint8), # type: ignore
+            np.array(Tile.WALL.color, dtype=np.uint8), # type: ignore
+        )
+        coins = self._counts["coins"][blocks] > 0
+        if self._fog:
+            explored = self._explored[blocks]
+            colors[~explored] = MINIMAP_UNKNOWN_COLOR
+            colors[coins & explored] = MINIMAP_COIN_COLOR
+        else:
+            colors[coins] = MINIMAP_COIN_COLOR
+            colors[self._counts["monsters"][blocks] > 0] = MINIMAP_MONSTER_COLOR
+        colors[blocks == self._player_block] = MINIMAP_PLAYER_COLOR
+        return colors
+
+
+class Interpolator:
+    """
+    Positions of the player and the monsters between tiles, for drawing
+    their movement smoothly. The simulation moves entities a whole tile at
+    a time, so the interpolator remembers where the player and the monsters
+    moved by the last monster step came from and on which tick, and spreads
+    each move over the ticks until the entity moves again: a player move
+    over the ticks of a held key repeat and a monster move over
+    MONSTER_MOVE_TICKS. Where an entity is drawn then depends on the render
+    time, the tick count plus alpha, the part of a tick left in the game
+    loop's accumulator, so movement looks the same at any frame rate and
+    is never ahead of the simulation.
+
+    The positions are computed with numpy into buffers that are kept from
+    frame to frame and only grow when more entities are in view than ever
+    before.
+    """
+
+    def __init__(self, simulation: Simulation) -> None:
+        self._simulation = simulation
+        self.player = simulation.player
+        self.alpha = 0.0  # the part of a tick passed since the last tick
+        self._width = simulation.world.width
+
+        # the player's last move: the cell it ended on, where it was drawn
+        # when it started and the tick it started on
+        self._player_cell = (self.player.x_pos, self.player.y_pos)
+        self._player_from = (float(self.player.x_pos), float(self.player.y_pos))
+        self._player_tick = simulation.tick_count
+        self._player_ticks = 1  # ticks the move is spread over
+
+        # the last monster moves: the sorted cells entered, the cells left
+        # in the same order, and the tick they were made on
+        self._moved_to = np.empty(0, dtype=np.int64)
+        self._moved_from = np.empty(0, dtype=np.int64)
+        self._moved_tick = 0
+        simulation.world.add_entity_listener(self._on_entities)
+
+        # the buffers positions returns views of
+        self._x = np.empty(0)
+        self._y = np.empty(0)
+
+    def update(self, alpha: float) -> None:
+        """
+        Sets the render time to alpha ticks after the current tick, and
+        starts drawing a move of the player if it moved since the last call.
+        """
+        player = self.player
+        cell = (player.x_pos, player.y_pos)
+        if cell != self._player_cell:
+            # start from where it is drawn now, in case the last move wasn't
+            # done yet
+            self._player_from = self.player_position()
+            self._player_cell = cell
+            self._player_tick = self._simulation.tick_count
+            self._player_ticks = self._simulation._player_move_ticks()
+        self.alpha = alpha
+
+    def player_position(self) -> tuple[float, float]:
+        """
+        Returns where the player is drawn at the render time, in tiles.
+        """
+        progress = self._progress(self._player_tick, self._player_ticks)
+        from_x, from_y = self._player_from
+        x, y = self._player_cell
+        return from_x + (x - from_x) * progress, from_y + (y - from_y) * progress
+
+    def positions(self, xs: np.ndarray, ys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns where the entities on the (xs[i], ys[i]) cells are drawn at
+        the render time, in tiles. The arrays returned are only valid until
+        the next call.
+        """
+        count = len(xs)
+        if len(self._x) < count:
+            self._x = np.empty(max(count, 2 * len(self._x)))
+            self._y = np.empty(len(self._x))
+        x = self._x[:count]
+        y = self._y[:count]
+        np.copyto(x, xs)
+        np.copyto(y, ys)
+
+        progress = self._progress(self._moved_tick, MONSTER_MOVE_TICKS)
+        moved_to = self._moved_to
+        if progress >= 1 or len(moved_to) == 0 or count == 0:
+            return x, y
+
+        # only monsters that moved in the last step are between tiles, and
+        # no coin can be on a cell a monster entered
+        cells = ys.astype(np.int64) * self._width + xs
+        slots = np.searchsorted(moved_to, cells)
+        np.minimum(slots, len(moved_to) - 1, out=slots)
+        moving = moved_to[slots] == cells
+        moved_from = self._moved_from[slots[moving]]
+        from_x = moved_from % self._width
+        from_y = moved_from // self._width
+        x[moving] = from_x + (xs[moving] - from_x) * progress
+        y[moving] = from_y + (ys[moving] - from_y) * progress
+        return x, y
+
+    def _progress(self, tick: int, ticks: int) -> float:
+        # how far a move that started on tick and is spread over ticks is
+        return min(max((self._simulation.tick_count + self.alpha - tick) / ticks, 0.0), 1.0)
+
+    def _on_entities(self, kind: str, left: np.ndarray, entered: np.ndarray) -> None:
+        if kind != "monsters" or len(left) != len(entered):
+            return
+        order = np.argsort(entered)
+        entered = entered[order]
+        left = left[order]
+
+        # monsters that sleep catch up on several steps in one tick, and of
+        # those only the last step is drawn
+        tick = self._simulation.tick_count
+        if tick == self._moved_tick and len(self._moved_to):
+            kept = ~_contains_sorted(np.sort(left), self._moved_to)
+            entered = np.concatenate((self._moved_to[kept], entered))
+            left = np.concatenate((self._moved_from[kept], left))
+            order = np.argsort(entered)
+            entered = entered[order]
+            left = left[order]
+        self._moved_to = entered
+        self._moved_from = left
+        self._moved_tick = tick
+
+
+class EntityStore:
+    """
+    Entities of a world stored as a struct of arrays: the x and y position
+    and the sprite ID of every entity. The entities are indexed by the
+    chunks of WORLD_CHUNK_SIZE x WORLD_CHUNK_SIZE tiles they are in: every
+    chunk that has held an entity gets a grid with the index of the entity
+    on each of its cells, or -1, and the other chunks share one empty grid.
+    So finding the entities on given cells is one array lookup, and moving
+    entities only writes the cells they left and entered, without sorting
+    or touching the chunks elsewhere. There is at most one entity of a
+    store on a cell. Removing an entity moves the last entity into its
+    index.
+    """
+
+    # the arrays holding a value for every entity
+    _columns: tuple[str, ...] = ("x", "y", "sprites")
+
+    def __init__(self, width: int, height: int) -> None:
+        self.x = np.empty(0, dtype=np.int32)
+        self.y = np.empty(0, dtype=np.int32)
+        self.sprites = np.empty(0, dtype=np.uint8)
+        self._width = width
+        self._height = height
+        self._chunk_columns = -(-width // WORLD_CHUNK_SIZE)
+        chunk_count = self._chunk_columns * -(-height // WORLD_CHUNK_SIZE)
+        # the grids of the chunks, flattened in row major order, in rows of
+        # which the first is the empty grid, the number of rows in use, and
+        # the row of the grid of every chunk
+        self._grids = np.full((1, WORLD_CHUNK_SIZE * WORLD_CHUNK_SIZE), -1, dtype=np.int32)
+        self._grid_count = 1
+        self._grid_rows = np.zeros(chunk_count, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def copy(self) -> EntityStore:
+        """
+        Returns a copy of the store that shares no arrays with it.
+        """
+        store = type(self)(self._width, self._height)
+        for name in self._columns + ("_grid_rows",):
+            setattr(store, name, getattr(self, name).copy())
+        store._grids = self._grids[: self._grid_count].copy()
+        store._grid_count = self._grid_count
+        return store
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        """
+        Returns the arrays that describe the store: the sorted cells of the
+        entities, the entity on each of them, and the columns other than
+        the positions, which follow from the cells.
+        """
+        cells = self.y.astype(np.int64) * self._width + self.x
+        indices = np.argsort(cells)
+        arrays = {"cells": cells[indices], "indices": indices}
+        for name in self._columns[2:]:
+            arrays[name] = getattr(self, name)
+        return arrays
+
+    @classmethod
+    def from_arrays(
+        cls, width: int, height: int, arrays: dict[str, np.ndarray]
+    ) -> EntityStore:
+        """
+        Returns a store made from the arrays returned by to_arrays.
+        """
+        store = cls(width, height)
+        cells = np.asarray(arrays["cells"], dtype=np.int64)
+        indices = np.asarray(arrays["indices"], dtype=np.intp)
+        for name in cls._columns[2:]:
+            setattr(store, name, np.asarray(arrays[name], dtype=getattr(store, name).dtype))
+        store.x = np.empty(len(cells), dtype=np.int32)
+        store.y = np.empty(len(cells), dtype=np.int32)
+        store.x[indices] = cells % width
+        store.y[indices] = cells // width
+        store._place(store.x, store.y, np.arange(len(cells)))
+        return store
+
+    def add(self, xs: np.ndarray, ys: np.ndarray, sprite: int) -> None:
+        """Adds entities with the given sprite at the (xs[i], ys[i]) positions."""
+        first = len(self.x)
+        self.x = np.concatenate((self.x, xs)).astype(np.int32)
+        self.y = np.concatenate((self.y, ys)).astype(np.int32)
+        self.sprites = np.concatenate(
+            (self.sprites, np.full(len(xs), sprite, dtype=np.uint8))
+        )
+        self._place(self.x[first:], self.y[first:], np.arange(first, len(self.x)))
+
+    def remove_at(self, cell: int) -> bool:
+        """
+        Removes the entity on the given cell, returning whether there was
+        one to remove.
+        """
+        x = cell % self._width
+        y = cell // self._width
+        index = int(self._entities_at(x, y))
+        if index < 0:
+            return False
+        self._place(x, y, -1)
+
+        last = len(self.x) - 1
+        if index != last:
+            self._place(self.x[last], self.y[last], index)
+            for column in self._columns:
+                getattr(self, column)[index] = getattr(self, column)[last]
+        for column in self._columns:
+            setattr(self, column, getattr(self, column)[:last])
+        return True
+
+    def occupied(self, xs: np.ndarray | int, ys: np.ndarray | int) -> np.ndarray:
+        """Returns whether there is an entity at each of the (xs[i], ys[i]) positions."""
+        return self._entities_at(xs, ys) >= 0
+
+    def in_rect(self, x: int, y: int, width: int, height: int) -> np.ndarray:
+        """
+        Returns the sorted indices of the entities inside the given
+        rectangle of tiles.
+        """
+        start_x = max(x, 0)
+        start_y = max(y, 0)
+        end_x = min(x + width, self._width)
+        end_y = min(y + height, self._height)
+        if start_x >= end_x or start_y >= end_y:
+            return np.empty(0, dtype=np.intp)
+
+        ys, xs = np.mgrid[start_y:end_y, start_x:end_x]
+        entities = self._entities_at(xs.reshape(-1), ys.reshape(-1))
+        return np.sort(entities[entities >= 0]).astype(np.intp)
+
+    def _locate(self, xs: np.ndarray, ys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # the chunk each of the (xs[i], ys[i]) positions is in, and its
+        # offset in the chunk's grid
+        xs = np.asarray(xs)
+        ys = np.asarray(ys)
+        shift = WORLD_CHUNK_SIZE.bit_length() - 1
+        mask = WORLD_CHUNK_SIZE - 1
+        chunks = (ys >> shift) * self._chunk_columns + (xs >> shift)
+        return chunks, ((ys & mask) << shift) | (xs & mask)
+
+    def _entities_at(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        # the index of the entity at each of the (xs[i], ys[i]) positions,
+        # or -1 where there is none
+        chunks, offsets = self._locate(xs, ys)
+        return self._grids[self._grid_rows[chunks], offsets]
+
+    def _place(self, xs: np.ndarray, ys: np.ndarray, entities: np.ndarray | int) -> None:
+        # sets the entities on the (xs[i], ys[i]) positions, giving the
+        # chunks they are in a grid of their own when they get an entity
+        chunks, offsets = self._locate(xs, ys)
+        rows = self._grid_rows[chunks]
+        new = np.unique(chunks[rows == 0])
+        if len(new):
+            count = self._grid_count + len(new)
+            if count > len(self._grids):
+                shape = (max(count, 2 * len(self._grids)), self._grids.shape[1])
+                grown = np.empty(shape, dtype=np.int32)
+                grown[: self._grid_count] = self._grids[: self._grid_count]
+                self._grids = grown
+            self._grids[self._grid_count : count] = -1
+            self._grid_rows[new] = np.arange(self._grid_count, count)
+            self._grid_count = count
+            rows = self._grid_rows[chunks]
+        self._grids[rows, offsets] = entities
+
+
+class MonsterSwarm(EntityStore):
+    """
+    The monsters of a world, which are stepped at once with vectorized
+    operations, either all of them or any subset.
+    """
+
+    _columns = EntityStore._columns + ("steps",)
+
+    def __init__(self, width: int, height: int) -> None:
+        super().__init__(width, height)
+        # the number of world monster steps each monster has been moved for
+        self.steps = np.empty(0, dtype=np.int64)
+
+    def add(self, xs: np.ndarray, ys: np.ndarray, sprite: int, steps: int = 0) -> None:
+        self.steps = np.concatenate((self.steps, np.full(len(xs), steps, dtype=np.int64)))
+        super().add(xs, ys, sprite)
+
+    def step(
+        self,
+        rng: np.random.Generator,
+        blocked: Callable[[np.ndarray, np.ndarray], np.ndarray],
+        chase: FlowField | None = None,
+        monsters: np.ndarray | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Moves the monsters with the given sorted indices, or every monster,
+        one tile in a random direction, or along the chase flow field for
+        monsters inside it. A move is blocked if the target tile is out of
+        bounds, is one of the positions blocked returns True for, had a monster
+        on it before the step, or is also the target of a monster with a
+        lower index. Returns the cell numbers the moved monsters left and
+        entered. vecenv.VectorGame repeats these rules, so changes to them
+        have to be made there too.
+        """
+        if monsters is None:
+            monsters = np.arange(len(self.x))
+        width = self._width
+        directions = rng.integers(0, len(DIRECTIONS), len(monsters))
+        if chase is not None:
+            chase_directions = chase.directions_at(self.x[monsters], self.y[monsters])
+            directions = np.where(chase_directions >= 0, chase_directions, directions)
+        target_x = self.x[monsters] + DIRECTION_X[directions]
+        target_y = self.y[monsters] + DIRECTION_Y[directions]
+
+        inside = np.flatnonzero(
+            (target_x >= 0)
+            & (target_x < width)
+            & (target_y >= 0)
+            & (target_y < self._height)
+        )
+        movers = monsters[inside]
+        targets = target_y[inside].astype(np.int64) * width + target_x[inside]
+
+        # sort the moves by target and then by monster, which puts the first
+        # monster in the swarm targeting a cell ahead of the others, so that
+        # it wins the cell
+        # (the remainders are taken by subtraction, which numpy does faster)
+        moves = np.sort(targets * len(self.x) + movers)
+        targets = moves // len(self.x)
+        movers = moves - targets * len(self.x)
+        target_y = targets // width
+        target_x = targets - target_y * width
+        won = ~blocked(target_x, target_y) & (self._entities_at(target_x, target_y) < 0)
+        won[1:] &= targets[1:] != targets[:-1]
+        movers = movers[won]
+        targets = targets[won]
+
+        # only the grids of the chunks the monsters left and entered change
+        moved_from = self.y[movers].astype(np.int64) * width + self.x[movers]
+        self._place(self.x[movers], self.y[movers], -1)
+        self.x[movers] = target_x[won]
+        self.y[movers] = target_y[won]
+        self._place(self.x[movers], self.y[movers], movers)
+        return moved_from, targets
+
+
+class FlowField:
+    """
+    Breadth-first path distances from a target cell to the passable cells
+    at most max_distance steps away, together with the direction of the
+    first step of a shortest path back to the target. The search is
+    limited to the square of cells within max_distance of the target, so
+    its cost does not depend on the size of the world, and any number of
+    entities can then read their next step from the field in O(1). The
+    chase directions of vecenv.VectorGame are found the same way.
+    """
+
+    def __init__(
+        self, world: World, target_x: int, target_y: int, max_distance: int
+    ) -> None:
+        width = world.width
+        height = world.height
+        self.origin_x = max(target_x - max_distance, 0)
+        self.origin_y = max(target_y - max_distance, 0)
+        end_x = min(target_x + max_distance + 1, width)
+        end_y = min(target_y + max_distance + 1, height)
+
+        # search on a flattened copy of the window padded with a border of
+        # collidable cells, so neighbours never fall outside of it
+        window_width = end_x - self.origin_x
+        window_height = end_y - self.origin_y
+        row = window_width + 2
+        passable = np.zeros((window_height + 2, window_width + 2), dtype=bool)
+        passable[1:-1, 1:-1] = ~world.collidable_in_rect(
+            self.origin_x, self.origin_y, window_width, window_height
+        )
+        passable = passable.reshape(-1)
+        distances = np.full(passable.size, -1, dtype=np.int32)
+        offsets = DIRECTION_Y * row + DIRECTION_X
+
+        frontier = np.array(
+            [(target_y - self.origin_y + 1) * row + target_x - self.origin_x + 1],
+            dtype=np.intp,
+        )
+        if 0 <= target_x < width and 0 <= target_y < height:
+            frontier = frontier[passable[frontier]]
+        else:
+            frontier = frontier[:0]
+        distances[frontier] = 0
+        distance = 0
+        while len(frontier) and distance < max_distance:
+            distance += 1
+            neighbours = (frontier[:, np.newaxis] + offsets).reshape(-1)
+            neighbours = neighbours[passable[neighbours] & (distances[neighbours] < 0)]
+            frontier = np.unique(neighbours)
+            distances[frontier] = distance
+
+        # a cell steps in the first direction whose neighbour is one closer
+        distances = distances.reshape(window_height + 2, window_width + 2)
+        inner = distances[1:-1, 1:-1]
+        directions = np.full(inner.shape, -1, dtype=np.int8)
+        for d, (dx, dy) in enumerate(DIRECTIONS):
+            neighbour = distances[
+                1 + dy : 1 + dy + window_height, 1 + dx : 1 + dx + window_width
+            ]
+            directions[(directions < 0) & (inner > 0) & (neighbour == inner - 1)] = d
+        self.distances = inner
+        self.directions = directions
+
+    def distance_at(self, x: int, y: int) -> int:
+        """
+        Returns the number of steps from (x, y) to the target, or -1 if the
+        target can't be reached within the field.
+        """
+        local_x = x - self.origin_x
+        local_y = y - self.origin_y
+        height, width = self.distances.shape
+        if local_x < 0 or local_x >= width or local_y < 0 or local_y >= height:
+            return -1
+        return int(self.distances[local_y, local_x])
+
+    def directions_at(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """
+        Returns for each of the (xs[i], ys[i]) positions the index in
+        DIRECTIONS of the next step towards the target, or -1 for positions
+        outside of the field and for the target itself.
+        """
+        local_x = np.asarray(xs) - self.origin_x
+        local_y = np.asarray(ys) - self.origin_y
+        height, width = self.directions.shape
+        inside = (local_x >= 0) & (local_x < width) & (local_y >= 0) & (local_y < height)
+        directions = np.full(local_x.shape, -1, dtype=np.int8)
+        directions[inside] = self.directions[local_y[inside], local_x[inside]]
+        return directions
+
+
+class FieldOfView:
+    """
+    The cells visible from an origin cell within a radius, found with
+    symmetric shadowcasting: light spreads out from the center of the
+    origin row by row in each of the four quadrants, walls cast shadows,
+    and a floor cell is visible if the center of the cell is lit, so that
+    visibility is symmetric. Walls are visible if any part of them is lit.
+    Cells outside of the world count as walls.
+
+    The rows are scanned with vectorized operations on all four quadrants
+    at once: the light of a quadrant is kept as flags for the slices of
+    slopes between the edges of the cells in all of its rows, and tables of
+    which slices each cell covers are computed once per radius.
+    """
+
+    def __init__(self, world: World, x: int, y: int, radius: int) -> None:
+        self.x = x
+        self.y = y
+        self.radius = radius
+        self.origin_x = x - radius  # the world position of visible[0, 0]
+        self.origin_y = y - radius
+        size = 2 * radius + 1
+        walls = world.collidable_in_rect(self.origin_x, self.origin_y, size, size)
+        walls = walls.reshape(-1)
+
+        visible = np.zeros(size * size, dtype=bool)
+        visible[radius * size + radius] = True
+        slices, rows = _shadowcasting_rows(radius)
+
+        # the light of the quadrants one after another, and a slice that is
+        # never lit at the end, so ranges can end after the last slice
+        light = np.ones(4 * slices + 1, dtype=bool)
+        light[-1] = False
+        quadrants = light[:-1]
+        for cells, slice_counts, first_slices, centers, near in rows:
+            row_walls = walls.take(cells)
+            lit = np.maximum.reduceat(light, first_slices)
+            seen = lit & (row_walls | np.maximum.reduceat(light, centers)[::2])
+            if near is not None:
+                seen &= near
+            visible[cells[seen]] = True
+            # walls put the slices they cover in shadow for the rows beyond
+            np.greater(quadrants, np.repeat(row_walls, slice_counts), out=quadrants)
+            if not quadrants.any():
+                break
+        self.visible = visible.reshape(size, size)
+
+    def is_visible(self, x: int, y: int) -> bool:
+        """
+        Returns whether the cell at (x, y) is visible.
+        """
+        local_x = x - self.origin_x
+        local_y = y - self.origin_y
+        size = len(self.visible)
+        if local_x < 0 or local_x >= size or local_y < 0 or local_y >= size:
+            return False
+        return bool(self.visible[local_y, local_x])
+
+    def visible_at(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """
+        Returns whether each of the (xs[i], ys[i]) cells is visible.
+        """
+        local_x = xs - self.origin_x
+        local_y = ys - self.origin_y
+        size = len(self.visible)
+        inside = (local_x >= 0) & (local_x < size) & (local_y >= 0) & (local_y < size)
+        visible = np.zeros(len(xs), dtype=bool)
+        visible[inside] = self.visible[local_y[inside], local_x[inside]]
+        return visible
+
+    def visible_in_rect(self, x: int, y: int, width: int, height: int) -> np.ndarray:
+        """
+        Returns a height x width bool array telling which cells of the
+        rectangle with its top left at (x, y) are visible.
+        """
+        rect = np.zeros((height, width), dtype=bool)
+        size = len(self.visible)
+        left = max(x, self.origin_x)
+        top = max(y, self.origin_y)
+        right = min(x + width, self.origin_x + size)
+        bottom = min(y + height, self.origin_y + size)
+        if left < right and top < bottom:
+            rect[top - y : bottom - y, left - x : right - x] = self.visible[
+                top - self.origin_y : bottom - self.origin_y,
+                left - self.origin_x : right - self.origin_x,
+            ]
+        return rect
+
+
+_SHADOWCASTING_ROWS: dict[int, tuple[int, list[tuple[np.ndarray | None, ...]]]] = {}
+
+
+def _shadowcasting_rows(radius: int) -> tuple[int, list[tuple[np.ndarray | None, ...]]]:
+    # the slopes of a quadrant's rows are split into slices at the edges of
+    # the cells of all rows up to radius, computed exactly with fractions.
+    # Returns the number of slices and for each row depth, over the four
+    # quadrants one after another: the window cells of the row, how many
+    # slices each cell covers, the first of them, the ranges of the slices
+    # on either side of each cell's center, and which cells are within the
+    # radius, or None if all of them are
+    tables = _SHADOWCASTING_ROWS.get(radius)
+    if tables is not None:
+        return tables
+
+    edges = sorted(
+        {
+            Fraction(2 * column - 1, 2 * depth)
+            for depth in range(1, radius + 1)
+            for column in range(-depth, depth + 2)
+        }
+        | {Fraction(-1), Fraction(1)}
+    )
+    edges = [edge for edge in edges if -1 <= edge <= 1]
+    slices = len(edges) - 1
+    middles = [(edges[i] + edges[i + 1]) / 2 for i in range(slices)]
+    quadrant_starts = np.arange(4)[:, np.newaxis] * slices
+
+    size = 2 * radius + 1
+    rows = []
+    for depth in range(1, radius + 1):
+        columns = np.arange(-depth, depth + 1)
+
+        # the column of the cell each slice of the row is in, from 0
+        covering = [math.floor(middle * depth + Fraction(1, 2)) + depth for middle in middles]
+        slice_counts = np.bincount(covering, minlength=len(columns))
+        first_slices = np.cumsum(slice_counts) - slice_counts
+
+        # the slices left and right of each center, as ranges to reduce
+        centers = []
+        for column in columns.tolist():
+            center = Fraction(column, depth)
+            i = bisect_left(edges, center)
+            if edges[i] == center:
+                centers.append((max(i - 1, 0), min(i, slices - 1) + 1))
+            else:
+                centers.append((i - 1, i))
+
+        # north, south, east and west, as offsets from the origin
+        offsets = [
+            (columns, np.full_like(columns, -depth)),
+            (columns, np.full_like(columns, depth)),
+            (np.full_like(columns, depth), columns),
+            (np.full_like(columns, -depth), columns),
+        ]
+        cells = np.array([(radius + dy) * size + radius + dx for dx, dy in offsets])
+        near = np.tile(columns**2 + depth**2 <= (radius + 0.5) ** 2, 4)
+        rows.append(
+            (
+                cells.reshape(-1),
+                np.tile(slice_counts, 4),
+                (quadrant_starts + first_slices).reshape(-1),
+                (quadrant_starts[:, :, np.newaxis] + np.array(centers)).reshape(-1),
+                None if near.all() else near,
+            )
+        )
+    tables = (slices, rows)
+    _SHADOWCASTING_ROWS[radius] = tables
+    return tables
+
+
+class TextCache:
+    """
+    A least recently used cache of rendered text surfaces, keyed by text,
+    font and color and holding at most max_size surfaces. Numbers are
+    composed from the cached glyphs of their digits, so a changing counter
+    never needs a full font render once its digits have been seen.
+    """
+
+    def __init__(self, max_size: int = TEXT_CACHE_SIZE) -> None:
+        self._max_size = max_size
+        self._surfaces: OrderedDict[
+            tuple[str, pygame.font.Font, tuple[int, int, int]], pygame.Surface
+        ] = OrderedDict()
+
+    def render(
+        self, font: pygame.font.Font, text: str, color: tuple[int, int, int]
+    ) -> pygame.Surface:
+        """
+        Returns the text rendered antialiased in the given font and color.
+        The returned surface is shared, so it must not be drawn on.
+        """
+        key = (text, font, color)
+        surface = self._surfaces.get(key)
+        if surface is not None:
+            self._surfaces.move_to_end(key)
+            return surface
+
+        surface = font.render(text, True, color)
+        self._surfaces[key] = surface
+        if len(self._surfaces) > self._max_size:
+            self._surfaces.popitem(last=False)
+        return surface
+
+    def render_parts(
+        self,
+        font: pygame.font.Font,
+        parts: tuple[str | int, ...],
+        color: tuple[int, int, int],
+    ) -> pygame.Surface:
+        """
+        Returns a new surface with the parts rendered next to each other.
+        Strings are rendered and cached whole, while integers are put
+        together from the cached glyphs of their digits.
+        """
+        glyphs = []
+        for part in parts:
+            if isinstance(part, int):
+                glyphs.extend(self.render(font, digit, color) for digit in str(part))
+            else:
+                glyphs.append(self.render(font, part, color))
+
+        width = sum(glyph.get_width() for glyph in glyphs)
+        height = max([font.get_height()] + [glyph.get_height() for glyph in glyphs])
+        surface = pygame.Surface((width, height), pygame.SRCALPHA)
+        x = 0
+        for glyph in glyphs:
+            surface.blit(glyph, (x, 0))
+            x += glyph.get_width()
+        return surface
+
+
+class SpriteAtlas:
+    """
+    Sprite images packed into a single surface, each in a named region, so
+    all sprites share one pixel format and one allocation. Sprites are
+    handed out as subsurfaces of the atlas, which blit like any surface.
+
+    load packs the PNG images of the given names and caches the packed
+    atlas as raw pixels on disk, keyed by the names, sizes and modification
+    times of the images, so later startups skip decoding and packing.
+    """
+
+    def __init__(self, surface: pygame.Surface, regions: dict[str, pygame.Rect]) -> None:
+        self.surface = surface
+        self._regions = regions
+
+    @classmethod
+    def pack(
+        cls,
+        images: dict[str, pygame.Surface],
+        max_width: int = ATLAS_MAX_WIDTH,
+        padding: int = ATLAS_PADDING,
+    ) -> SpriteAtlas:
+        """
+        Packs the images into shelves, tallest first, starting a new shelf
+        once a shelf would get wider than max_width.
+        """
+        order = sorted(images, key=lambda name: -images[name].get_height())
+        regions = {}
+        x = y = shelf_height = width = 0
+        for name in order:
+            image_width, image_height = images[name].get_size()
+            if x > 0 and x + image_width > max_width:
+                x = 0
+                y += shelf_height + padding
+                shelf_height = 0
+            regions[name] = pygame.Rect(x, y, image_width, image_height)
+            x += image_width + padding
+            shelf_height = max(shelf_height, image_height)
+            width = max(width, x - padding)
+
+        surface = pygame.Surface((max(width, 1), max(y + shelf_height, 1)), pygame.SRCALPHA)
+        surface.fill((0, 0, 0, 0))
+        for name, region in regions.items():
+            surface.blit(images[name], region)
+        return cls(surface, regions)
+
+    @classmethod
+    def load(
+        cls,
+        names: tuple[str, ...],
+        resource_dir: str = RESOURCE_DIR,
+        cache_dir: str = ATLAS_CACHE_DIR,
+    ) -> SpriteAtlas:
+        """
+        Returns an atlas of the images name.png in resource_dir, from
+        cache_dir if it has been packed before, and stores it there
+        otherwise. A cache that can't be written to, such as on a read-only
+        install, is skipped.
+        """
+        paths = [os.path.join(resource_dir, f"{name}.png") for name in names]
+        key = hashlib.sha1(str(ATLAS_FILE_VERSION).encode())
+        for name, path in zip(names, paths):
+            stat = os.stat(path)
+            key.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+        path = os.path.join(cache_dir, f"atlas-{key.hexdigest()[:16]}.bin")
+        try:
+            return cls.open(path)
+        except (OSError, ValueError, struct.error):
+            pass
+
+        atlas = cls.pack({name: pygame.image.load(path) for name, path in zip(names, paths)})
+
+        # write to a temporary file first so a crash never leaves half an atlas
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            atlas.save(temporary_path)
+            os.replace(temporary_path, path)
+        except OSError:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+        return atlas
+
+    @classmethod
+    def open(cls, path: str) -> SpriteAtlas:
+        """
+        Reads an atlas written by save.
+        """
+        with open(path, "rb") as file:
+            data = file.read()
+
+        magic, version, width, height, count = ATLAS_FILE_HEADER.unpack_from(data)
+        if magic != ATLAS_FILE_MAGIC or version != ATLAS_FILE_VERSION:
+            raise ValueError(f"{path} is not a version {ATLAS_FILE_VERSION} atlas file")
+
+        offset = ATLAS_FILE_HEADER.size
+        regions = {}
+        for _ in range(count):
+            x, y, region_width, region_height, length = ATLAS_FILE_REGION.unpack_from(
+                data, offset
+            )
+            offset += ATLAS_FILE_REGION.size
+            name = data[offset : offset + length].decode()
+            offset += length
+            regions[name] = pygame.Rect(x, y, region_width, region_height)
+
+        pixels = data[offset:]
+        if len(pixels) != width * height * 4:
+            raise ValueError(f"{path} is truncated")
+        return cls(pygame.image.frombytes(pixels, (width, height), "RGBA"), regions)
+
+    def save(self, path: str) -> None:
+        """
+        Writes the atlas with its pixels uncompressed, so opening it is a
+        single read.
+        """
+        width, height = self.surface.get_size()
+        with open(path, "wb") as file:
+            file.write(
+                ATLAS_FILE_HEADER.pack(
+                    ATLAS_FILE_MAGIC, ATLAS_FILE_VERSION, width, height, len(self._regions)
+                )
+            )
+            for name, region in self._regions.items():
+                encoded = name.encode()
+                file.write(ATLAS_FILE_REGION.pack(*region, len(encoded)))
+                file.write(encoded)
+            file.write(pygame.image.tobytes(self.surface, "RGBA"))
+
+    def convert(self) -> None:
+        """
+        Converts the atlas to the pixel format of the display, so blitting
+        its sprites needs no conversion. Needs a display mode to be set.
+        """
+        self.surface = self.surface.convert_alpha()
+
+    def region(self, name: str) -> pygame.Rect:
+        """
+        Returns the area of the atlas holding the named sprite.
+        """
+        return self._regions[name].copy()
+
+    def sprites(self, names: tuple[str, ...]) -> list[pygame.Surface]:
+        """
+        Returns the named sprites as subsurfaces of the atlas, in the given
+        order. They share the atlas pixels, so they must not be drawn on.
+        """
+        return [self.surface.subsurface(self._regions[name]) for name in names]
+
+
+class FrameProfiler:
+    """
+    Times named scopes of the game loop, frame by frame. Wrap the code to
+    time in "with profiler.scope(name):", and call next_frame once per
+    frame with the frame time. The time spent in each scope during a frame
+    is kept in a ring buffer of the last history frames, from which summary
+    computes percentiles, and every timed scope is kept for write_trace,
+    which writes a trace file for chrome://tracing or Perfetto.
+
+    A disabled profiler hands out a shared no-op scope and records nothing,
+    so the instrumentation can stay in place. Scopes of the same name must
+    not be nested.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        history: int = PROFILER_HISTORY,
+        trace_path: str | None = None,
+    ) -> None:
+        self.enabled = enabled
+        self.trace_path = trace_path  # where close writes the trace, if anywhere
+        self.frame_count = 0
+        self._history = history
+        self._scopes: dict[str, ProfilerScope] = {}
+        self._columns = ["frame"]  # the frame time, then the scopes
+        self._current = [0.0]  # milliseconds spent in each column this frame
+        self._samples: np.ndarray | None = None  # history x columns milliseconds
+        self._trace: deque[tuple[str, float, float]] = deque(maxlen=PROFILER_TRACE_EVENTS)
+        self._frame_start = time.perf_counter()
+
+    def scope(self, name: str) -> ProfilerScope | nullcontext:
+        """
+        Returns a context manager timing the code run in it under name.
+        """
+        if not self.enabled:
+            return _DISABLED_SCOPE
+        scope = self._scopes.get(name)
+        if scope is None:
+            scope = ProfilerScope(self, name, len(self._columns))
+            self._scopes[name] = scope
+            self._columns.append(name)
+            self._current.append(0.0)
+        return scope
+
+    def next_frame(self, delta: float) -> None:
+        """
+        Ends the current frame, which took delta milliseconds.
+        """
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self._trace.append(("frame", self._frame_start, now - self._frame_start))
+        self._frame_start = now
+
+        columns = len(self._columns)
+        if self._samples is None or self._samples.shape[1] < columns:
+            samples = np.full((self._history, columns), np.nan)
+            if self._samples is not None:
+                samples[:, : self._samples.shape[1]] = self._samples
+            self._samples = samples
+
+        self._current[0] = delta
+        self._samples[self.frame_count % self._history, :columns] = self._current
+        self._current = [0.0] * columns
+        self.frame_count += 1
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """
+        Returns the mean and percentiles of the frame time and of the time
+        spent in each scope per frame, in milliseconds, over the recorded
+        frames.
+        """
+        if self._samples is None or self.frame_count == 0:
+            return {}
+        samples = self._samples[: min(self.frame_count, self._history)]
+        summary = {}
+        for column, name in enumerate(self._columns[: samples.shape[1]]):
+            values = samples[:, column]
+            values = values[~np.isnan(values)]
+            if len(values) == 0:
+                continue
+            p50, p95, p99 = np.percentile(values, (50, 95, 99))
+            summary[name] = {
+                "mean_ms": float(values.mean()),
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "p99_ms": float(p99),
+                "max_ms": float(values.max()),
+            }
+        return summary
+
+    def write_trace(self, path: str) -> None:
+        """
+        Writes the timed frames and scopes kept as a Chrome trace event
+        file, with times in microseconds.
+        """
+        events = [
+            {
+                "name": name,
+                "ph": "X",
+                "ts": start * 1e6,
+                "dur": duration * 1e6,
+                "pid": 0,
+                "tid": 0,
+            }
+            for name, start, duration in self._trace
+        ]
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+    def close(self) -> None:
+        """
+        Writes the trace to trace_path, if it is set.
+        """
+        if self.trace_path is not None:
+            self.write_trace(self.trace_path)
+
+
+class ProfilerScope:
+    """
+    A named scope of a FrameProfiler, adding the time spent in it to the
+    profiler's current frame.
+    """
+
+    __slots__ = ("_profiler", "_name", "_column", "_start")
+
+    def __init__(self, profiler: FrameProfiler, name: str, column: int) -> None:
+        self._profiler = profiler
+        self._name = name
+        self._column = column
+        self._start = 0.0
+
+    def __enter__(self) -> ProfilerScope:
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        duration = time.perf_counter() - self._start
+        profiler = self._profiler
+        profiler._current[self._column] += duration * 1000
+        profiler._trace.append((self._name, self._start, duration))
+
+
+_DISABLED_SCOPE = nullcontext()  # the scope handed out by disabled profilers
+
+
+class ImageEntity:
+    """
+    A game entity drawn with an image, which it refers to by its sprite ID.
+    """
+
+    __slots__ = ("sprite", "x_pos", "y_pos")
+
+    def __init__(
+        self,
+        sprite: int,
+        x_pos: int,
+        y_pos: int,
+    ) -> None:
+        self.sprite = sprite
+        self.x_pos = x_pos
+        self.y_pos = y_pos
+
+
+class Player(ImageEntity):
+    __slots__ = ("move_up", "move_down", "move_left", "move_right", "speed")
+
+    def __init__(self, sprite: int, x_pos: int, y_pos: int, speed=4) -> None:
+        super().__init__(sprite, x_pos, y_pos)
         self.move_up = 0
         self.move_down = 0
         self.move_left = 0
@@ -475,18 +3600,80 @@ class Player(ImageEntity):
         self.speed = speed  # speed in tiles per second
 
     def move(self, world: World):
+        old_x_pos, old_y_pos = self.x_pos, self.y_pos
         new_x_pos = self.x_pos + self.move_right - self.move_left
         new_y_pos = self.y_pos + self.move_down - self.move_up
 
-        if not world.get_tile_at_position(new_x_pos, self.y_pos).is_collidable: # type: ignore
+        if not world.is_collidable_at_position(new_x_pos, self.y_pos):
             self.x_pos = new_x_pos
 
-        if not world.get_tile_at_position(self.x_pos, new_y_pos).is_collidable: # type: ignore
+        if not world.is_collidable_at_position(self.x_pos, new_y_pos):
             self.y_pos = new_y_pos
 
+        if self.x_pos != old_x_pos or self.y_pos != old_y_pos:
+            world.publish_entered_cell(self)
+
     def is_moving(self):
         return bool(self.move_up + self.move_down + self.move_left + self.move_right)
 
 
 if __name__ == "__main__":
-    game = GameApplication()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=GAME_TITLE)
+    parser.add_argument("map", nargs="?", default="", help="a map file to play on")
+    parser.add_argument("--seed", type=int, help="the seed of the game")
+    parser.add_argument(
+        "--maze", type=int, metavar="SIZE", help="play on a generated SIZE x SIZE maze"
+    )
+    parser.add_argument("--record", metavar="PATH", help="record the game to a file")
+    parser.add_argument("--replay", metavar="PATH", help="watch a recorded game")
+    parser.add_argument(
+        "--profile", action="store_true", help="show the profiler overlay, also toggled with F3"
+    )
+    parser.add_argument("--trace", metavar="PATH", help="write a profiler trace file on exit")
+    parser.add_argument("--save", metavar="PATH", help="save the game when quitting")
+    parser.add_argument("--load", metavar="PATH", help="continue a saved game")
+    args = parser.parse_args()
+    if args.load and args.record:
+        parser.error("a recording has to start from a new game, not a saved one")
+    if args.maze and args.map:
+        parser.error("play either on a map file or on a maze, not both")
+    profiler = FrameProfiler(args.profile or args.trace is not None, trace_path=args.trace)
+
+    if args.replay:
+        recording = InputRecording.open(args.replay)
+        game = GameApplication(
+            recording.tile_grid(),
+            recording.coin_count,
+            recording.monster_count,
+            recording.seed,
+            replay=recording,
+            profiler=profiler,
+        )
+    else:
+        seed = args.seed
+        recorder = None
+
+        # a recording needs the seed, and a maze is made from it, so pick one
+        # if none was given
+        if seed is None and (args.record or args.maze):
+            seed = int.from_bytes(os.urandom(4), "little")
+        if args.maze:
+            from mapgen import MAP_CACHE_DIR, cached_maze
+
+            # the maze is played as a map file, so recordings and saved games
+            # can refer to it like to any other map
+            args.map = os.path.join(MAP_CACHE_DIR, f"maze-{args.maze}-s{seed}.map")
+            if not os.path.exists(args.map):
+                maze = cached_maze(args.maze, args.maze, MAZE_CORRIDOR_WIDTH, seed)
+                ChunkedTileGrid.from_array(maze).save(args.map)
+        if args.record:
+            map_path = os.path.abspath(args.map) if args.map else ""
+            recorder = InputRecorder(args.record, seed, map_path=map_path)
+        tile_grid = ChunkedTileGrid.open(args.map) if args.map else MAP
+        game = GameApplication(
+            tile_grid, seed=seed, recorder=recorder, profiler=profiler, save_path=args.save
+        )
+        if args.load:
+            game.restore(GameSnapshot.open(args.load))
+    game.show_profiler = args.profile
+    game.run()
@@ -0,0 +1,137 @@
+"""
+Procedural maze maps for the game world.
+
+A maze is a grid of square rooms of corridor_width x corridor_width floor
+tiles, separated by walls one tile thick, in which the walls between rooms
+are knocked down along a random spanning tree. Generated maps are cached on
+disk keyed by their parameters, so asking for the same maze again only
+costs loading it.
+"""
+
+from __future__ import annotations
+import os
+import numpy as np
+
+MAP_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".map_cache")
+MAZE_VERSION = 1  # bump when the generator changes, to skip stale cached maps
+FLOOR = 0  # tile ID of floor tiles
+WALL = 1  # tile ID of wall tiles
+
+
+def generate_maze(
+    width: int, height: int, corridor_width: int = 4, seed: int = 0
+) -> np.ndarray:
+    """
+    Returns a height x width uint8 array of tile IDs holding a maze with
+    corridors corridor_width tiles wide, surrounded by walls. The same
+    parameters always give the same maze. Tiles left over when the size
+    isn't a whole number of rooms are walls.
+    """
+    pitch = corridor_width + 1
+    rows = (height - 1) // pitch
+    columns = (width - 1) // pitch
+    if rows < 1 or columns < 1:
+        raise ValueError(
+            f"A {width}x{height} map is too small for corridors {corridor_width} wide"
+        )
+
+    west_open, north_open = _spanning_tree(rows, columns, np.random.default_rng(seed))
+
+    # every room is a block of tiles with its north wall in the first row and
+    # its west wall in the first column, opened where the tree joins rooms
+    blocks = np.full((rows, pitch, columns, pitch), WALL, dtype=np.uint8)
+    blocks[:, 1:, :, 1:] = FLOOR
+    blocks[:, 1:, :, 0] = np.where(west_open, FLOOR, WALL)[:, np.newaxis, :]
+    blocks[:, 0, :, 1:] = np.where(north_open, FLOOR, WALL)[:, :, np.newaxis]
+
+    grid = np.full((height, width), WALL, dtype=np.uint8)
+    grid[: rows * pitch, : columns * pitch] = blocks.reshape(rows * pitch, columns * pitch)
+    return grid
+
+
+def cached_maze(
+    width: int,
+    height: int,
+    corridor_width: int = 4,
+    seed: int = 0,
+    cache_dir: str = MAP_CACHE_DIR,
+) -> np.ndarray:
+    """
+    Like generate_maze, but loads the maze from cache_dir if it has been
+    generated before, and stores it there otherwise. A cache that can't be
+    written to, such as on a read-only file system, is skipped.
+    """
+    name = f"maze-v{MAZE_VERSION}-{width}x{height}-c{corridor_width}-s{seed}.npy"
+    path = os.path.join(cache_dir, name)
+    try:
+        return np.load(path)
+    except (OSError, ValueError):
+        pass
+
+    grid = generate_maze(width, height, corridor_width, seed)
+
+    # write to a temporary file first so a crash never leaves half a map
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(temporary_path, "wb") as file:
+            np.save(file, grid)
+        os.replace(temporary_path, path)
+    except OSError:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+    return grid
+
+
+def _spanning_tree(
+    rows: int, columns: int, rng: np.random.Generator
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Builds a random spanning tree of the rooms with an iterative depth-first
+    search, which gives long winding corridors. Returns boolean arrays
+    telling for each room whether its west and its north wall are open.
+    """
+    rooms = rows * columns
+    west_open = bytearray(rooms)
+    north_open = bytearray(rooms)
+    visited = bytearray(rooms)
+    draws = rng.random(rooms * 2).tolist()
+    draw = 0
+
+    start = int(rng.integers(rooms))
+    visited[start] = 1
+    stack = [start]
+    while stack:
+        room = stack[-1]
+        row, column = divmod(room, columns)
+        # the wall between two rooms belongs to the room east or south of it,
+        # so each candidate is (neighbour, wall owner, whether it's a west wall)
+        neighbours = []
+        if column > 0 and not visited[room - 1]:
+            neighbours.append((room - 1, room, True))
+        if column < columns - 1 and not visited[room + 1]:
+            neighbours.append((room + 1, room + 1, True))
+        if row > 0 and not visited[room - columns]:
+            neighbours.append((room - columns, room, False))
+        if row < rows - 1 and not visited[room + columns]:
+            neighbours.append((room + columns, room + columns, False))
+
+        if not neighbours:
+            stack.pop()
+            continue
+
+        neighbour, owner, is_west = neighbours[int(draws[draw] * len(neighbours))]
+        draw += 1
+        if is_west:
+            west_open[owner] = 1
+        else:
+            north_open[owner] = 1
+
+        visited[neighbour] = 1
+        stack.append(neighbour)
+
+    shape = (rows, columns)
+    return (
+        np.frombuffer(west_open, dtype=np.uint8).reshape(shape).astype(bool),
+        np.frombuffer(north_open, dtype=np.uint8).reshape(shape).astype(bool),
+    )
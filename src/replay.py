@@ -0,0 +1,66 @@
+"""
+Replays recorded games headless and as fast as possible.
+
+A recording made with python main.py --record holds the seed and the keys
+of a game, so replaying it runs the exact same game through the game rules
+without a display or any waiting. Each replay is checked against the
+outcome stored in the recording, which catches engine changes that alter
+how games play out, and timed, so a real session doubles as a
+performance workload.
+
+Usage: python replay.py session.rec [more.rec ...] [--repeat 1] [--profile]
+"""
+
+from __future__ import annotations
+import argparse
+import cProfile
+import pstats
+import sys
+import time
+from main import InputRecording, TICKS_PER_SECOND
+
+PROFILE_LINES = 25  # number of functions shown by --profile
+
+
+def replay(path: str) -> tuple[bool, int, float]:
+    """
+    Replays the recording at path. Returns whether it matched the recorded
+    outcome, the number of ticks run and the seconds it took.
+    """
+    recording = InputRecording.open(path)
+    simulation = recording.new_game()
+    start = time.perf_counter()
+    ticks = recording.run(simulation)
+    return recording.matches(simulation), ticks, time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("recordings", nargs="+")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--profile", action="store_true")
+    args = parser.parse_args()
+
+    profiler = cProfile.Profile() if args.profile else None
+    all_match = True
+    for path in args.recordings:
+        for _ in range(args.repeat):
+            if profiler is not None:
+                profiler.enable()
+            matches, ticks, seconds = replay(path)
+            if profiler is not None:
+                profiler.disable()
+            all_match = all_match and matches
+            print(
+                f"{path}: {ticks} ticks ({ticks / TICKS_PER_SECOND:.0f} s of game time) "
+                f"in {seconds:.2f} s, {ticks / max(seconds, 1e-9):.0f} ticks/sec, "
+                f"{'matches' if matches else 'DIFFERS FROM'} the recorded outcome"
+            )
+
+    if profiler is not None:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(PROFILE_LINES)
+    sys.exit(0 if all_match else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Parameter sweeps of many seeded headless games, spread over a process pool.
+
+Every combination of coin count, monster count, map size and player speed
+is played for a number of games, each with its own seed derived from the
+sweep seed, by a random or a scripted player. The games run as plain
+simulations without any display in worker processes, and the result of
+every game is written to a JSONL or CSV file as soon as it finishes, so a
+long sweep can be watched and a stopped one still leaves its results. The
+same arguments always play the same games. Results record the width and
+height of the map played rather than the size asked for, as the default
+map used for size 32 is not square.
+
+Usage: python sweep.py [--coins 50] [--monsters 20] [--sizes 32]
+                       [--speeds 4] [--games 100] [--player random]
+                       [--max-ticks 12000] [--seed 0] [--workers N]
+                       [--output sweep.jsonl]
+"""
+
+from __future__ import annotations
+import argparse
+import csv
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from main import (
+    COIN_COUNT,
+    MONSTER_COUNT,
+    MOVEMENT_KEYS,
+    PLAYER_MOVEMENT_SPEED,
+    TICKS_PER_SECOND,
+    Simulation,
+)
+from benchmark import make_map
+
+PLAYERS = ("random", "scripted")  # the kinds of players a sweep can use
+KEY_SECONDS = 1  # seconds a player holds a key before picking the next one
+RESULT_FIELDS = (
+    "game",
+    "coins",
+    "monsters",
+    "map_width",
+    "map_height",
+    "speed",
+    "player",
+    "seed",
+    "score",
+    "survival_ticks",
+    "caught",
+    "won",
+)
+
+_maps: dict[tuple[int, int], np.ndarray] = {}  # maps already loaded by a worker
+
+
+def game_seed(sweep_seed: int, combination: int, game: int) -> int:
+    """
+    Returns the seed of a game of a sweep, which only depends on the sweep
+    seed and the position of the game in the sweep.
+    """
+    sequence = np.random.SeedSequence((sweep_seed, combination, game))
+    return int(sequence.generate_state(1)[0])
+
+
+def play_game(task: dict[str, object]) -> dict[str, object]:
+    """
+    Plays the game described by task until the player is caught or
+    max_ticks ticks have passed, and returns its result. Runs in the worker
+    processes.
+    """
+    size = int(task["map_size"])  # type: ignore
+    map_seed = int(task["map_seed"])  # type: ignore
+    key = (size, map_seed)
+    if key not in _maps:
+        _maps[key] = make_map(size, map_seed)
+
+    seed = int(task["seed"])  # type: ignore
+    simulation = Simulation.new_game(
+        _maps[key], int(task["coins"]), int(task["monsters"]), seed  # type: ignore
+    )
+    simulation.player.speed = int(task["speed"])  # type: ignore
+
+    # a random player holds a random arrow key, a scripted one cycles
+    # through them, each changing key every KEY_SECONDS
+    keys = list(MOVEMENT_KEYS)
+    rng = np.random.default_rng(seed)
+    held = None
+    max_ticks = int(task["max_ticks"])  # type: ignore
+    while simulation.tick_count < max_ticks and not simulation.game_over:
+        if simulation.tick_count % (KEY_SECONDS * TICKS_PER_SECOND) == 0:
+            if held is not None:
+                simulation.queue_key(held, False)
+            if task["player"] == "random":
+                held = keys[rng.integers(len(keys))]
+            else:
+                held = keys[simulation.tick_count // (KEY_SECONDS * TICKS_PER_SECOND) % len(keys)]
+            simulation.queue_key(held, True)
+        simulation.tick()
+
+    result = {name: task[name] for name in RESULT_FIELDS if name in task}
+    map_height, map_width = _maps[key].shape
+    result.update(
+        map_width=map_width,
+        map_height=map_height,
+        score=simulation.coin_count,
+        survival_ticks=simulation.tick_count,
+        caught=simulation.game_over,
+        won=simulation.coin_count >= simulation.total_coins,
+    )
+    return result
+
+
+def make_tasks(args: argparse.Namespace) -> list[dict[str, object]]:
+    """
+    Returns the games of the sweep in a fixed order, numbered by game.
+    """
+    tasks = []
+    grid = itertools.product(args.coins, args.monsters, args.sizes, args.speeds)
+    for combination, (coins, monsters, size, speed) in enumerate(grid):
+        for game in range(args.games):
+            tasks.append(
+                {
+                    "game": len(tasks),
+                    "coins": coins,
+                    "monsters": monsters,
+                    "map_size": size,
+                    "map_seed": args.seed,
+                    "speed": speed,
+                    "player": args.player,
+                    "seed": game_seed(args.seed, combination, game),
+                    "max_ticks": args.max_ticks,
+                }
+            )
+    return tasks
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--coins", type=int, nargs="+", default=[COIN_COUNT])
+    parser.add_argument("--monsters", type=int, nargs="+", default=[MONSTER_COUNT])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[32])
+    parser.add_argument("--speeds", type=int, nargs="+", default=[PLAYER_MOVEMENT_SPEED])
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--player", choices=PLAYERS, default="random")
+    parser.add_argument("--max-ticks", type=int, default=600 * TICKS_PER_SECOND)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output", default="sweep.jsonl")
+    args = parser.parse_args()
+
+    tasks = make_tasks(args)
+
+    # make the maps once up front, so the workers only load them
+    for size in set(args.sizes):
+        make_map(size, args.seed)
+
+    start = time.perf_counter()
+    with open(args.output, "w", newline="") as file:
+        if args.output.endswith(".csv"):
+            writer = csv.DictWriter(file, RESULT_FIELDS)
+            writer.writeheader()
+            write = writer.writerow
+        else:
+            write = lambda result: file.write(json.dumps(result) + "\n")
+
+        with ProcessPoolExecutor(args.workers) as pool:
+            futures = [pool.submit(play_game, task) for task in tasks]
+            for done, future in enumerate(as_completed(futures), 1):
+                write(future.result())
+                file.flush()
+                if done % 100 == 0 or done == len(tasks):
+                    elapsed = time.perf_counter() - start
+                    print(f"{done} / {len(tasks)} games, {done / elapsed:.1f} games/sec")
+
+
+if __name__ == "__main__":
+    main()
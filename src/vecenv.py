@@ -0,0 +1,304 @@
+"""
+Many independent games stepped in lockstep, for training and evaluating bots.
+
+VectorGame plays num_envs games on the same map with the rules of the
+game, using numpy operations over all games at once and no pygame at all:
+the player moves one tile per step, coins are collected by walking onto
+them and monsters move at the same pace relative to the player as in the
+game, chasing the player when it is close. Each step takes one action per
+game and returns array shaped observations, rewards and terminals, and
+games that ended are reset straight away.
+
+    games = VectorGame(1024, seed=0)
+    observations = games.reset()
+    observations, rewards, dones = games.step(actions)
+
+The rules are written again here for many games at once rather than shared
+with main, so they have to be kept in sync with:
+
+- Simulation.new_game, which spawns coins and monsters on distinct free
+  cells other than PLAYER_START (VectorGame._reset),
+- MonsterSwarm.step, which blocks moves into walls, coins, monsters and
+  cells a monster earlier in the swarm targets (VectorGame._move_monsters),
+- FlowField, whose first direction one step closer is the chase direction
+  (_chase_directions),
+- Simulation.check_collisions, which ends the game when the player enters a
+  monster's cell or a monster enters the player's (VectorGame.step).
+
+VectorGameTest in the tests plays both versions side by side.
+"""
+
+from __future__ import annotations
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from main import (
+    COIN_COUNT,
+    COLLIDABLE_BY_ID,
+    DIRECTION_X,
+    DIRECTION_Y,
+    DIRECTIONS,
+    MAP,
+    MONSTER_CHASE_RADIUS,
+    MONSTER_COUNT,
+    MONSTER_MOVE_TICKS,
+    PLAYER_MOVEMENT_SPEED,
+    PLAYER_START,
+    TICKS_PER_SECOND,
+)
+
+VIEW_RADIUS = 3  # observations show the tiles this far around the player
+MAX_STEPS = 1000  # steps after which a game ends even if the player is alive
+CHASE_BLOCK_CELLS = 4096  # player cells whose chase directions are found at once
+OBSERVATION_CHANNELS = ("walls", "coins", "monsters")  # the masks of an observation
+ACTION_COUNT = len(DIRECTIONS) + 1  # standing still, then the DIRECTIONS
+
+
+class VectorGame:
+    """
+    num_envs games on one map, stepped together. Action 0 stands still and
+    action d + 1 moves the player in DIRECTIONS[d]. One step is the time it
+    takes the player to move a tile, and monsters move every
+    monster_period steps, blocked like in MonsterSwarm.step. Within
+    MONSTER_CHASE_RADIUS steps of the player they step towards it like
+    they do along a FlowField.
+
+    A game ends when a monster and the player meet or after max_steps
+    steps. Coins and monsters start on distinct random floor cells other
+    than the player's start.
+    """
+
+    def __init__(
+        self,
+        num_envs: int,
+        tile_grid: list[list[int]] | np.ndarray = MAP,
+        coin_count: int = COIN_COUNT,
+        monster_count: int = MONSTER_COUNT,
+        seed: int | None = None,
+        view_radius: int = VIEW_RADIUS,
+        max_steps: int = MAX_STEPS,
+    ) -> None:
+        tiles = np.asarray(tile_grid, dtype=np.uint8)
+        self.num_envs = num_envs
+        self.height, self.width = tiles.shape
+        self.coin_count = coin_count
+        self.monster_count = monster_count
+        self.view_radius = view_radius
+        self.max_steps = max_steps
+        player_move_ticks = max(1, round(TICKS_PER_SECOND / PLAYER_MOVEMENT_SPEED))
+        self.monster_period = max(1, MONSTER_MOVE_TICKS // player_move_ticks)
+        self._rng = np.random.default_rng(seed)
+
+        # the games keep their grids padded with walls, view_radius and at
+        # least one tile wide, so observation windows and moves never need
+        # bounds checks
+        pad = max(view_radius, 1)
+        self._row = self.width + 2 * pad
+        self._walls = np.pad(COLLIDABLE_BY_ID[tiles], pad, constant_values=True)
+        start = (PLAYER_START[1] + pad) * self._row + PLAYER_START[0] + pad
+        self._start = start
+        floor = np.flatnonzero(~self._walls.reshape(-1))
+        self._floor = floor[floor != start]
+        if coin_count + monster_count > len(self._floor):
+            raise ValueError(
+                f"Cannot place {coin_count + monster_count} coins and monsters "
+                f"on {len(self._floor)} free cells"
+            )
+        self._offsets = DIRECTION_Y * self._row + DIRECTION_X
+
+        # the chase directions around the cells players have been on, found
+        # as they are first needed, and the row of each cell in them
+        size = 2 * MONSTER_CHASE_RADIUS + 1
+        self._chase = np.empty((0, size, size), dtype=np.int8)
+        self._chase_count = 0
+        self._chase_rows = np.full(self._walls.size, -1, dtype=np.int64)
+
+        cells = self._walls.size
+        self._coins = np.zeros((num_envs, cells), dtype=bool)
+        self._monster_grid = np.zeros((num_envs, cells), dtype=bool)
+        self._monsters = np.zeros((num_envs, monster_count), dtype=np.int64)
+        self._players = np.full(num_envs, start, dtype=np.int64)
+        self.steps = np.zeros(num_envs, dtype=np.int64)
+        self.scores = np.zeros(num_envs, dtype=np.int64)
+
+    def reset(self) -> np.ndarray:
+        """
+        Starts every game over and returns their observations.
+        """
+        self._reset(np.arange(self.num_envs))
+        return self.observations()
+
+    def step(self, actions: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Plays one action in every game. Returns the observations, the coins
+        collected as rewards and whether each game ended. Games that ended
+        are reset, so their observations show the start of the next game.
+        """
+        envs = np.arange(self.num_envs)
+        actions = np.asarray(actions)
+
+        # the player moves unless it would walk into a wall
+        moving = actions > 0
+        targets = self._players.copy()
+        targets[moving] += self._offsets[actions[moving] - 1]
+        self._players = np.where(self._walls.reshape(-1)[targets], self._players, targets)
+
+        rewards = self._coins[envs, self._players]
+        self._coins[envs, self._players] = False
+        self.scores += rewards
+
+        # a game ends when the player walks into a monster, before the
+        # monsters move, or when a monster walks into the player
+        dones = self._monster_grid[envs, self._players]
+        self.steps += 1
+        self._move_monsters(np.flatnonzero((self.steps % self.monster_period == 0) & ~dones))
+        dones |= self._monster_grid[envs, self._players] | (self.steps >= self.max_steps)
+        done_envs = np.flatnonzero(dones)
+        if len(done_envs):
+            self._reset(done_envs)
+        return self.observations(), rewards.astype(np.float32), dones
+
+    def observations(self) -> np.ndarray:
+        """
+        Returns a num_envs x 3 x size x size uint8 array with the masks of
+        OBSERVATION_CHANNELS in the size x size window centered on each
+        player, where size is 2 * view_radius + 1. Cells outside of the map
+        are walls.
+        """
+        size = 2 * self.view_radius + 1
+        shape = (self.num_envs, -1, self._row)
+        envs = np.arange(self.num_envs)
+        x = self._players % self._row - self.view_radius
+        y = self._players // self._row - self.view_radius
+        observations = np.empty((self.num_envs, 3, size, size), dtype=np.uint8)
+        walls = sliding_window_view(self._walls, (size, size))
+        observations[:, 0] = walls[y, x]
+        for channel, grid in ((1, self._coins), (2, self._monster_grid)):
+            windows = sliding_window_view(grid.reshape(shape), (size, size), axis=(1, 2))
+            observations[:, channel] = windows[envs, y, x]
+        return observations
+
+    def _move_monsters(self, envs: np.ndarray) -> None:
+        # every monster picks a random direction, or the first step of a
+        # shortest path to the player if it is close enough
+        count = self.monster_count
+        if count == 0 or len(envs) == 0:
+            return
+        monsters = self._monsters[envs]
+        players = self._players[envs, np.newaxis]
+        directions = self._rng.integers(0, len(DIRECTIONS), monsters.shape)
+        radius = MONSTER_CHASE_RADIUS
+        dx = monsters % self._row - players % self._row
+        dy = monsters // self._row - players // self._row
+        near = (np.abs(dx) <= radius) & (np.abs(dy) <= radius)
+        chase = np.full(directions.shape, -1, dtype=np.int8)
+        rows = np.broadcast_to(self._chase_rows_of(players), near.shape)
+        chase[near] = self._chase[rows[near], dy[near] + radius, dx[near] + radius]
+        directions = np.where(chase >= 0, chase, directions)
+
+        # the blocking rules of MonsterSwarm.step, with the cells of all
+        # games numbered one after the other and the monsters of the moving
+        # games numbered in order
+        cells = self._walls.size
+        total = monsters.size
+        targets = envs[:, np.newaxis] * cells + monsters + self._offsets[directions]
+        keys = np.sort(targets.reshape(-1) * total + np.arange(total))
+        targets = keys // total
+        movers = keys % total
+        local = targets % cells
+        free = (
+            ~self._walls.reshape(-1)[local]
+            & ~self._coins.reshape(-1)[targets]
+            & ~self._monster_grid.reshape(-1)[targets]
+        )
+        movers = movers[free]
+        targets = targets[free]
+        won = np.ones(len(targets), dtype=bool)
+        won[1:] = targets[1:] != targets[:-1]
+        movers = movers[won]
+        targets = targets[won]
+
+        moved_envs = envs[movers // count]
+        grid = self._monster_grid.reshape(-1)
+        grid[moved_envs * cells + monsters.reshape(-1)[movers]] = False
+        grid[targets] = True
+        self._monsters[moved_envs, movers % count] = targets % cells
+
+    def _chase_rows_of(self, cells: np.ndarray) -> np.ndarray:
+        # the rows of the chase directions around the cells, finding those
+        # of new cells CHASE_BLOCK_CELLS at a time to bound the memory used
+        missing = np.unique(cells[self._chase_rows[cells] < 0])
+        if len(missing):
+            count = self._chase_count + len(missing)
+            if count > len(self._chase):
+                shape = (max(count, 2 * len(self._chase)),) + self._chase.shape[1:]
+                grown = np.empty(shape, dtype=np.int8)
+                grown[: self._chase_count] = self._chase[: self._chase_count]
+                self._chase = grown
+            for start in range(0, len(missing), CHASE_BLOCK_CELLS):
+                block = missing[start : start + CHASE_BLOCK_CELLS]
+                first = self._chase_count
+                self._chase[first : first + len(block)] = _chase_directions(
+                    self._walls, MONSTER_CHASE_RADIUS, block
+                )
+                self._chase_rows[block] = np.arange(first, first + len(block))
+                self._chase_count += len(block)
+        return self._chase_rows[cells]
+
+    def _reset(self, envs: np.ndarray) -> None:
+        # draw distinct floor cells for the coins and monsters of each game
+        # by taking the smallest of random keys given to every floor cell
+        placed = self.coin_count + self.monster_count
+        keys = self._rng.random((len(envs), len(self._floor)))
+        cells = self._floor[np.argpartition(keys, placed - 1, axis=1)[:, :placed]]
+        coins = cells[:, : self.coin_count]
+        monsters = cells[:, self.coin_count :]
+
+        rows = envs[:, np.newaxis]
+        self._coins[envs] = False
+        self._coins[rows, coins] = True
+        self._monster_grid[envs] = False
+        self._monster_grid[rows, monsters] = True
+        self._monsters[envs] = monsters
+        self._players[envs] = self._start
+        self.steps[envs] = 0
+        self.scores[envs] = 0
+
+
+def _chase_directions(walls: np.ndarray, radius: int, cells: np.ndarray) -> np.ndarray:
+    """
+    Returns for each of the given cells of the padded walls grid, numbered
+    as in the flattened grid, the direction a monster at each offset of at
+    most radius from it steps in to follow a shortest path to it, as an
+    array of len(cells) x (2 * radius + 1) x (2 * radius + 1) indices into
+    DIRECTIONS, with -1 where no path of at most radius steps exists. This
+    is the flow field of every cell, found with breadth-first searches run
+    for all the cells at once.
+    """
+    size = 2 * radius + 1
+    width = walls.shape[1]
+
+    # a window of size + 2 around each cell, bordered by walls, so that the
+    # search never looks outside of it
+    padded = np.pad(walls, radius + 1, constant_values=True)
+    windows = sliding_window_view(padded, (size + 2, size + 2))
+    passable = ~windows[cells // width, cells % width]
+    passable[:, 0, :] = passable[:, -1, :] = False
+    passable[:, :, 0] = passable[:, :, -1] = False
+
+    distances = np.full(passable.shape, -1, dtype=np.int8)
+    center = radius + 1
+    distances[:, center, center] = np.where(passable[:, center, center], 0, -1)
+    for distance in range(1, radius + 1):
+        previous = distances == distance - 1
+        reached = np.zeros(passable.shape, dtype=bool)
+        for dx, dy in DIRECTIONS:
+            reached[:, 1:-1, 1:-1] |= previous[:, 1 + dy : size + 1 + dy, 1 + dx : size + 1 + dx]
+        distances[reached & passable & (distances < 0)] = distance
+
+    # a cell steps in the first direction whose neighbour is one closer
+    inner = distances[:, 1:-1, 1:-1]
+    directions = np.full(inner.shape, -1, dtype=np.int8)
+    for d, (dx, dy) in enumerate(DIRECTIONS):
+        neighbour = distances[:, 1 + dy : size + 1 + dy, 1 + dx : size + 1 + dx]
+        directions[(directions < 0) & (inner > 0) & (neighbour == inner - 1)] = d
+    return directions
@@ -1,13 +1,856 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
 import unittest
 from unittest.mock import patch
 
 from tmc import points, reflect
 from tmc.utils import load, load_module, reload_module, get_stdout, check_source
 
+# the game's modules import each other by name, as when run from src
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import main
+import mapgen
+import numpy as np
+import sweep
+import vecenv
+
 @points('14.own_game')
 class Part14Test(unittest.TestCase):
     def test_1_pygame(self):
         pass
 
+
+class GameLoopTest(unittest.TestCase):
+    def test_stall_is_not_fast_forwarded(self):
+        game = main.GameApplication(seed=1, headless=True)
+        game.step(delta=60_000)
+        self.assertEqual(game.simulation.tick_count, main.MAX_TICKS_PER_FRAME)
+        self.assertLessEqual(game.accumulator, main.TICK_MILLIS * main.MAX_TICKS_PER_FRAME)
+        game.step(delta=0)
+        self.assertFalse(game.is_behind)
+
+    def test_profiler_overlay_restores_profiler(self):
+        game = main.GameApplication(seed=1, headless=True)
+        toggle = main.pygame.event.Event(main.pygame.KEYDOWN, key=main.PROFILER_OVERLAY_KEY)
+        game.handle_events([toggle])
+        self.assertTrue(game.profiler.enabled)
+        game.handle_events([toggle])
+        self.assertFalse(game.profiler.enabled)
+
+        game = main.GameApplication(seed=1, headless=True, profiler=main.FrameProfiler(True))
+        game.handle_events([toggle])
+        game.handle_events([toggle])
+        self.assertTrue(game.profiler.enabled)
+
+
+class HeadlessGameTest(unittest.TestCase):
+    def test_time_only_passes_when_stepped(self):
+        game = main.GameApplication(seed=4, headless=True)
+        self.assertEqual(game.simulation.tick_count, 0)
+        game.step(delta=3 * main.TICK_MILLIS, render=True)
+        self.assertEqual(game.simulation.tick_count, 3)
+
+    def test_scripted_games_are_reproducible(self):
+        def key(kind, key):
+            return main.pygame.event.Event(kind, key=key)
+
+        script = {
+            0: [key(main.pygame.KEYDOWN, main.pygame.K_RIGHT)],
+            40: [key(main.pygame.KEYUP, main.pygame.K_RIGHT)],
+            41: [key(main.pygame.KEYDOWN, main.pygame.K_DOWN)],
+            90: [key(main.pygame.KEYUP, main.pygame.K_DOWN)],
+        }
+        states = []
+        for _ in range(2):
+            game = main.GameApplication(seed=4, headless=True)
+            frames = game.simulate(150, script, render=True)
+            states.append((
+                frames,
+                game.simulation.tick_count,
+                game.simulation.coin_count,
+                (game.player.x_pos, game.player.y_pos),
+                game.world.monster_coordinates(),
+            ))
+        self.assertEqual(states[0], states[1])
+        self.assertNotEqual(states[0][3], main.PLAYER_START)
+
+    def test_quitting_ends_the_game_without_exiting(self):
+        game = main.GameApplication(seed=4, headless=True)
+        game.step([main.pygame.event.Event(main.pygame.QUIT)])
+        self.assertTrue(game.game_over)
+        self.assertEqual(game.simulate(10), 0)
+
+
+class DirtyRectTest(unittest.TestCase):
+    def test_dirty_rects_match_a_full_redraw(self):
+        game = main.GameApplication(seed=6, headless=True)
+        full = game.window.get_rect()
+        rng = random.Random(6)
+        held = set()
+        updates = []
+        with patch.object(main.pygame.display, "update", side_effect=updates.append):
+            for frame in range(300):
+                events = []
+                if rng.random() < 0.05:
+                    key = rng.choice(list(main.MOVEMENT_KEYS))
+                    kind = main.pygame.KEYUP if key in held else main.pygame.KEYDOWN
+                    held ^= {key}
+                    events.append(main.pygame.event.Event(kind, key=key))
+                if frame == 100:
+                    events.append(
+                        main.pygame.event.Event(main.pygame.KEYDOWN, key=main.PROFILER_OVERLAY_KEY)
+                    )
+                game.step(events, render=True)
+                drawn = main.pygame.surfarray.array3d(game.window)
+                game.draw_frame()
+                self.assertTrue((main.pygame.surfarray.array3d(game.window) == drawn).all(), frame)
+                if game.game_over:
+                    break
+        self.assertTrue(any(rects != [full] for rects in updates))
+
+
+class InterpolatorTest(unittest.TestCase):
+    def test_player_moves_are_spread_over_the_move_ticks(self):
+        simulation = main.Simulation.new_game(
+            np.zeros((20, 20), dtype=np.uint8), coin_count=0, monster_count=0, seed=0
+        )
+        interpolator = main.Interpolator(simulation)
+        simulation.queue_key(main.pygame.K_RIGHT, True)
+        simulation.queue_key(main.pygame.K_RIGHT, False)
+        simulation.tick()
+        x, y = main.PLAYER_START
+        self.assertEqual((simulation.player.x_pos, simulation.player.y_pos), (x + 1, y))
+
+        ticks = simulation._player_move_ticks()
+        interpolator.update(0.0)
+        self.assertEqual(interpolator.player_position(), (x, y))
+        interpolator.update(0.5)
+        self.assertAlmostEqual(interpolator.player_position()[0], x + 0.5 / ticks)
+        simulation.advance(ticks - 1)
+        interpolator.update(0.5)
+        self.assertAlmostEqual(interpolator.player_position()[0], x + (ticks - 0.5) / ticks)
+        simulation.advance(1)
+        interpolator.update(0.0)
+        self.assertEqual(interpolator.player_position(), (x + 1, y))
+
+    def test_monsters_are_drawn_between_the_cells_of_their_last_step(self):
+        simulation = main.Simulation.new_game(
+            np.zeros((40, 40), dtype=np.uint8), coin_count=0, monster_count=30, seed=1
+        )
+        interpolator = main.Interpolator(simulation)
+        monsters = simulation.world._monsters
+        while True:
+            from_x, from_y = monsters.x.copy(), monsters.y.copy()
+            simulation.tick()
+            if simulation.tick_count % main.MONSTER_MOVE_TICKS == 0:
+                break
+        to_x, to_y = monsters.x.copy(), monsters.y.copy()
+        self.assertTrue((to_x != from_x).any() or (to_y != from_y).any())
+
+        for alpha in (0.0, 0.25, 0.75):
+            interpolator.update(alpha)
+            x, y = interpolator.positions(to_x, to_y)
+            progress = alpha / main.MONSTER_MOVE_TICKS
+            self.assertTrue(np.allclose(x, from_x + (to_x - from_x) * progress), alpha)
+            self.assertTrue(np.allclose(y, from_y + (to_y - from_y) * progress), alpha)
+        # the move ends just as the next step is made
+        simulation.advance(main.MONSTER_MOVE_TICKS - 1)
+        interpolator.update(1.0)
+        x, y = interpolator.positions(to_x, to_y)
+        self.assertTrue((x == to_x).all() and (y == to_y).all())
+
+
+class TextCacheTest(unittest.TestCase):
+    def test_numbers_are_put_together_from_cached_digits(self):
+        main.pygame.font.init()
+        font = main.pygame.font.Font(None, 24)
+        rendered = []
+
+        class CountingFont:
+            def render(self, text, antialias, color):
+                rendered.append(text)
+                return font.render(text, antialias, color)
+
+            def get_height(self):
+                return font.get_height()
+
+        counting_font = CountingFont()
+        cache = main.TextCache(max_size=16)
+        white = (255, 255, 255)
+        first = cache.render_parts(counting_font, ("Coins: ", 1234567890), white)
+        self.assertEqual(sorted(rendered), sorted(["Coins: "] + list("1234567890")))
+        rendered.clear()
+        for number in (98, 765, 4321):
+            cache.render_parts(counting_font, ("Coins: ", number), white)
+        self.assertEqual(rendered, [])
+        seven = cache.render(counting_font, "7", white)
+        self.assertIs(cache.render(counting_font, "7", white), seven)
+
+        glyphs = [font.render(text, True, white) for text in ["Coins: "] + list("1234567890")]
+        self.assertEqual(first.get_width(), sum(glyph.get_width() for glyph in glyphs))
+
+    def test_least_recently_used_texts_are_dropped(self):
+        main.pygame.font.init()
+        font = main.pygame.font.Font(None, 24)
+        cache = main.TextCache(max_size=2)
+        a = cache.render(font, "a", (255, 255, 255))
+        cache.render(font, "b", (255, 255, 255))
+        self.assertIs(cache.render(font, "a", (255, 255, 255)), a)
+        cache.render(font, "c", (255, 255, 255))
+        self.assertIs(cache.render(font, "a", (255, 255, 255)), a)
+        self.assertEqual(len(cache._surfaces), 2)
+        self.assertNotIn(("b", font, (255, 255, 255)), cache._surfaces)
+
+
+class TileLayerTest(unittest.TestCase):
+    def test_cached_chunks_match_the_world(self):
+        rng = np.random.default_rng(0)
+        world = main.World((rng.random((30, 40)) < 0.3).astype(np.uint8))
+        layer = main.TileLayer(world, 3, chunk_size=8, cache_size=4)
+        surface = main.pygame.Surface((40 * 3, 30 * 3))
+
+        def assert_matches_world(width, height):
+            surface.fill((0, 0, 0))
+            layer.render(surface, 0, 0, width, height)
+            colors = main.COLORS_BY_ID[world.tile_grid.rect(0, 0, width, height)]
+            expected = colors.swapaxes(0, 1).repeat(3, axis=0).repeat(3, axis=1)
+            pixels = main.pygame.surfarray.array3d(surface)[: width * 3, : height * 3]
+            self.assertTrue((pixels == expected).all())
+            self.assertLessEqual(len(layer._chunks), 4)
+
+        assert_matches_world(40, 30)
+        # the view fits in the cache, so changed tiles are redrawn in place
+        assert_matches_world(16, 16)
+        chunks = dict(layer._chunks)
+        for _ in range(30):
+            x, y = (int(v) for v in rng.integers(0, 16, 2))
+            collidable = world.is_collidable_at_position(x, y)
+            world.set_tile_at_position(x, y, main.Tile.FLOOR if collidable else main.Tile.WALL)
+        assert_matches_world(16, 16)
+        self.assertEqual(dict(layer._chunks), chunks)
+
+    def test_zoom_levels_keep_their_chunks_bounded(self):
+        rng = np.random.default_rng(1)
+        tiles = (rng.random((600, 600)) < 0.3).astype(np.uint8)
+        world = main.World(tiles)
+        sprites = [main.pygame.Surface((4, 4))]
+        camera = main.Camera(main.CAMERA_WIDTH, main.CAMERA_HEIGHT, world, main.TILE_SIZE, sprites)
+        surface = main.pygame.Surface((camera._view_width, camera._view_height))
+        for zoom in range(main.ZOOM_LEVELS):
+            camera.set_zoom(zoom)
+            layer = camera._tile_layer
+            tile_size = layer._tile_size
+            for point in [(300.5, 300.25), (190, 410.75), (420.25, 180), (300, 300)]:
+                camera.center_on_point(*point)
+                camera.render_world_tiles(surface)
+                chunks = dict(layer._chunks)
+                camera.render_world_tiles(surface)
+                # the whole view stays cached
+                self.assertEqual(dict(layer._chunks), chunks, (zoom, point))
+                pixels = sum(chunk.get_width() * chunk.get_height() for chunk in chunks.values())
+                self.assertLessEqual(pixels * 4, main.TILE_CACHE_BYTES, (zoom, point))
+
+                xs = camera.pos_x + (np.arange(surface.get_width()) + camera.shift_x) // tile_size
+                ys = camera.pos_y + (np.arange(surface.get_height()) + camera.shift_y) // tile_size
+                expected = main.COLORS_BY_ID[tiles[ys[np.newaxis, :], xs[:, np.newaxis]]]
+                self.assertTrue((main.pygame.surfarray.array3d(surface) == expected).all())
+            self.assertLessEqual(len(camera._levels), main.ZOOM_CACHE_SIZE)
+
+
+class ViewCullingTest(unittest.TestCase):
+    def test_sprites_in_rect_finds_the_entities_inside(self):
+        world = main.World(np.zeros((150, 170), dtype=np.uint8), seed=0)
+        world.place_coins(400, sprite=3)
+        world.add_monsters(900, sprite=4)
+        world.move_monsters()
+        entities = [(3, x, y) for x, y in world.coin_coordinates()] + [
+            (4, x, y) for x, y in world.monster_coordinates()
+        ]
+        rng = np.random.default_rng(1)
+        for _ in range(20):
+            x, y = (int(v) for v in rng.integers(-40, 180, 2))
+            width, height = (int(v) for v in rng.integers(1, 90, 2))
+            expected = [
+                (sprite, entity_x, entity_y)
+                for sprite, entity_x, entity_y in entities
+                if x <= entity_x < x + width and y <= entity_y < y + height
+            ]
+            self.assertEqual(
+                sorted(world.sprites_in_rect(x, y, width, height)), sorted(expected)
+            )
+
+
+class WorldGridTest(unittest.TestCase):
+    def test_batch_queries_match_single_tiles(self):
+        rng = np.random.default_rng(0)
+        grid = (rng.random((23, 31)) < 0.4).astype(np.uint8)
+        world = main.World(grid)
+        from_lists = main.World(grid.tolist())
+        self.assertEqual(
+            from_lists.collidable_in_rect(0, 0, 31, 23).tolist(), grid.astype(bool).tolist()
+        )
+        for y in range(23):
+            for x in range(31):
+                tile = main.Tile.WALL if grid[y, x] else main.Tile.FLOOR
+                self.assertIs(world.get_tile_at_position(x, y), tile)
+        self.assertIs(world.get_tile_at_position(-1, 5), main.Tile.BOUNDS)
+
+        xs, ys = np.meshgrid(np.arange(-2, 34), np.arange(-2, 26))
+        collidable = np.array([
+            [world.is_collidable_at_position(x, y) for x in range(-2, 34)]
+            for y in range(-2, 26)
+        ])
+        self.assertEqual(world.collidable_in_rect(-2, -2, 36, 28).tolist(), collidable.tolist())
+        self.assertEqual(world.passable_positions(xs, ys).tolist(), (~collidable).tolist())
+        masks = world.neighbour_masks()
+        for d, (dx, dy) in enumerate(main.DIRECTIONS):
+            self.assertEqual(
+                masks[d].tolist(), (~collidable[2 + dy : 25 + dy, 2 + dx : 33 + dx]).tolist()
+            )
+
+
+class FreeCellTest(unittest.TestCase):
+    def assert_free_cells_match(self, world):
+        for chunk, count in enumerate(world._free_counts.tolist()):
+            free = world._free_cells_in_chunk(chunk)
+            self.assertEqual(count, len(free))
+            if chunk in world._free_lists:
+                self.assertEqual(world._free_lists[chunk].tolist(), free.tolist())
+
+    def test_free_cells_stay_consistent(self):
+        rng = np.random.default_rng(0)
+        world = main.World((rng.random((150, 130)) < 0.3).astype(np.uint8), seed=0)
+        world.place_coins(2000)
+        world.add_monsters(500)
+        self.assert_free_cells_match(world)
+        for step in range(40):
+            world.move_monsters((60, 60) if step % 2 else None)
+            for x, y in world.coin_coordinates()[:5]:
+                self.assertTrue(world.remove_coin_at_position(x, y))
+            x, y = (int(v) for v in rng.integers(0, 130, 2))
+            collidable = world.is_collidable_at_position(x, y)
+            world.set_tile_at_position(x, y, main.Tile.FLOOR if collidable else main.Tile.WALL)
+            world.place_coins(3)
+            world.add_monsters(2)
+            self.assert_free_cells_match(world)
+
+        entities = world.coin_coordinates() + world.monster_coordinates()
+        self.assertEqual(len(set(entities)), 2000 - 200 + 120 + 500 + 80)
+        ys, xs = np.nonzero(~world.collidable_in_rect(0, 0, 130, 150))
+        occupied = set(entities)
+        expected = [cell for cell in zip(xs.tolist(), ys.tolist()) if cell not in occupied]
+        self.assertEqual(sorted(map(tuple, world.free_cells().tolist())), sorted(expected))
+
+    def test_new_games_keep_the_start_free(self):
+        # the player's start and eight floor cells around it
+        grid = np.ones((10, 10), dtype=np.uint8)
+        x, y = main.PLAYER_START
+        grid[y - 1:y + 2, x - 1:x + 2] = 0
+        for seed in range(10):
+            simulation = main.Simulation.new_game(grid, coin_count=5, monster_count=3, seed=seed)
+            world = simulation.world
+            entities = world.coin_coordinates() + world.monster_coordinates()
+            self.assertNotIn(main.PLAYER_START, entities)
+            self.assertEqual(len(set(entities)), 8)
+            self.assert_free_cells_match(world)
+        with self.assertRaises(ValueError):
+            main.Simulation.new_game(grid, coin_count=5, monster_count=4, seed=0)
+
+
+class CollisionTest(unittest.TestCase):
+    def test_player_collects_the_coins_it_enters(self):
+        world = main.World(np.zeros((1, 4), dtype=np.uint8), seed=0)
+        world.place_coins(4)
+        player = main.Player(main.ROBOT_SPRITE, 0, 0, speed=main.TICKS_PER_SECOND)
+        simulation = main.Simulation(world, player, 4)
+        simulation.tick()
+        self.assertEqual(simulation.coin_count, 1)
+
+        simulation.queue_key(main.pygame.K_RIGHT, True)
+        for x in range(1, 4):
+            simulation.tick()
+            self.assertEqual((player.x_pos, simulation.coin_count), (x, x + 1))
+        simulation.queue_key(main.pygame.K_RIGHT, False)
+        simulation.advance(5)
+        self.assertEqual(simulation.coin_count, 4)
+        self.assertEqual(world.coin_coordinates(), [])
+        self.assertEqual(world.pop_entered_cells(), [])
+
+    def test_entering_a_monster_ends_the_game(self):
+        world = main.World(np.array([[1, 0]], dtype=np.uint8), seed=0)
+        world.add_monsters(1)
+        world.set_tile_at_position(0, 0, main.Tile.FLOOR)
+        player = main.Player(main.ROBOT_SPRITE, 0, 0)
+        simulation = main.Simulation(world, player, 0)
+        simulation.tick()
+        self.assertFalse(simulation.game_over)
+
+        simulation.queue_key(main.pygame.K_RIGHT, True)
+        simulation.tick()
+        self.assertEqual(player.x_pos, 1)
+        self.assertTrue(simulation.game_over)
+
+
+class FlowFieldTest(unittest.TestCase):
+    def test_paths_follow_breadth_first_distances(self):
+        rng = np.random.default_rng(0)
+        grid = (rng.random((35, 40)) < 0.3).astype(np.uint8)
+        world = main.World(grid)
+        for target_x, target_y in [(20, 17), (0, 0), (39, 3)]:
+            world.set_tile_at_position(target_x, target_y, main.Tile.FLOOR)
+            distances = {(target_x, target_y): 0}
+            frontier = [(target_x, target_y)]
+            while frontier:
+                x, y = frontier.pop(0)
+                for dx, dy in main.DIRECTIONS:
+                    cell = (x + dx, y + dy)
+                    if cell not in distances and not world.is_collidable_at_position(*cell):
+                        distances[cell] = distances[(x, y)] + 1
+                        frontier.append(cell)
+
+            field = world.flow_field(target_x, target_y, 12)
+            ys, xs = np.mgrid[0:35, 0:40]
+            directions = field.directions_at(xs, ys)
+            for y in range(35):
+                for x in range(40):
+                    distance = distances.get((x, y), -1)
+                    expected = distance if distance <= 12 else -1
+                    self.assertEqual(field.distance_at(x, y), expected, (x, y))
+                    # following the directions takes a shortest path
+                    path_x, path_y = x, y
+                    for _ in range(max(expected, 0)):
+                        dx, dy = main.DIRECTIONS[directions[path_y, path_x]]
+                        path_x, path_y = path_x + dx, path_y + dy
+                        self.assertFalse(world.is_collidable_at_position(path_x, path_y))
+                    if expected >= 0:
+                        self.assertEqual((path_x, path_y), (target_x, target_y))
+
+
+class MapgenTest(unittest.TestCase):
+    def test_mazes_are_connected(self):
+        for width, height, corridor_width, seed in [(41, 31, 4, 0), (64, 50, 2, 3), (13, 9, 1, 7)]:
+            grid = mapgen.generate_maze(width, height, corridor_width, seed)
+            self.assertEqual(grid.shape, (height, width))
+            self.assertTrue((grid[0] == mapgen.WALL).all() and (grid[:, 0] == mapgen.WALL).all())
+            floor = {(x, y) for y, x in zip(*np.nonzero(grid == mapgen.FLOOR))}
+            start = min(floor)
+            reached = {start}
+            frontier = [start]
+            while frontier:
+                x, y = frontier.pop()
+                for dx, dy in main.DIRECTIONS:
+                    cell = (x + dx, y + dy)
+                    if cell in floor and cell not in reached:
+                        reached.add(cell)
+                        frontier.append(cell)
+            self.assertEqual(reached, floor)
+
+    def test_cached_mazes_are_identical(self):
+        cache_dir = tempfile.mkdtemp()
+        grid = mapgen.cached_maze(60, 45, 3, 5, cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        with patch.object(mapgen, "generate_maze") as generate_maze:
+            cached = mapgen.cached_maze(60, 45, 3, 5, cache_dir)
+        generate_maze.assert_not_called()
+        self.assertEqual(cached.dtype, grid.dtype)
+        self.assertTrue((cached == grid).all())
+        self.assertTrue((grid == mapgen.generate_maze(60, 45, 3, 5)).all())
+
+    def test_unwritable_cache_is_skipped(self):
+        blocker = os.path.join(tempfile.mkdtemp(), "file")
+        with open(blocker, "w"):
+            pass
+        grid = mapgen.cached_maze(30, 30, 4, 1, os.path.join(blocker, "cache"))
+        self.assertTrue((grid == mapgen.generate_maze(30, 30, 4, 1)).all())
+
+
+class ChunkedTileGridTest(unittest.TestCase):
+    def test_map_files_page_in_the_saved_tiles(self):
+        rng = np.random.default_rng(0)
+        tiles = (rng.random((100, 150)) < 0.3).astype(np.uint8)
+        path = os.path.join(tempfile.mkdtemp(), "world.map")
+        main.ChunkedTileGrid.from_array(tiles, chunk_size=32).save(path)
+        grid = main.ChunkedTileGrid.open(path, cache_size=2)
+        self.assertEqual((grid.width, grid.height, grid.chunk_size), (150, 100, 32))
+        self.assertEqual(
+            grid.passable_counts().tolist(),
+            main.ChunkedTileGrid.from_array(tiles, chunk_size=32).passable_counts().tolist(),
+        )
+
+        # an edited chunk stays in memory while others are paged in and out
+        grid.set(40, 50, 1 - int(tiles[50, 40]))
+        tiles[50, 40] = 1 - tiles[50, 40]
+        for _ in range(50):
+            x, y = (int(v) for v in rng.integers(0, (150, 100)))
+            self.assertEqual(grid.get(x, y), tiles[y, x])
+            self.assertLessEqual(len(grid._resident), 2)
+        xs = rng.integers(0, 150, 500)
+        ys = rng.integers(0, 100, 500)
+        self.assertEqual(grid.gather(xs, ys).tolist(), tiles[ys, xs].tolist())
+        self.assertEqual(grid.rect(13, 7, 120, 90).tolist(), tiles[7:97, 13:133].tolist())
+
+        # edits are never written back to the file
+        reopened = main.ChunkedTileGrid.open(path)
+        self.assertEqual(reopened.get(40, 50), 1 - tiles[50, 40])
+
+
+class MonsterLodTest(unittest.TestCase):
+    def test_monsters_the_camera_can_draw_move(self):
+        world = main.World(np.zeros((400, 400), dtype=np.uint8), seed=0)
+        world.add_monsters(20000)
+        sprites = [main.pygame.Surface((4, 4))] * 3
+        camera = main.Camera(main.CAMERA_WIDTH, main.CAMERA_HEIGHT, world, main.TILE_SIZE, sprites)
+        camera.set_zoom(main.ZOOM_LEVELS - 1)
+        monsters = world._monsters
+        for target in [(200, 200), (128, 130), (255, 191), (64, 335)]:
+            world.move_monsters(target)
+            camera.center_on_point(*target)
+            drawn = monsters.in_rect(
+                camera.pos_x - 1, camera.pos_y - 1, camera._width + 3, camera._height + 3
+            )
+            self.assertTrue((monsters.steps[drawn] == world._monster_steps).all(), target)
+
+    def test_sleeping_monsters_catch_up(self):
+        world = main.World(np.zeros((400, 400), dtype=np.uint8), seed=0)
+        world.add_monsters(20000)
+        monsters = world._monsters
+        far = monsters.in_rect(320, 320, 80, 80)
+        xs = monsters.x[far].copy()
+        ys = monsters.y[far].copy()
+        for _ in range(5):
+            world.move_monsters((10, 10))
+        self.assertEqual(monsters.x[far].tolist(), xs.tolist())
+        self.assertEqual(monsters.y[far].tolist(), ys.tolist())
+        self.assertTrue((monsters.steps[far] == 0).all())
+
+        world.move_monsters((360, 360))
+        self.assertTrue((monsters.steps[far] == 6).all())
+        moved = (monsters.x[far] != xs) | (monsters.y[far] != ys)
+        self.assertGreater(moved.mean(), 0.5)
+
+
+class EntityStoreTest(unittest.TestCase):
+    def test_store_matches_a_dict_of_entities(self):
+        rng = np.random.default_rng(0)
+        store = main.EntityStore(150, 140)
+        entities = {}
+        for _ in range(40):
+            cells = rng.choice(150 * 140, 30, replace=False)
+            cells = np.array(
+                [cell for cell in cells.tolist() if cell not in entities], dtype=np.int64
+            )
+            sprite = int(rng.integers(0, 5))
+            store.add(cells % 150, cells // 150, sprite)
+            entities.update((cell, sprite) for cell in cells.tolist())
+            for cell in rng.choice(150 * 140, 20).tolist():
+                self.assertEqual(store.remove_at(cell), entities.pop(cell, None) is not None)
+
+            self.assertEqual(len(store), len(entities))
+            cells = store.y.astype(np.int64) * 150 + store.x
+            self.assertEqual(dict(zip(cells.tolist(), store.sprites.tolist())), entities)
+            probe = rng.integers(0, 150 * 140, 200)
+            self.assertEqual(
+                store.occupied(probe % 150, probe // 150).tolist(),
+                [cell in entities for cell in probe.tolist()],
+            )
+            x, y = (int(v) for v in rng.integers(-20, 150, 2))
+            found = store.in_rect(x, y, 70, 50)
+            self.assertEqual(found.tolist(), sorted(found.tolist()))
+            self.assertEqual(
+                sorted(cells[found].tolist()),
+                sorted(c for c in entities if x <= c % 150 < x + 70 and y <= c // 150 < y + 50),
+            )
+
+    def test_arrays_and_copies_are_independent(self):
+        store = main.EntityStore(100, 80)
+        store.add(np.array([5, 70, 99]), np.array([3, 79, 0]), 2)
+        restored = main.EntityStore.from_arrays(100, 80, store.to_arrays())
+        copy = store.copy()
+        store.remove_at(3 * 100 + 5)
+        store.add(np.array([1]), np.array([1]), 4)
+        for other in (restored, copy):
+            self.assertEqual(other.x.tolist(), [5, 70, 99])
+            self.assertEqual(other.y.tolist(), [3, 79, 0])
+            self.assertEqual(other.sprites.tolist(), [2, 2, 2])
+            occupied = other.occupied(np.array([5, 1]), np.array([3, 1]))
+            self.assertEqual(occupied.tolist(), [True, False])
+
+
+class SpriteAtlasTest(unittest.TestCase):
+    def assert_same_atlas(self, atlas, other):
+        for name in main.SPRITE_NAMES:
+            self.assertEqual(atlas.region(name), other.region(name))
+        self.assertEqual(
+            main.pygame.image.tobytes(atlas.surface, "RGBA"),
+            main.pygame.image.tobytes(other.surface, "RGBA"),
+        )
+
+    def test_saved_atlases_open_unchanged(self):
+        cache_dir = tempfile.mkdtemp()
+        atlas = main.SpriteAtlas.load(main.SPRITE_NAMES, cache_dir=cache_dir)
+        path = os.path.join(cache_dir, "saved.bin")
+        atlas.save(path)
+        self.assert_same_atlas(main.SpriteAtlas.open(path), atlas)
+
+        with patch.object(main.SpriteAtlas, "pack") as pack:
+            cached = main.SpriteAtlas.load(main.SPRITE_NAMES, cache_dir=cache_dir)
+        pack.assert_not_called()
+        self.assert_same_atlas(cached, atlas)
+
+    def test_unwritable_cache_is_skipped(self):
+        blocker = os.path.join(tempfile.mkdtemp(), "file")
+        with open(blocker, "w"):
+            pass
+        atlas = main.SpriteAtlas.load(main.SPRITE_NAMES, cache_dir=os.path.join(blocker, "cache"))
+        self.assertEqual(len(atlas.sprites(main.SPRITE_NAMES)), len(main.SPRITE_NAMES))
+
+
+class MonsterSwarmTest(unittest.TestCase):
+    def test_seeded_steps_are_deterministic(self):
+        rng = np.random.default_rng(0)
+        walls = rng.random((150, 200)) < 0.2
+        cells = rng.choice(np.flatnonzero(~walls), 3000, replace=False)
+        swarms = []
+        for _ in range(2):
+            swarm = main.MonsterSwarm(200, 150)
+            swarm.add(cells % 200, cells // 200, 0)
+            step_rng = np.random.default_rng(7)
+            for _ in range(30):
+                swarm.step(step_rng, lambda xs, ys: walls[ys, xs])
+            swarms.append(swarm)
+
+        first, second = swarms
+        self.assertEqual(first.x.tolist(), second.x.tolist())
+        self.assertEqual(first.y.tolist(), second.y.tolist())
+        self.assertFalse(walls[first.y, first.x].any())
+        self.assertEqual(len(set(zip(first.x.tolist(), first.y.tolist()))), 3000)
+        # the chunk grids point at every monster and at nothing else
+        self.assertEqual(first._entities_at(first.x, first.y).tolist(), list(range(3000)))
+        self.assertEqual(len(first.in_rect(0, 0, 200, 150)), 3000)
+
+def play(simulation, ticks, seed):
+    # holds a random movement key for every 13 ticks, returning the state
+    # of the game after each tick
+    rng = random.Random(seed)
+    held = None
+    states = []
+    for tick in range(ticks):
+        if tick % 13 == 0:
+            if held is not None:
+                simulation.queue_key(held, False)
+            held = rng.choice(list(main.MOVEMENT_KEYS))
+            simulation.queue_key(held, True)
+        simulation.tick()
+        world = simulation.world
+        states.append((
+            simulation.tick_count,
+            simulation.coin_count,
+            simulation.game_over,
+            simulation.player.x_pos,
+            simulation.player.y_pos,
+            world.monster_coordinates(),
+            sorted(world.coin_coordinates()),
+            world._free_counts.tolist(),
+        ))
+    return states
+
+
+class SnapshotTest(unittest.TestCase):
+    def test_bytes_round_trip(self):
+        simulation = main.Simulation.new_game(seed=2)
+        play(simulation, 40, 0)
+        snapshot = main.GameSnapshot.capture(simulation)
+        data = snapshot.to_bytes()
+        self.assertEqual(main.GameSnapshot.from_bytes(data).to_bytes(), data)
+
+    def test_restored_games_play_on_identically(self):
+        simulation = main.Simulation.new_game(seed=3)
+        play(simulation, 57, 1)
+        snapshot = main.GameSnapshot.capture(simulation)
+        expected = play(simulation, 200, 2)
+
+        loaded = main.GameSnapshot.from_bytes(snapshot.to_bytes())
+        self.assertEqual(play(loaded.restore(), 200, 2), expected)
+        self.assertEqual(play(loaded.restore(), 200, 2), expected)
+
+
+class ReplayTest(unittest.TestCase):
+    def test_replay_reproduces_the_game(self):
+        path = os.path.join(tempfile.mkdtemp(), "game.rec")
+        recorder = main.InputRecorder(path, 5)
+        game = main.GameApplication(seed=5, headless=True, recorder=recorder)
+        rng = random.Random(5)
+        held = set()
+        for frame in range(1500):
+            events = []
+            if rng.random() < 0.05:
+                key = rng.choice(list(main.MOVEMENT_KEYS))
+                kind = main.pygame.KEYUP if key in held else main.pygame.KEYDOWN
+                held ^= {key}
+                events.append(main.pygame.event.Event(kind, key=key))
+            game.step(events, delta=rng.choice([5, 16, 17, 33]))
+            if game.game_over:
+                break
+        game.quit()
+
+        recording = main.InputRecording.open(path)
+        simulation = recording.new_game()
+        recording.run(simulation)
+        self.assertTrue(recording.matches(simulation))
+        self.assertEqual(simulation.tick_count, game.simulation.tick_count)
+        self.assertEqual(
+            simulation.world.monster_coordinates(), game.world.monster_coordinates()
+        )
+        self.assertEqual(
+            sorted(simulation.world.coin_coordinates()), sorted(game.world.coin_coordinates())
+        )
+
+
+class FieldOfViewTest(unittest.TestCase):
+    def test_visibility_is_symmetric(self):
+        rng = np.random.default_rng(0)
+        for density in (0.1, 0.3):
+            world = main.World((rng.random((24, 24)) < density).astype(np.uint8))
+            for _ in range(20):
+                x, y = (int(v) for v in rng.integers(0, 24, 2))
+                if world.is_collidable_at_position(x, y):
+                    continue
+                view = main.FieldOfView(world, x, y, 6)
+                for local_y, local_x in zip(*np.nonzero(view.visible)):
+                    other_x = view.origin_x + int(local_x)
+                    other_y = view.origin_y + int(local_y)
+                    if world.is_collidable_at_position(other_x, other_y):
+                        continue
+                    other = main.FieldOfView(world, other_x, other_y, 6)
+                    self.assertTrue(other.is_visible(x, y), ((x, y), (other_x, other_y)))
+
+
+class MinimapTest(unittest.TestCase):
+    def test_updates_match_a_fresh_minimap(self):
+        for fog in (False, True):
+            simulation = main.Simulation.new_game(seed=1)
+            world = simulation.world
+            minimap = main.Minimap(world, fog=fog, refresh_frames=1)
+            rng = np.random.default_rng(0)
+            keys = list(main.MOVEMENT_KEYS)
+            for tick in range(600):
+                if tick % 20 == 0:
+                    for key in keys:
+                        simulation.queue_key(key, False)
+                    simulation.queue_key(keys[rng.integers(len(keys))], True)
+                simulation.tick()
+                if tick % 50 == 7:
+                    x = int(rng.integers(world.width))
+                    y = int(rng.integers(world.height))
+                    if not world._is_occupied(x, y):
+                        collidable = world.is_collidable_at_position(x, y)
+                        world.set_tile_at_position(
+                            x, y, main.Tile.FLOOR if collidable else main.Tile.WALL
+                        )
+                if fog:
+                    view = world.field_of_view(
+                        simulation.player.x_pos, simulation.player.y_pos, main.FOV_RADIUS
+                    )
+                    world.explore(view)
+                    minimap.explore(view)
+                minimap.update(simulation.player.x_pos, simulation.player.y_pos)
+
+            fresh = main.Minimap(world, fog=fog)
+            fresh.update(simulation.player.x_pos, simulation.player.y_pos)
+            self.assertTrue(
+                (main.pygame.surfarray.array3d(minimap.surface)
+                 == main.pygame.surfarray.array3d(fresh.surface)).all()
+            )
+
+
+class VectorGameTest(unittest.TestCase):
+    KEYS = (main.pygame.K_RIGHT, main.pygame.K_LEFT, main.pygame.K_DOWN, main.pygame.K_UP)
+
+    def start_like(self, simulation):
+        # a single vector game in the same state as the simulation, drawing
+        # the same random numbers
+        world = simulation.world
+        games = vecenv.VectorGame(
+            1, coin_count=len(world._coins), monster_count=len(world._monsters)
+        )
+        games.reset()
+        games._coins[0] = False
+        games._coins[0, self.cells(games, world._coins.x, world._coins.y)] = True
+        monsters = self.cells(games, world._monsters.x, world._monsters.y)
+        games._monster_grid[0] = False
+        games._monster_grid[0, monsters] = True
+        games._monsters[0] = monsters
+        games._rng.bit_generator.state = world._rng.bit_generator.state
+        return games
+
+    def cells(self, games, xs, ys):
+        pad = (games._row - games.width) // 2
+        return (np.asarray(ys) + pad) * games._row + np.asarray(xs) + pad
+
+    def test_matches_simulation(self):
+        move_ticks = round(main.TICKS_PER_SECOND / main.PLAYER_MOVEMENT_SPEED)
+        endings = 0
+        for seed in range(5):
+            simulation = main.Simulation.new_game(seed=seed)
+            games = self.start_like(simulation)
+            actions = np.random.default_rng(seed).integers(0, vecenv.ACTION_COUNT, 300)
+            for action in actions.tolist():
+                coins = simulation.coin_count
+                if action > 0:
+                    simulation.queue_key(self.KEYS[action - 1], True)
+                    simulation.queue_key(self.KEYS[action - 1], False)
+                simulation.advance(move_ticks)
+                _, rewards, dones = games.step(np.array([action]))
+
+                self.assertEqual(bool(dones[0]), simulation.game_over)
+                self.assertEqual(rewards[0], simulation.coin_count - coins)
+                if simulation.game_over:
+                    endings += 1
+                    break
+                world = simulation.world
+                player = simulation.player
+                self.assertEqual(games._players[0], self.cells(games, player.x_pos, player.y_pos))
+                self.assertEqual(
+                    games._monsters[0].tolist(),
+                    self.cells(games, world._monsters.x, world._monsters.y).tolist(),
+                )
+                self.assertEqual(
+                    np.flatnonzero(games._coins[0]).tolist(),
+                    sorted(self.cells(games, world._coins.x, world._coins.y).tolist()),
+                )
+        self.assertGreater(endings, 0)
+
+    def test_walking_into_a_monster_ends_the_game(self):
+        games = vecenv.VectorGame(1, seed=0, coin_count=0, monster_count=1)
+        games.reset()
+        monster = games._players[0] + 1
+        games._monster_grid[0] = False
+        games._monster_grid[0, monster] = True
+        games._monsters[0] = monster
+        # the monsters move on this step, which must not save the player
+        games.steps[:] = games.monster_period - 1
+        _, _, dones = games.step(np.array([1]))
+        self.assertTrue(dones[0])
+
+
+class SweepTest(unittest.TestCase):
+    def test_same_arguments_play_the_same_games(self):
+        args = argparse.Namespace(
+            coins=[10], monsters=[2, 5], sizes=[32], speeds=[main.PLAYER_MOVEMENT_SPEED],
+            games=2, player="random", max_ticks=300, seed=3,
+        )
+        tasks = sweep.make_tasks(args)
+        self.assertEqual(len(tasks), 4)
+        self.assertEqual(len({task["seed"] for task in tasks}), 4)
+        rows = [sweep.play_game(task) for task in tasks]
+        self.assertEqual([sweep.play_game(task) for task in sweep.make_tasks(args)], rows)
+        size = (len(main.MAP[0]), len(main.MAP))
+        for row in rows:
+            self.assertEqual(set(row), set(sweep.RESULT_FIELDS))
+            self.assertEqual((row["map_width"], row["map_height"]), size)
+
 if __name__ == '__main__':
     unittest.main()